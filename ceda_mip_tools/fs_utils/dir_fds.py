@@ -0,0 +1,255 @@
+"""
+Filesystem operations made relative to open directory file descriptors,
+so that the kernel does not have to resolve the whole of a deep path (such
+as a CMIP6 DRS path) for every call.
+"""
+
+import os
+import stat
+import resource
+import threading
+import collections
+
+
+# open the directories with these flags (O_PATH would do, but not all of
+# the *at() calls accept it)
+_open_flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) | getattr(os, 'O_CLOEXEC', 0)
+
+_have_dir_fd = all(func in os.supports_dir_fd
+                   for func in (os.stat, os.open, os.rename, os.mkdir, os.access, os.readlink,
+                                os.link, os.unlink))
+
+
+class DirFDCache(object):
+    """
+    Keeps directory file descriptors open for the directories most recently
+    used, up to max_open of them (and at most a quarter of the process's
+    limit on open files), closing the least recently used when the limit is
+    reached.  A directory is opened relative to its parent if that is open.
+
+    Each operation is done on the last component of the path, relative to
+    the descriptor of its parent directory, so paths with symbolic links as
+    their last component behave as the plain os functions.  Where the
+    platform does not support dir_fd, the plain path is used.
+
+    A descriptor refers to the directory itself rather than to its path, so
+    directories renamed or removed through this object are forgotten.  If
+    an operation finds nothing where a directory on the way to it has been
+    removed by other means (e.g. removed and created again), the descriptor
+    is reopened and the operation retried; but a directory renamed by other
+    means is not noticed, so a long-running user should close() the cache
+    from time to time.  The descriptors are shared between threads (the
+    calls are serialised).
+
+    As with os.path, exists(), isdir(), isfile() and islink() return False
+    for paths that cannot be stat-ed for any reason.
+    """
+
+    def __init__(self, max_open=256):
+        soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if soft_limit != resource.RLIM_INFINITY:
+            max_open = min(max_open, soft_limit // 4)
+        # (rename needs two open at once)
+        self._max_open = max(2, max_open)
+        self._fds = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.enabled = _have_dir_fd
+
+
+    def _get_fd(self, dir_path):
+        "returns the descriptor for a directory (with the lock held), opening it if needed"
+        try:
+            fd = self._fds[dir_path]
+        except KeyError:
+            pass
+        else:
+            self._fds.move_to_end(dir_path)
+            return fd
+
+        parent, name = os.path.split(dir_path)
+        parent_fd = self._fds.get(parent) if name else None
+        if parent_fd != None:
+            fd = os.open(name, _open_flags, dir_fd=parent_fd)
+        else:
+            fd = os.open(dir_path, _open_flags)
+        self._fds[dir_path] = fd
+        while len(self._fds) > self._max_open:
+            os.close(self._fds.popitem(last=False)[1])
+        return fd
+
+
+    def _split(self, path):
+        "returns (absolute parent directory, last component) of a path"
+        dir_path, name = os.path.split(os.path.abspath(path))
+        return dir_path, name
+
+
+    def _forget_removed(self, dir_path):
+        """
+        closes the descriptors (if open) for the directory and those above
+        it which have been removed, with any below them; returns whether
+        there were any
+        """
+        removed = False
+        path = dir_path
+        while True:
+            fd = self._fds.get(path)
+            if fd != None and os.fstat(fd).st_nlink == 0:
+                self._forget(path)
+                removed = True
+            parent = os.path.dirname(path)
+            if parent == path:
+                return removed
+            path = parent
+
+
+    def _with_fds(self, dir_paths, op):
+        """
+        calls op(*descriptors of the directories) with the lock held, and
+        again with fresh descriptors if it raises FileNotFoundError and one
+        of the directories (or one above) turns out to have been removed
+        """
+        with self._lock:
+            try:
+                return op(*[self._get_fd(dir_path) for dir_path in dir_paths])
+            except FileNotFoundError:
+                if not any([self._forget_removed(dir_path) for dir_path in dir_paths]):
+                    raise
+            return op(*[self._get_fd(dir_path) for dir_path in dir_paths])
+
+
+    def _call(self, func, path, *args, **kwargs):
+        "calls func(last component, *args, dir_fd=parent descriptor, **kwargs)"
+        if not self.enabled:
+            return func(path, *args, **kwargs)
+        dir_path, name = self._split(path)
+        if not name:
+            # the root directory
+            return func(path, *args, **kwargs)
+        return self._with_fds([dir_path],
+                              lambda fd: func(name, *args, dir_fd=fd, **kwargs))
+
+
+    def stat(self, path, follow_symlinks=True):
+        return self._call(os.stat, path, follow_symlinks=follow_symlinks)
+
+
+    def lstat(self, path):
+        return self.stat(path, follow_symlinks=False)
+
+
+    def exists(self, path):
+        try:
+            self.stat(path)
+        except (OSError, ValueError):
+            return False
+        return True
+
+
+    def isdir(self, path):
+        try:
+            return stat.S_ISDIR(self.stat(path).st_mode)
+        except (OSError, ValueError):
+            return False
+
+
+    def isfile(self, path):
+        try:
+            return stat.S_ISREG(self.stat(path).st_mode)
+        except (OSError, ValueError):
+            return False
+
+
+    def islink(self, path):
+        try:
+            return stat.S_ISLNK(self.lstat(path).st_mode)
+        except (OSError, ValueError):
+            return False
+
+
+    def readlink(self, path):
+        return self._call(os.readlink, path)
+
+
+    def access(self, path, mode):
+        return self._call(os.access, path, mode)
+
+
+    def mkdir(self, path, mode=0o777):
+        self._call(os.mkdir, path, mode)
+
+
+    def makedirs(self, path, mode=0o777):
+        "as os.makedirs (with exist_ok=False), creating each directory relative to its parent"
+        parent = os.path.dirname(os.path.abspath(path))
+        if not self.exists(parent):
+            self.makedirs(parent, mode)
+        self.mkdir(path, mode)
+
+
+    def rename(self, src, dst, is_dir=None):
+        """
+        as os.rename; if src is a directory, any open descriptors for it
+        (and for a directory it replaces) and those below are closed.
+        is_dir says whether src is a directory, if the caller knows;
+        otherwise it is lstat-ed to find out.
+        """
+        if not self.enabled:
+            os.rename(src, dst)
+            return
+        src_dir, src_name = self._split(src)
+        dst_dir, dst_name = self._split(dst)
+
+        def op(src_fd, dst_fd):
+            src_is_dir = is_dir
+            if src_is_dir == None:
+                src_is_dir = stat.S_ISDIR(os.stat(src_name, dir_fd=src_fd,
+                                                  follow_symlinks=False).st_mode)
+            os.rename(src_name, dst_name, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+            return src_is_dir
+
+        with self._lock:
+            # (only directories can have descriptors to close, and looking
+            # for them goes through all those that are open)
+            if self._with_fds([src_dir, dst_dir], op):
+                self._forget(os.path.join(src_dir, src_name))
+                self._forget(os.path.join(dst_dir, dst_name))
+
+
+    def link(self, src, dst):
+        "as os.link (not following a symbolic link at src)"
+        if not self.enabled:
+            os.link(src, dst, follow_symlinks=False)
+            return
+        src_dir, src_name = self._split(src)
+        dst_dir, dst_name = self._split(dst)
+        self._with_fds([src_dir, dst_dir],
+                       lambda src_fd, dst_fd: os.link(src_name, dst_name,
+                                                      src_dir_fd=src_fd, dst_dir_fd=dst_fd,
+                                                      follow_symlinks=False))
+
+
+    def remove(self, path):
+        self._call(os.unlink, path)
+
+
+    def _forget(self, dir_path):
+        "closes any descriptors for the directory and those below it"
+        prefix = dir_path.rstrip('/') + '/'
+        for path in [path for path in self._fds
+                     if path == dir_path or path.startswith(prefix)]:
+            os.close(self._fds.pop(path))
+
+
+    def close(self):
+        with self._lock:
+            while self._fds:
+                os.close(self._fds.popitem()[1])
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
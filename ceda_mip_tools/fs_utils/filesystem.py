@@ -0,0 +1,55 @@
+"""
+Filesystem access used by the tools, so that it can be served from
+somewhere other than the live filesystem (e.g. a scan manifest).
+"""
+
+import os
+
+
+class LocalFilesystem(object):
+    """
+    Filesystem operations on the live filesystem.  If dir_fds (a
+    dir_fds.DirFDCache) is given, single-path operations are made relative
+    to open directory file descriptors.
+    """
+
+    def __init__(self, dir_fds=None):
+        self._dir_fds = dir_fds
+
+    def stat(self, path):
+        if self._dir_fds:
+            return self._dir_fds.stat(path)
+        return os.stat(path)
+
+    def islink(self, path):
+        if self._dir_fds:
+            return self._dir_fds.islink(path)
+        return os.path.islink(path)
+
+    def readlink(self, path):
+        if self._dir_fds:
+            return self._dir_fds.readlink(path)
+        return os.readlink(path)
+
+    def isdir(self, path):
+        if self._dir_fds:
+            return self._dir_fds.isdir(path)
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        if self._dir_fds:
+            return self._dir_fds.isfile(path)
+        return os.path.isfile(path)
+
+    def walk(self, top):
+        return os.walk(top)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def get_attributes(self, path):
+        """
+        Returns a dictionary of netCDF global attributes of a file if these
+        are already known without opening it, otherwise None
+        """
+        return None
@@ -0,0 +1,285 @@
+"""
+Scan manifest: a snapshot of the metadata of the files in one or more
+directory trees (and optionally their netCDF global attributes), stored in
+an SQLite database, so that several tools can use one scan instead of each
+stat-ing the same files.
+"""
+
+import os
+import json
+import stat
+import sqlite3
+import urllib.request
+
+from ceda_mip_tools.fs_utils.filesystem import LocalFilesystem
+
+
+# size of the memory map used for reading the database
+_mmap_size = 1 << 30
+
+# number of entries to insert per statement batch while scanning
+_insert_batch_size = 10000
+
+
+def read_netcdf_attributes(path, names):
+    """
+    Returns a dictionary of the named global attributes of a netCDF file
+    (None for any which are absent)
+    """
+    import netCDF4
+    with netCDF4.Dataset(path) as ds:
+        return dict((name, getattr(ds, name, None)) for name in names)
+
+
+class ScanManifest(object):
+    """
+    An SQLite database with one row per file, directory or symbolic link,
+    holding its path, size, mtime, ctime, mode, uid, gid, inode and device
+    (from stat, i.e. following symbolic links), plus the netCDF attributes
+    if these were read.
+    """
+
+    _schema = [
+        """CREATE TABLE IF NOT EXISTS entries (
+               path TEXT PRIMARY KEY,
+               parent TEXT NOT NULL,
+               name TEXT NOT NULL,
+               kind TEXT NOT NULL,
+               size INTEGER,
+               mtime REAL,
+               ctime REAL,
+               mode INTEGER,
+               uid INTEGER,
+               gid INTEGER,
+               inode INTEGER,
+               dev INTEGER,
+               link_target TEXT,
+               attributes TEXT)""",
+
+        """CREATE INDEX IF NOT EXISTS entries_by_parent ON entries (parent)""",
+        ]
+
+    # values of the 'kind' column
+    FILE = 'f'
+    DIR = 'd'
+    LINK = 'l'
+
+    def __init__(self, path, readonly=True):
+        if readonly:
+            if not os.path.exists(path):
+                raise IOError("manifest {} does not exist".format(path))
+            uri = 'file:{}?mode=ro'.format(urllib.request.pathname2url(os.path.abspath(path)))
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._conn:
+                for statement in self._schema:
+                    self._conn.execute(statement)
+        self._conn.execute('PRAGMA mmap_size = {}'.format(_mmap_size))
+
+
+    def close(self):
+        self._conn.close()
+
+
+    def _norm(self, path):
+        return os.path.normpath(os.path.abspath(path))
+
+
+    def _get_row(self, path):
+        return self._conn.execute(
+            "SELECT kind, size, mtime, ctime, mode, uid, gid, inode, dev, link_target, attributes "
+            "FROM entries WHERE path = ?", (self._norm(path),)).fetchone()
+
+
+    def _row_to_stat(self, row):
+        kind, size, mtime, ctime, mode, uid, gid, inode, dev = row[:9]
+        if mode == None:
+            # a dangling symbolic link
+            return None
+        return os.stat_result((mode, inode, dev, 1, uid, gid, size, mtime, mtime, ctime))
+
+
+    def get_stat(self, path):
+        "Returns an os.stat_result for the path, or None if it is not in the manifest"
+        row = self._get_row(path)
+        return self._row_to_stat(row) if row else None
+
+
+    def get_kind(self, path):
+        "Returns the kind of entry (FILE, DIR or LINK), or None if it is not in the manifest"
+        row = self._get_row(path)
+        return row[0] if row else None
+
+
+    def get_link_target(self, path):
+        row = self._get_row(path)
+        return row[9] if row else None
+
+
+    def get_attributes(self, path):
+        "Returns the dictionary of netCDF attributes recorded for a file, or None"
+        row = self._get_row(path)
+        if row and row[10] != None:
+            return json.loads(row[10])
+        return None
+
+
+    def contains_dir(self, path):
+        return self.get_kind(path) == self.DIR
+
+
+    def listdir(self, path):
+        "Like os.listdir, but using the manifest"
+        return [name for name, in self._conn.execute(
+                "SELECT name FROM entries WHERE parent = ? ORDER BY name", (self._norm(path),))]
+
+
+    def walk(self, top):
+        """
+        Like os.walk (top-down), but using the manifest.  Symbolic links to
+        directories are listed as directories but not followed.  The dirs
+        list may be modified in place to prune the walk.
+        """
+        stack = [self._norm(top)]
+        while stack:
+            root = stack.pop()
+            dirs = []
+            files = []
+            real_dirs = set()
+            for name, kind, mode in self._conn.execute(
+                    "SELECT name, kind, mode FROM entries WHERE parent = ? ORDER BY name", (root,)):
+                if kind == self.DIR:
+                    dirs.append(name)
+                    real_dirs.add(name)
+                elif kind == self.LINK and mode != None and stat.S_ISDIR(mode):
+                    dirs.append(name)
+                else:
+                    files.append(name)
+            yield root, dirs, files
+            stack.extend(os.path.join(root, name) for name in reversed(dirs)
+                         if name in real_dirs)
+
+
+    def _entry_row(self, path, lstat_data, get_attributes):
+        "returns the database row for a path, given the result of lstat"
+        link_target = None
+        if stat.S_ISLNK(lstat_data.st_mode):
+            kind = self.LINK
+            link_target = os.readlink(path)
+            try:
+                s = os.stat(path)
+            except OSError:
+                s = None
+        else:
+            kind = self.DIR if stat.S_ISDIR(lstat_data.st_mode) else self.FILE
+            s = lstat_data
+
+        attributes = None
+        if get_attributes and s and stat.S_ISREG(s.st_mode) and path.endswith('.nc'):
+            try:
+                attributes = json.dumps(get_attributes(path), default=str)
+            except Exception as exc:
+                print("warning: could not read attributes of {}: {}".format(path, exc))
+
+        parent, name = os.path.split(path)
+        if s:
+            return (path, parent, name, kind, s.st_size, s.st_mtime, s.st_ctime,
+                    s.st_mode, s.st_uid, s.st_gid, s.st_ino, s.st_dev, link_target, attributes)
+        else:
+            return (path, parent, name, kind) + (None,) * 8 + (link_target, attributes)
+
+
+    def _scan_tree(self, top):
+        "yields (path, lstat_result) for everything under top (including top itself)"
+        yield top, os.lstat(top)
+        stack = [top]
+        while stack:
+            dirname = stack.pop()
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    lstat_data = entry.stat(follow_symlinks=False)
+                    yield entry.path, lstat_data
+                    if stat.S_ISDIR(lstat_data.st_mode):
+                        stack.append(entry.path)
+
+
+    def _insert(self, rows):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+    def scan(self, tops, get_attributes=None):
+        """
+        Records everything under the given directories (or files) in the
+        manifest.  If get_attributes is given, it is called with the path of
+        each *.nc file to get a dictionary of attributes to record.
+        Returns the number of entries recorded.
+        """
+        count = 0
+        rows = []
+        for top in tops:
+            for path, lstat_data in self._scan_tree(self._norm(top)):
+                rows.append(self._entry_row(path, lstat_data, get_attributes))
+                if len(rows) >= _insert_batch_size:
+                    self._insert(rows)
+                    count += len(rows)
+                    rows = []
+        self._insert(rows)
+        count += len(rows)
+        return count
+
+
+class ManifestFilesystem(LocalFilesystem):
+    """
+    Filesystem operations answered from a scan manifest where possible,
+    falling back to the live filesystem for paths not in the manifest.
+    """
+
+    def __init__(self, manifest):
+        self._manifest = manifest
+
+    def stat(self, path):
+        s = self._manifest.get_stat(path)
+        return s if s else os.stat(path)
+
+    def islink(self, path):
+        kind = self._manifest.get_kind(path)
+        return kind == ScanManifest.LINK if kind else os.path.islink(path)
+
+    def readlink(self, path):
+        target = self._manifest.get_link_target(path)
+        return target if target != None else os.readlink(path)
+
+    def isdir(self, path):
+        s = self._manifest.get_stat(path)
+        return stat.S_ISDIR(s.st_mode) if s else os.path.isdir(path)
+
+    def isfile(self, path):
+        s = self._manifest.get_stat(path)
+        return stat.S_ISREG(s.st_mode) if s else os.path.isfile(path)
+
+    def walk(self, top):
+        if self._manifest.contains_dir(top):
+            return self._manifest.walk(top)
+        return os.walk(top)
+
+    def listdir(self, path):
+        if self._manifest.contains_dir(path):
+            return self._manifest.listdir(path)
+        return os.listdir(path)
+
+    def get_attributes(self, path):
+        return self._manifest.get_attributes(path)
+
+
+def get_filesystem(manifest_path=None, dir_fds=None):
+    """
+    Returns a ManifestFilesystem if a manifest path is given, otherwise a
+    LocalFilesystem (using the dir_fds.DirFDCache if given)
+    """
+    if manifest_path:
+        return ManifestFilesystem(ScanManifest(manifest_path))
+    return LocalFilesystem(dir_fds)
@@ -0,0 +1,82 @@
+"""
+Scans directory trees into a manifest file recording the metadata of every
+file (and the netCDF global attributes used to make dataset IDs), which can
+then be passed to restructure-for-cmip6, add-to-mip, mip-pipeline and
+mip-dataset-status with --manifest instead of them each scanning the
+filesystem.
+"""
+
+import os
+import sys
+import argparse
+
+from ceda_mip_tools.fs_utils.manifest import ScanManifest, read_netcdf_attributes
+
+
+# netCDF attributes recorded in addition to those needed for dataset IDs
+_extra_attributes = ['tracking_id']
+
+
+class MIPScanner(object):
+
+    def _parse_args(self, arg_list=None):
+
+        parser = argparse.ArgumentParser(description=__doc__)
+
+        parser.add_argument('-o', '--output',
+                            metavar='path',
+                            required=True,
+                            help='path of manifest file to write')
+
+        parser.add_argument('-O', '--overwrite',
+                            action='store_true',
+                            help='permit overwriting of existing manifest file')
+
+        parser.add_argument('-a', '--append',
+                            action='store_true',
+                            help='add to (or update) an existing manifest file')
+
+        parser.add_argument('--no-attributes',
+                            action='store_true',
+                            help='do not read netCDF attributes (only record file metadata)')
+
+        parser.add_argument('paths', nargs='+',
+                            metavar='path',
+                            help='one or more directories (or files) to scan')
+
+        args = parser.parse_args(arg_list or sys.argv[1:])
+
+        if os.path.exists(args.output) and not (args.overwrite or args.append):
+            parser.error(f"Output file '{args.output}' already exists")
+
+        for path in args.paths:
+            if not os.path.exists(path):
+                parser.error(f"Input file/directory {path} does not exist")
+
+        return args
+
+
+    def _get_attribute_reader(self):
+        # imported here so that scanning without attributes does not need netCDF4
+        from ceda_mip_tools.restructure_for_cmip6.dataset_id_getter import DatasetIDGetter
+        names = DatasetIDGetter().attribute_names + _extra_attributes
+        return lambda path: read_netcdf_attributes(path, names)
+
+
+    def run(self):
+        args = self._parse_args()
+
+        if os.path.exists(args.output) and args.overwrite and not args.append:
+            os.remove(args.output)
+
+        get_attributes = None if args.no_attributes else self._get_attribute_reader()
+
+        manifest = ScanManifest(args.output, readonly=False)
+        count = manifest.scan(args.paths, get_attributes=get_attributes)
+        manifest.close()
+        print(f"{count} entries recorded in {args.output}")
+
+
+def main():
+    scanner = MIPScanner()
+    scanner.run()
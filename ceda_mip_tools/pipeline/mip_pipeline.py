@@ -0,0 +1,314 @@
+"""
+Restructures a batch of CMIP6 files into the DRS directory structure, and
+submits each dataset directory for ingestion and publication as soon as
+its files have been moved.  Optionally tracks the publication status of
+each submitted dataset, from when it is submitted until all have finished.
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+
+from ceda_mip_tools.pub_sys_intfc import config, util, status_cache
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.errors import PublicationError, ServiceError
+from ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6 import Restructurer, InvalidMove
+from ceda_mip_tools.restructure_for_cmip6.dataset_id_getter import DatasetIDGetterException
+
+
+# exit statuses of the tracking, as for mip-dataset-status --watch
+_track_exit_completed = 0
+_track_exit_failed = 2
+_track_exit_timeout = 3
+
+
+class MIPPipeline(object):
+    """
+    Runs the restructuring (through Restructurer) in the main thread, the
+    validation and submission (through PublicationClient) in a worker
+    thread which is fed with each dataset directory once it is complete,
+    together with the stat results gathered while restructuring, and with
+    --track, the polling of the statuses of the submitted datasets in
+    another worker thread which is fed with each dataset ID once it has
+    been submitted.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._queue = queue.Queue()
+        self._track_queue = queue.Queue()
+        self._added_ids = []
+        self._num_errors = 0
+        self._submit_failed = False
+        self._stop_tracking = threading.Event()
+        self._track_status = _track_exit_completed
+
+
+    def _parse_args(self, arg_list=None):
+
+        "Parses arguments and returns parsed args object."
+
+        parser = argparse.ArgumentParser(description=__doc__)
+
+        util.add_project_arg(parser)
+
+        parser.add_argument('paths', nargs='+',
+                            metavar='path',
+                            help='one or more input paths or directories')
+
+        parser.add_argument('-d', '--directory',
+                            metavar='path',
+                            default='.',
+                            help='base directory to move files to')
+
+        parser.add_argument('-v', '--version',
+                            type=int,
+                            metavar='yyyymmdd',
+                            help='version number (default = today)')
+
+        parser.add_argument('-o', '--output',
+                            metavar='path',
+                            help=('path of file containing output list '
+                                  'of versioned directories'))
+
+        parser.add_argument('-O', '--overwrite',
+                            action='store_true',
+                            help=('permit overwriting of existing '
+                                  'output file'))
+
+        parser.add_argument('-m', '--merge',
+                            action='store_true',
+                            help=('permit adding to existing '
+                                  '(non-empty) version directory'))
+
+        parser.add_argument('--replica', action='store_true',
+                            help='label the datasets as replicas')
+
+        parser.add_argument('--track', action='store_true',
+                            help=('after submitting, track the publication status of the '
+                                  'submitted datasets until all have finished (as with '
+                                  'mip-dataset-status --watch)'))
+
+        parser.add_argument('--watch-interval', type=float, metavar='seconds',
+                            default=config.watch_min_interval,
+                            help='with --track, initial polling interval')
+
+        parser.add_argument('--watch-max-interval', type=float, metavar='seconds',
+                            default=config.watch_max_interval,
+                            help='with --track, maximum polling interval')
+
+        parser.add_argument('--watch-timeout', type=float, metavar='seconds',
+                            help='with --track, give up after this long')
+
+        util.add_cv_dir_arg(parser)
+        util.add_manifest_arg(parser)
+        util.add_api_root_arg(parser)
+        util.add_stats_args(parser)
+
+        args = parser.parse_args(arg_list or sys.argv[1:])
+
+        for path in args.paths:
+            if not os.path.exists(path):
+                parser.error("Input file/directory {} does not exist".format(path))
+
+        if args.output and not args.overwrite and os.path.exists(args.output):
+            parser.error("Output file '{}' already exists".format(args.output))
+
+        return args
+
+
+    def _on_dataset_done(self, dataset_dir, file_stats):
+        "called by the restructurer when all the files for a dataset directory have been moved"
+        file_stats = dict((os.path.abspath(path), stat_data)
+                          for path, stat_data in file_stats.items())
+        self._queue.put((os.path.abspath(dataset_dir), file_stats))
+
+
+    def _submit_worker(self, replica, track):
+        """
+        validates and submits dataset directories from the queue until it
+        gets None, passing the IDs of those submitted on to the tracking
+        queue if tracking (and then None, however it stops)
+        """
+        try:
+            while True:
+                item = self._queue.get()
+                if item == None:
+                    break
+                dataset_dir, file_stats = item
+                print()
+                try:
+                    dataset_id = self._client.add(dataset_dir, replica=replica,
+                                                  file_stats=file_stats)
+                except PublicationError as exc:
+                    print("ERROR: adding directory {}: {}".format(dataset_dir, exc))
+                    self._num_errors += 1
+                    continue
+                print("INFO: added directory {}\n(dataset id = {})".format(dataset_dir, dataset_id))
+                self._added_ids.append(dataset_id)
+                if track:
+                    self._track_queue.put(dataset_id)
+        except BaseException:
+            self._submit_failed = True
+            raise
+        finally:
+            if track:
+                self._track_queue.put(None)
+
+
+    def _track_worker(self, min_interval, max_interval, timeout=None,
+                      unknown_grace=config.track_unknown_grace):
+        """
+        Polls the statuses of the datasets from the tracking queue, starting
+        as each arrives, until the queue gives None and all of the datasets
+        have finished (or _stop_tracking is set), printing each status
+        change.  The polling interval grows for as long as nothing changes,
+        as with mip-dataset-status --watch, and timeout counts from the end
+        of the submissions.  A dataset is only counted as unknown to the
+        publication system (and so failed) if it is still unknown
+        unknown_grace seconds after its submission.  Sets _track_status to
+        the exit status.
+        """
+        statuses = {}
+        submitted = {}
+        remaining = []
+        submitting = True
+        end_of_submissions = None
+        interval = min_interval
+
+        while True:
+            # (block for new datasets only while there are none to poll)
+            block = submitting and not remaining
+            while True:
+                try:
+                    dataset_id = self._track_queue.get(block=block, timeout=interval)
+                except queue.Empty:
+                    break
+                block = False
+                if dataset_id == None:
+                    submitting = False
+                    end_of_submissions = time.time()
+                else:
+                    remaining.append(dataset_id)
+                    submitted[dataset_id] = time.time()
+
+            if self._stop_tracking.is_set():
+                print("Stopped tracking with {} MIP datasets unfinished".format(len(remaining)))
+                self._track_status = _track_exit_failed
+                return
+
+            changed = False
+            if remaining:
+                try:
+                    results = self._client.status_many(remaining)
+                except ServiceError as exc:
+                    print("WARNING: poll failed ({}); will retry in {:g} seconds".format(exc, interval))
+                    results = []
+                now = time.time()
+                for dataset_id, status in results:
+                    if status == 'UNKNOWN' and now - submitted[dataset_id] < unknown_grace:
+                        # (probably not registered yet)
+                        continue
+                    old_status = statuses.get(dataset_id)
+                    if old_status != status:
+                        print("{}  {}: {} -> {}".format(time.strftime('%Y-%m-%d %H:%M:%S'),
+                                                         dataset_id, old_status or 'submitted', status))
+                        changed = True
+                    statuses[dataset_id] = status
+                remaining = [dataset_id for dataset_id in remaining
+                             if statuses.get(dataset_id) not in status_cache.terminal_statuses
+                             and statuses.get(dataset_id) != 'UNKNOWN']
+                sys.stdout.flush()
+
+            if not submitting and not remaining:
+                break
+
+            interval = min_interval if changed else min(interval * config.watch_backoff_factor,
+                                                        max_interval)
+            if (end_of_submissions != None and timeout != None
+                    and time.time() - end_of_submissions + interval > timeout):
+                print("Timed out with {} MIP datasets unfinished".format(len(remaining)))
+                self._track_status = _track_exit_timeout
+                return
+            if remaining:
+                self._stop_tracking.wait(interval)
+
+        num_failed = sum(1 for status in statuses.values() if status in ('failed', 'UNKNOWN'))
+        if num_failed:
+            print("Finished: {} of {} MIP datasets failed".format(num_failed, len(statuses)))
+            self._track_status = _track_exit_failed
+        else:
+            print("Finished: all {} MIP datasets completed".format(len(statuses)))
+
+
+    def run(self):
+        args = self._parse_args()
+
+        restructurer = Restructurer(directory=args.directory, version=args.version,
+                                    merge=args.merge, manifest=args.manifest)
+        try:
+            self._client = PublicationClient(args.project, api_url_root=args.api_url_root,
+                                             jobs=2 if args.track else 1,
+                                             cv_dir=args.cv_dir, manifest=args.manifest)
+        except ValueError as exc:
+            print(exc)
+            sys.exit(1)
+
+        # restructure stage (exits if the files cannot be moved)
+        try:
+            plan = restructurer.plan(args.paths)
+        except (InvalidMove, DatasetIDGetterException) as err:
+            print("file move would fail for following reason:\n{}".format(err))
+            sys.exit(1)
+        for dataset_dir, versions in sorted(plan.existing_versions.items()):
+            print("note: {} already has version(s) {}".format(os.path.dirname(dataset_dir),
+                                                             ", ".join(versions)))
+
+        # validation and submission stage, and tracking stage (as each
+        # dataset is submitted)
+        util.start_request_stats(args)
+        workers = [threading.Thread(target=self._submit_worker, args=(args.replica, args.track))]
+        if args.track:
+            workers.append(threading.Thread(target=self._track_worker,
+                                            args=(args.watch_interval, args.watch_max_interval),
+                                            kwargs={'timeout': args.watch_timeout}))
+        for worker in workers:
+            worker.start()
+        try:
+            dataset_dirs = restructurer.execute(plan, on_dataset_done=self._on_dataset_done)
+        except BaseException:
+            # (submit what was completed, but do not wait for it to be published)
+            self._stop_tracking.set()
+            raise
+        finally:
+            self._queue.put(None)
+            workers[0].join()
+
+        print()
+        if args.output:
+            with open(args.output, "w") as fout:
+                for path in dataset_dirs:
+                    fout.write(path + "\n")
+        print("{} versioned directories".format(len(dataset_dirs)))
+        print("{} datasets added, {} errors".format(len(self._added_ids), self._num_errors))
+        if self._submit_failed:
+            print("ERROR: submission stopped early by the error above")
+
+        exit_status = 1 if self._num_errors or self._submit_failed else 0
+        if args.track:
+            for worker in workers[1:]:
+                worker.join()
+            if not exit_status:
+                exit_status = self._track_status
+
+        util.finish_request_stats(args)
+        self._client.close()
+        sys.exit(exit_status)
+
+
+def main():
+    pipeline = MIPPipeline()
+    pipeline.run()
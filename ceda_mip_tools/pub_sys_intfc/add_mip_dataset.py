@@ -4,24 +4,40 @@ Adds MIP dataset(s) for ingestion to CEDA archive and publication to ESGF.
 
 import os
 import sys
+import json
 
 from ceda_mip_tools.pub_sys_intfc import config, util
-from ceda_mip_tools.pub_sys_intfc.permissions_checker import UserPermissionsChecker
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.errors import InvalidDatasetIDError, IngestionUserError, ServiceError
+
+
+_schedules = ['input', 'smallest-first', 'largest-first', 'interleaved']
+
+_preflight_policies = ['off', 'report', 'skip', 'skip-unless-failed']
 
 
 class MIPAdder(object):
+    """
+    The add-to-mip command: the dataset directories are validated and
+    submitted through a PublicationClient, and this handles the arguments,
+    the selection and ordering of the directories, and the reporting
+    """
 
     def __init__(self,
                  configuration=config.configuration,
                  api_url_root=config.api_url_root,
                  requester=None):
         self._configuration = configuration
-        self._api_add_url = api_url_root + config.api_add_suffix
-        self._requester = requester or util.get_user_name()
-        self._perms_checker = UserPermissionsChecker(config.ingestion_user)
-        self._api_url_root = None
-        self._chain = None
-        self._drs = None
+        self._requester = requester
+        self._client = None
+        self._full_check = False
+        self._report_fh = None
+        self._byte_budget = None
+        # [number of datasets, files, bytes] for the run summary
+        self._added = [0, 0, 0]
+        self._deferred = [0, 0, 0]
+        self._num_errors = 0
+        self._skipped = 0
 
     def _parse_args(self, arg_list=None):
 
@@ -37,11 +53,14 @@ class MIPAdder(object):
         parser = util.ArgsFromCmdLineOrFileParser('dirs', 'dataset directories', 
                                                   var_meta='directory',
                                                   var_help=dirs_help,
+                                                  allow_lazy=True,
                                                   description=__doc__)
 
         util.add_project_arg(parser)
         parser.add_standard_arguments()
+        util.add_cv_dir_arg(parser)
         util.add_api_root_arg(parser)
+        util.add_stats_args(parser)
 
         parser.add_argument("--dataset-id", "-d", type=str,
                             metavar='dataset_id',
@@ -50,157 +69,351 @@ class MIPAdder(object):
         parser.add_argument("--replica", action='store_true',
                             help='label the dataset as a replica')
 
+        util.add_manifest_arg(parser)
+        util.add_shard_arg(parser)
+
+        parser.add_argument("--balance-shards", action='store_true',
+                            help=('with --shard and --manifest, balance the shards by the number of '
+                                  'files in each dataset directory instead of only by dataset ID; '
+                                  'every job must then be given the same list of directories'))
+
+        parser.add_argument("--schedule", choices=_schedules, default='input',
+                            help=('order in which to submit the datasets: in the order given '
+                                  '(the default, each being submitted as soon as it is validated), '
+                                  'or, once all have been validated, by total size: smallest-first, '
+                                  'largest-first, or interleaved (alternately largest and smallest)'))
+
+        parser.add_argument("--byte-budget", metavar='size',
+                            help=("submit no more than this total size in this run (e.g. '50T'); "
+                                  "datasets which would exceed it are deferred, and can be "
+                                  "submitted by a later run"))
+
+        parser.add_argument("--preflight", choices=_preflight_policies, default='off',
+                            help=('before submitting, look up the dataset IDs in the publication '
+                                  'system, {} at a time, and for those which it already has (from '
+                                  'this requester) either report them but still submit them, skip '
+                                  'them, or skip them unless their status is failed (the default, '
+                                  'off, is not to look them up)').format(config.max_query_datasets))
+
+        parser.add_argument("--report", metavar='filename',
+                            help=('write the outcome for each directory to this file, in '
+                                  'newline-delimited JSON (see mip-merge-results)'))
+
+        parser.add_argument("--no-integrity-check", action='store_true',
+                            help=('do not check the structure of the netCDF files for signs of '
+                                  'truncation (this reads only the file headers)'))
+
+        parser.add_argument("--full-check", action='store_true',
+                            help=('re-check every file, instead of only those which have changed '
+                                  'or did not pass on a previous run (every file is still stat-ed '
+                                  'to see whether it has changed, unless --manifest is used)'))
+
         args = parser.parse_args(arg_list or sys.argv[1:])
 
+        if args.lazy and args.dataset_id:
+            parser.error("--lazy cannot be used with --dataset-id")
+
         if args.dataset_id and len(args.dirs) != 1:
             parser.error("Only one directory can be specified with --dataset-id")
 
+        if args.balance_shards and not (args.shard and args.manifest):
+            parser.error("--balance-shards needs --shard and --manifest")
+
+        if args.balance_shards and args.lazy:
+            parser.error("--balance-shards needs the whole list of directories, "
+                         "so cannot be used with --lazy")
+
+        if args.byte_budget:
+            try:
+                args.byte_budget = util.parse_size(args.byte_budget)
+            except ValueError as exc:
+                parser.error("--byte-budget: {}".format(exc))
+
         return args
 
     
-    def _get_dataset_id(self, path, dataset_id=None):
-        """
-        returns the dataset ID implied by the path, but if dataset_id is specified,
-        then just return that instead
+    def run(self):
+        args = self._parse_args()
+        try:
+            self._client = PublicationClient(args.project, api_url_root=args.api_url_root,
+                                             requester=self._requester, cv_dir=args.cv_dir,
+                                             manifest=args.manifest,
+                                             configuration=self._configuration,
+                                             check_integrity=not args.no_integrity_check)
+        except ValueError as exc:
+            print(exc)
+            sys.exit(1)
+        self._full_check = args.full_check
+        try:
+            sharder = util.parse_shard_arg(args)
+        except ValueError as exc:
+            print(exc)
+            sys.exit(1)
 
-        but in either case, raises an exception if it does not look like a valid dataset 
-        ID
-        """
-        
-        if dataset_id == None:
+        cwd = os.getcwd()
+        # convert to full paths (with --lazy, as they are read)
+        paths = (path if path.startswith("/") else os.path.normpath(os.path.join(cwd, path))
+                 for path in args.dirs)
+
+        if args.lazy:
+            paths = self._check_paths_as_read(paths)
+        if sharder:
+            paths = self._select_shard(paths, sharder, args.dataset_id, args.balance_shards)
+        if not args.lazy:
+            paths = list(paths)
+            if sharder:
+                print("INFO: shard {} has {} of the {} directories".format(sharder, len(paths),
+                                                                          len(args.dirs)))
+
+        if args.report:
+            self._report_fh = open(args.report, 'w')
+        util.start_request_stats(args)
+
+        self._byte_budget = args.byte_budget
+
+        if args.preflight != 'off':
+            paths = self._preflight(paths, args.preflight, args.dataset_id)
+
+        stopped = False
+        try:
+            self._process_dirs(paths, args)
+        except InvalidDatasetIDError as exc:
+            # (only raised here with --lazy)
+            print()
+            print("ERROR: {}\nstopping at this directory".format(exc))
+            stopped = True
+        except IngestionUserError as exc:
+            print("ERROR: {}".format(exc))
+            stopped = True
+        print()
+        self._print_summary()
+
+        if self._report_fh:
+            self._report_fh.close()
+        util.finish_request_stats(args)
+        self._client.close()
+        sys.exit(1 if self._num_errors or stopped else 0)
 
-            dataset_id = self._drs.dir_to_dataset_id(path)
-            if dataset_id == None:
-                raise Exception("{} does not look like valid DRS path".format(path))
 
+    def _process_dirs(self, paths, args):
+        "validates and submits the directories, in the order given by the --schedule policy"
+        if args.schedule == 'input':
+            for path in paths:
+                print()
+                self._process_dir(path, args.dataset_id, args.replica)
         else:
-            if not self._drs.plausible_dataset_id(dataset_id):
-                raise Exception("'{}' does not look like valid dataset ID".format(dataset_id))
-        
-        return dataset_id
+            checked = []
+            for path in paths:
+                print()
+                result = self._check_dir(path, args.dataset_id)
+                if result:
+                    checked.append((path,) + result)
+            print()
+            print("INFO: {} directories validated ({}); submitting {}".format(
+                    len(checked), self._describe_size(sum(size[0] for _, _, size in checked),
+                                                      sum(size[1] for _, _, size in checked)),
+                    args.schedule))
+            for path, dataset_id, size in self._schedule(checked, args.schedule):
+                print()
+                self._submit_dir(path, dataset_id, size, args.replica)
 
 
-    def _validate_dataset_dir(self, path):
+    def _check_paths_as_read(self, paths):
         """
-        check that the files under the dataset directory are ingestable
+        passes on the paths (as read with --lazy), raising
+        InvalidDatasetIDError as soon as one is read whose dataset ID cannot
+        be worked out, before anything is done with it
         """
-
-        # check that everything is readable by the ingestion user
-        errors = False
-        have_ncdf = False
-
-        messages = []
-        permissions = []
-        checker_args = {
-            'messages': messages,
-            'permissions': permissions,
-            'continue_on_error': True 
-            }
-
-        if not os.path.isdir(path):
-            raise Exception("not a directory")
-
-        if not self._perms_checker.check_access(path, 'rx', **checker_args):
-            errors = True
-
-        for root, dirs, files in os.walk(path):
-            for fn in files:
-                file_path = os.path.join(root, fn)
-                if fn.endswith('.nc'):
-                    have_ncdf = True
-                    if not self._perms_checker.check_access(file_path, 
-                                                            'r', **checker_args):
-                        errors = True
+        for path in paths:
+            self._client.get_dataset_id(path)
+            yield path
+
+
+    def _schedule(self, checked, policy):
+        "orders a list of (path, dataset_id, (num_files, num_bytes)) by the scheduling policy"
+        by_size = sorted(checked, key=lambda item: item[2][1])
+        if policy == 'smallest-first':
+            return by_size
+        elif policy == 'largest-first':
+            return sorted(checked, key=lambda item: -item[2][1])
+        elif policy == 'interleaved':
+            ordered = []
+            while by_size:
+                ordered.append(by_size.pop())
+                if by_size:
+                    ordered.append(by_size.pop(0))
+            return ordered
+        return checked
+
+
+    def _describe_size(self, num_files, num_bytes):
+        return "{} files, {}".format(num_files, util.format_size(num_bytes))
+
+
+    def _print_summary(self):
+        summary = "{} datasets added ({})".format(self._added[0], self._describe_size(*self._added[1:]))
+        if self._skipped:
+            summary += ", {} skipped as already known".format(self._skipped)
+        if self._deferred[0]:
+            summary += ", {} deferred by --byte-budget ({})".format(
+                self._deferred[0], self._describe_size(*self._deferred[1:]))
+        summary += ", {} errors".format(self._num_errors)
+        print("INFO: " + summary)
+
+
+    def _preflight(self, paths, policy, dataset_id=None):
+        """
+        Yields the paths to be processed, having looked up their dataset IDs
+        in the publication system a page at a time, and reported (and,
+        depending on the policy, skipped) those that it already has.  Paths
+        whose dataset ID cannot be worked out are passed on, for the error
+        to be reported as usual.
+        """
+        for page in util.paginate_list(paths, config.max_query_datasets):
+            dataset_ids = {}
+            for path in page:
+                try:
+                    dataset_ids[path] = self._client.get_dataset_id(path, dataset_id)
+                except InvalidDatasetIDError:
+                    pass
+            statuses = {}
+            if dataset_ids:
+                try:
+                    statuses = dict(self._client.status_many(sorted(set(dataset_ids.values()))))
+                except ServiceError as exc:
+                    print("WARNING: pre-flight status check failed, so submitting without it: {}"
+                          .format(exc))
+
+            for path in page:
+                status = statuses.get(dataset_ids.get(path), 'UNKNOWN')
+                if status == 'UNKNOWN':
+                    yield path
+                elif policy == 'skip' or (policy == 'skip-unless-failed' and status != 'failed'):
+                    print()
+                    print("INFO: skipping directory {} as the publication system already has it\n"
+                          "(dataset id = {}, status {})".format(path, dataset_ids[path], status))
+                    self._report(path, dataset_ids[path], 'skipped',
+                                 'already known (status {})'.format(status))
+                    self._skipped += 1
                 else:
-                    messages.append('invalid filename (not *.nc):\n   {}'.format(file_path))
-                    errors = True
-                    
-            # also check (non-recursively) that directories are readable
-            # (if they contain any files then execute permission will get checked
-            # as part of checking the files)
-            for dn in dirs:
-                dir_path = os.path.join(root, dn)
-                if not self._perms_checker.check_access(dir_path, 
-                                                        'r',
-                                                        **checker_args):
-                    errors = True
-
-        if not have_ncdf:
-            messages.append("does not contain any valid files")
-            errors = True
-            
-        if errors:
-            message = '\n'.join(['dataset cannot be ingested'] + messages)
-
-            for path, stat_data in permissions:
-                if stat_data.st_uid == 0:
-                    drawline = "=" * 80 + "\n"
-                    message += ("\n{}Please email support@jasmin.ac.uk "
-                                "to ask for user '{}' to be given access to\n"
-                                "{}\n{}").format(drawline, config.ingestion_user,
-                                                 path, drawline)
-
-            raise Exception(message)
-
-
-    def _add_dataset_dir(self, path, dataset_id, replica):
-        "adds specified dataset directory to publication system and parse the response"
-       
-        params = {'chain': self._chain,
-                  'config': self._configuration,
-                  'dataset_id': dataset_id,
-                  'directory': path,
-                  'requester': self._requester,
-                  'is_replica': replica}
-        
-        fields = util.do_post_expecting_json(self._api_url_root + config.api_add_suffix,
-                                             params,
-                                             description='publication system',
-                                             compulsory_fields=('status',))
-        
-        if fields['status'] != 0:
-            message = 'publication system did not accept dataset'
-            try:
-                message += ': ' + fields['message']
-            except KeyError:
-                pass
-            raise Exception(message)
+                    print()
+                    print("INFO: the publication system already has directory {}\n"
+                          "(dataset id = {}, status {})".format(path, dataset_ids[path], status))
+                    yield path
 
 
-    def run(self):
-        args = self._parse_args()
-        self._drs, self._chain = util.parse_project_arg(args)
-        self._api_url_root = args.api_url_root
-        errors = False
+    def _get_shard_key(self, path, dataset_id=None):
+        """
+        the key by which a directory is assigned to a shard: its dataset ID, or
+        if that cannot be found, the path (so that the error is reported by
+        exactly one of the jobs)
+        """
+        try:
+            return self._client.get_dataset_id(path, dataset_id)
+        except Exception:
+            return path
 
-        cwd = os.getcwd()
-        for path in args.dirs:
-            # convert to full path
-            if not path.startswith("/"):
-                path = os.path.normpath(os.path.join(cwd, path))
 
-            print()
-            try:
-                dataset_id = self._get_dataset_id(path, args.dataset_id)
-            except Exception as exc:
-                print("ERROR: getting dataset ID: {}".format(exc))
-                errors = True
-                continue
-            try:
-                self._validate_dataset_dir(path)
-            except Exception as exc:
-                print("ERROR: validating dataset directory {}: {}".format(path, exc))
-                errors = True
-                continue
-            try:
-                self._add_dataset_dir(path, dataset_id, args.replica)
-            except Exception as exc:
-                print("ERROR: adding directory {} as ID {}: {}".format(path, dataset_id, exc))
-                errors = True
-                continue
-            print("INFO: added directory {}\n(dataset id = {}".format(path, dataset_id))
-        print()
-        sys.exit(1 if errors else 0)
+    def _count_files(self, path):
+        return sum(len(files) for _, _, files in self._client.fs.walk(path))
+
+
+    def _select_shard(self, paths, sharder, dataset_id=None, balance=False):
+        """
+        returns the paths which are in the given shard (paths may be a
+        generator, and unless balancing, a generator is returned)
+        """
+        if not balance:
+            return sharder.select(paths, key=lambda path: self._get_shard_key(path, dataset_id))
+        paths = list(paths)
+        keys = [self._get_shard_key(path, dataset_id) for path in paths]
+        sharder.balance(dict((key, self._count_files(path))
+                             for key, path in zip(keys, paths)))
+        return [path for key, path in zip(keys, paths) if sharder.includes(key)]
+
+
+    def _process_dir(self, path, dataset_id=None, replica=False, file_stats=None):
+        """
+        Gets the dataset ID for a (full) directory path, validates the
+        directory and adds it to the publication system, printing the
+        outcome.  Returns the dataset ID if added, or None on error (or if
+        it was deferred by the byte budget).
+        """
+        result = self._check_dir(path, dataset_id, file_stats=file_stats)
+        if not result:
+            return None
+        dataset_id, size = result
+        if self._submit_dir(path, dataset_id, size, replica):
+            return dataset_id
+        return None
+
+
+    def _check_dir(self, path, dataset_id=None, file_stats=None):
+        """
+        Gets the dataset ID for a (full) directory path and validates the
+        directory, printing the outcome if there is an error.  Returns
+        (dataset_id, (num_files, num_bytes)), or None on error.
+        """
+        try:
+            dataset_id = self._client.get_dataset_id(path, dataset_id)
+        except Exception as exc:
+            print("ERROR: getting dataset ID: {}".format(exc))
+            self._report(path, dataset_id, 'error', 'getting dataset ID: {}'.format(exc))
+            self._num_errors += 1
+            return None
+        try:
+            size = self._client.validate(path, file_stats=file_stats, full_check=self._full_check)
+        except IngestionUserError:
+            # (which would be the same for every directory)
+            raise
+        except Exception as exc:
+            print("ERROR: validating dataset directory {}: {}".format(path, exc))
+            self._report(path, dataset_id, 'error', 'validating: {}'.format(exc))
+            self._num_errors += 1
+            return None
+        return dataset_id, size
+
+
+    def _submit_dir(self, path, dataset_id, size, replica=False):
+        """
+        Adds a validated directory to the publication system, unless this
+        would take the run over its byte budget, printing the outcome.
+        Returns whether it was added.
+        """
+        num_files, num_bytes = size
+        if self._byte_budget != None and self._added[2] + num_bytes > self._byte_budget:
+            print("INFO: deferring directory {} ({}) as it would exceed the byte budget"
+                  .format(path, self._describe_size(num_files, num_bytes)))
+            self._report(path, dataset_id, 'deferred', 'over byte budget',
+                         num_files=num_files, num_bytes=num_bytes)
+            self._deferred = [self._deferred[0] + 1, self._deferred[1] + num_files,
+                              self._deferred[2] + num_bytes]
+            return False
+        try:
+            self._client.submit(path, dataset_id, replica)
+        except Exception as exc:
+            print("ERROR: adding directory {} as ID {}: {}".format(path, dataset_id, exc))
+            self._report(path, dataset_id, 'error', 'adding: {}'.format(exc),
+                         num_files=num_files, num_bytes=num_bytes)
+            self._num_errors += 1
+            return False
+        print("INFO: added directory {}\n(dataset id = {}, {})".format(
+                path, dataset_id, self._describe_size(num_files, num_bytes)))
+        self._report(path, dataset_id, 'added', num_files=num_files, num_bytes=num_bytes)
+        self._added = [self._added[0] + 1, self._added[1] + num_files, self._added[2] + num_bytes]
+        return True
+
+
+    def _report(self, path, dataset_id, status, message=None, num_files=None, num_bytes=None):
+        "writes the outcome for a directory to the --report file (if any)"
+        if self._report_fh:
+            self._report_fh.write(json.dumps({'dataset_id': dataset_id,
+                                              'directory': path,
+                                              'status': status,
+                                              'message': message,
+                                              'num_files': num_files,
+                                              'num_bytes': num_bytes}) + "\n")
+            self._report_fh.flush()
 
 
 def main():
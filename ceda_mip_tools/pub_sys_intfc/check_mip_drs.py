@@ -0,0 +1,98 @@
+"""
+Checks that MIP dataset IDs or dataset directories conform to the project DRS,
+reporting which facets are invalid.
+"""
+
+import sys
+import json
+
+from ceda_mip_tools.pub_sys_intfc import config, util
+
+
+class MIPDRSChecker(object):
+
+    def __init__(self):
+        self._drs = None
+
+
+    def _parse_args(self, arg_list=None):
+
+        "Parses arguments and returns parsed args object."
+
+        items_help = ("Dataset ID (including .v<version> part) or dataset directory "
+                      "with format ${BASEDIR}/${DRS_DIRS}/${VERSION_DIR}. "
+                      "Anything containing '/' is treated as a directory.")
+
+        parser = util.ArgsFromCmdLineOrFileParser('items', 'dataset IDs or directories',
+                                                  var_meta='item',
+                                                  var_help=items_help,
+                                                  description=__doc__)
+
+        util.add_project_arg(parser)
+        parser.add_standard_arguments()
+        util.add_cv_dir_arg(parser)
+
+        parser.add_argument('--verbose', '-v', action='store_true',
+                            help='also list the valid items')
+
+        parser.add_argument('--ndjson', '-n', metavar='filename',
+                            help=("write a result for each item in newline-delimited JSON "
+                                  "format to specified file ('-' for standard output)"))
+
+        return parser.parse_args(arg_list or sys.argv[1:])
+
+
+    def _result_to_dict(self, result):
+        return {'item': result.item,
+                'dataset_id': result.dataset_id,
+                'valid': not result.errors,
+                'errors': [error._asdict() for error in result.errors]}
+
+
+    def _report(self, results, verbose=False, ndjson_fh=None):
+        "Reports on a list of ValidationResult and returns the number of invalid items"
+        num_invalid = 0
+        for result in results:
+            if result.errors:
+                num_invalid += 1
+                print("INVALID: {}".format(result.item))
+                for error in result.errors:
+                    print("    {}".format(error))
+            elif verbose:
+                print("OK: {}".format(result.item))
+            if ndjson_fh:
+                ndjson_fh.write(json.dumps(self._result_to_dict(result)) + "\n")
+        return num_invalid
+
+
+    def run(self):
+        args = self._parse_args()
+        try:
+            self._drs, chain = util.parse_project_arg(args)
+        except ValueError as exc:
+            print(exc)
+            sys.exit(1)
+
+        if args.ndjson == '-':
+            ndjson_fh = sys.stdout
+        elif args.ndjson:
+            ndjson_fh = open(args.ndjson, 'w')
+        else:
+            ndjson_fh = None
+
+        num_checked = num_invalid = 0
+        for items in util.paginate_list(args.items, config.validation_chunk_size):
+            results = self._drs.validator.validate_many(items)
+            num_checked += len(results)
+            num_invalid += self._report(results, verbose=args.verbose, ndjson_fh=ndjson_fh)
+
+        if ndjson_fh and ndjson_fh != sys.stdout:
+            ndjson_fh.close()
+
+        print("{} checked, {} invalid".format(num_checked, num_invalid))
+        sys.exit(1 if num_invalid else 0)
+
+
+def main():
+    checker = MIPDRSChecker()
+    checker.run()
@@ -0,0 +1,134 @@
+"""
+Audit of how the variables in netCDF files are chunked and compressed,
+reading only their metadata (never the data), flagging layouts that make
+reading slow or waste space.  The codes of the findings are:
+
+  classic-format  the file is in a netCDF-3 format, so cannot be compressed
+  uncompressed    a large variable is stored without compression
+  no-shuffle      a variable is deflated without the shuffle filter, which
+                  usually makes floating point data compress much better
+  high-deflate    the deflate level is so high that writing and reading are
+                  slow for little extra compression
+  small-chunks    chunks are so small that reading needs very many small
+                  reads (e.g. one time step of a small spatial tile each)
+  large-chunks    chunks are so large that reading a small part of the
+                  variable means reading and decompressing a lot of data
+  many-chunks     the variable has so many chunks that its chunk index is
+                  itself slow to read
+  unreadable      the file could not be opened
+"""
+
+import math
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from ceda_mip_tools.pub_sys_intfc import config, util
+
+
+Finding = collections.namedtuple('Finding', 'code variable detail')
+
+# keys of Variable.filters() which indicate a compression filter
+_compression_filters = ('zlib', 'szip', 'zstd', 'bzip2', 'blosc')
+
+
+def _audit_variable(name, var):
+    "returns a list of Finding for one (large) variable of a netCDF-4 file"
+    findings = []
+    itemsize = var.dtype.itemsize
+    filters = var.filters() or {}
+    if not any(filters.get(key) for key in _compression_filters):
+        findings.append(Finding('uncompressed', name, util.format_size(var.size * itemsize)))
+    elif filters.get('zlib'):
+        if not filters.get('shuffle'):
+            findings.append(Finding('no-shuffle', name, 'deflate level {}'.format(filters.get('complevel'))))
+        if filters.get('complevel', 0) > config.chunk_audit_max_deflate_level:
+            findings.append(Finding('high-deflate', name, 'deflate level {}'.format(filters['complevel'])))
+
+    chunking = var.chunking()
+    if chunking == 'contiguous':
+        return findings
+    chunk_bytes = itemsize
+    num_chunks = 1
+    for dim_len, chunk_len in zip(var.shape, chunking):
+        chunk_bytes *= chunk_len
+        num_chunks *= math.ceil(dim_len / chunk_len)
+    description = "chunks of {} ({}), {} chunks".format(
+        "x".join(str(chunk_len) for chunk_len in chunking), util.format_size(chunk_bytes), num_chunks)
+    if chunk_bytes < config.chunk_audit_min_chunk_bytes and num_chunks > 1:
+        findings.append(Finding('small-chunks', name, description))
+    elif chunk_bytes > config.chunk_audit_max_chunk_bytes:
+        findings.append(Finding('large-chunks', name, description))
+    if num_chunks > config.chunk_audit_max_chunks:
+        findings.append(Finding('many-chunks', name, description))
+    return findings
+
+
+def audit_file(path):
+    """
+    Audits the chunking and compression of the variables of at least
+    config.chunk_audit_min_var_bytes in a netCDF file.  Returns a list of
+    Finding (empty if nothing was flagged).
+    """
+    import netCDF4
+    findings = []
+    try:
+        with netCDF4.Dataset(path) as ds:
+            classic = not ds.data_model.startswith('NETCDF4')
+            for name, var in ds.variables.items():
+                if not hasattr(var.dtype, 'itemsize') or not var.ndim:
+                    # (variable-length types)
+                    continue
+                if var.size * var.dtype.itemsize < config.chunk_audit_min_var_bytes:
+                    continue
+                if classic:
+                    findings.append(Finding('classic-format', None, ds.data_model))
+                    break
+                findings.extend(_audit_variable(name, var))
+    except Exception as exc:
+        findings.append(Finding('unreadable', None, str(exc)))
+    return findings
+
+
+def audit_files(paths, jobs=config.chunk_audit_jobs, executor=None):
+    """
+    Audits the files (see audit_file), up to 'jobs' at a time in separate
+    processes (as the netCDF library cannot be used by several threads at
+    once), or using the given concurrent.futures executor.  Yields
+    (path, findings) in the order given.
+    """
+    paths = list(paths)
+    if executor == None and jobs <= 1:
+        for path in paths:
+            yield path, audit_file(path)
+        return
+    own_executor = executor == None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        chunksize = max(1, min(16, len(paths) // (4 * jobs)))
+        for path, findings in zip(paths, executor.map(audit_file, paths, chunksize=chunksize)):
+            yield path, findings
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+def summarise(results):
+    """
+    Summarises a list of (path, findings) for one dataset: returns a list
+    of lines, one per code found, giving the number of files affected and
+    an example
+    """
+    files_by_code = collections.OrderedDict()
+    examples = {}
+    for path, findings in results:
+        for finding in findings:
+            files_by_code.setdefault(finding.code, set()).add(path)
+            examples.setdefault(finding.code, finding)
+    lines = []
+    for code, files in files_by_code.items():
+        example = examples[code]
+        lines.append("{}: {} of {} files (e.g. {}{})".format(
+                code, len(files), len(results),
+                example.variable + ': ' if example.variable else '', example.detail))
+    return lines
@@ -0,0 +1,586 @@
+"""
+Python interface for adding datasets to, and querying the status of
+datasets in, the publication system from within a program, without running
+add-to-mip or mip-dataset-status as separate processes.  Those commands
+are themselves built on it.
+
+Example:
+
+    with PublicationClient('CMIP6') as client:
+        results = client.add_many(dataset_dirs)
+        statuses = client.status_many([r.dataset_id for r in results if r.added])
+
+Errors are raised as the exceptions in ceda_mip_tools.pub_sys_intfc.errors.
+"""
+
+import os
+import sys
+import stat
+import time
+import collections
+
+from ceda_mip_tools.pub_sys_intfc import config, util, status_cache, netcdf_integrity
+from ceda_mip_tools.pub_sys_intfc.errors import (PublicationError, InvalidDatasetIDError,
+                                                 DatasetValidationError, IngestionUserError,
+                                                 ServiceError, SubmissionError)
+from ceda_mip_tools.pub_sys_intfc.permissions_checker import UserPermissionsChecker
+from ceda_mip_tools.pub_sys_intfc.validation_fingerprints import ValidationFingerprints, get_fingerprint
+from ceda_mip_tools.fs_utils.manifest import get_filesystem
+
+
+# return values of PublicationClient.watch (the exit statuses of
+# mip-dataset-status --watch)
+watch_exit_completed = 0
+watch_exit_failed = 2
+watch_exit_timeout = 3
+
+
+class AddResult(collections.namedtuple('AddResult', 'directory dataset_id error')):
+    """
+    The outcome of adding one dataset directory: error is None if it was
+    added, otherwise the PublicationError raised
+    """
+    __slots__ = ()
+
+    @property
+    def added(self):
+        return self.error == None
+
+
+class PublicationClient(object):
+    """
+    Adds and queries datasets of one project.  The HTTP session (and hence
+    its open connections), the DRS validator and the status cache (if
+    cache_file is given) are shared by all the calls, so the client should
+    be kept for as long as there is work to do, and then closed.
+
+    The ingestion user (as whom the files are checked) is only looked up
+    when a dataset directory is first validated, so a client that only
+    queries statuses can be used on any host.  Unless check_integrity is
+    false, the structure of the netCDF files is also checked when
+    validating.
+
+    The public attributes are the project's DatasetDRS (drs), its chain,
+    the StatusCache (cache, or None) and the filesystem object (fs), which
+    answers from the manifest if one was given.
+    """
+
+    def __init__(self, project,
+                 api_url_root=config.api_url_root,
+                 requester=None,
+                 jobs=1,
+                 cv_dir=None,
+                 manifest=None,
+                 cache_file=None,
+                 configuration=config.configuration,
+                 check_integrity=True):
+
+        if not 1 <= jobs <= config.max_query_jobs:
+            raise ValueError("jobs must be between 1 and {}".format(config.max_query_jobs))
+        self._jobs = jobs
+
+        self.drs, self.chain = util.get_project_drs(project,
+                                                    cv_dir or os.environ.get(config.cv_dir_env_var))
+        self._configuration = configuration
+        self._api_url_root = api_url_root
+        self._requester = requester or util.get_user_name()
+        self._session = util.get_session(pool_size=jobs)
+        self.cache = (status_cache.StatusCache(cache_file, configuration, self.chain)
+                      if cache_file else None)
+
+        self._manifest = manifest
+        self.fs = get_filesystem(manifest)
+        self._check_integrity = check_integrity
+        # (set up on first use by _get_perms_checker)
+        self._perms_checker = None
+        self._fingerprints = None
+
+
+    def close(self):
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+        self._session.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def _describe_errors(self, errors):
+        return '; '.join(str(error) for error in errors)
+
+
+    def get_dataset_id(self, path, dataset_id=None):
+        """
+        Returns the dataset ID for a DRS dataset directory, or if dataset_id
+        is given, that instead; raises InvalidDatasetIDError if it does not
+        look like a valid dataset ID
+        """
+        if dataset_id == None:
+            path = os.path.abspath(path)
+            dataset_id = self.drs.dir_to_dataset_id(path)
+            if dataset_id == None:
+                raise InvalidDatasetIDError("{} does not look like valid DRS path ({})"
+                                            .format(path, self._describe_errors(self.drs.get_dir_errors(path))))
+        elif not self.drs.plausible_dataset_id(dataset_id):
+            raise InvalidDatasetIDError("'{}' does not look like valid dataset ID ({})"
+                                        .format(dataset_id,
+                                                self._describe_errors(self.drs.get_dataset_id_errors(dataset_id))))
+        return dataset_id
+
+
+    def _invalid_spec_error(self, dataset_spec, errors):
+        "Returns an InvalidDatasetIDError for an invalid dataset spec, given its list of FacetError"
+        reasons = self._describe_errors(errors)
+        if '/' in dataset_spec:
+            return InvalidDatasetIDError(("{} looks like a directory but cannot be mapped into a dataset ID ({})"
+                                          ).format(dataset_spec, reasons))
+        else:
+            return InvalidDatasetIDError(("{} does not looks like a valid dataset identifier ({})"
+                                          ).format(dataset_spec, reasons))
+
+
+    def validate_specs(self, dataset_specs):
+        """
+        Returns the dataset IDs for a list of dataset specs (dataset IDs or
+        directories), or raises InvalidDatasetIDError for the first invalid one
+        """
+        dataset_ids = []
+        for result in self.drs.validator.validate_many(dataset_specs):
+            if result.errors:
+                raise self._invalid_spec_error(result.item, result.errors)
+            dataset_ids.append(result.dataset_id)
+        return dataset_ids
+
+
+    def _get_perms_checker(self):
+        """
+        Returns the UserPermissionsChecker for the ingestion user (looking
+        the user up on first use), or raises IngestionUserError
+        """
+        if self._perms_checker == None:
+            try:
+                perms_checker = UserPermissionsChecker(config.ingestion_user,
+                                                       fs=self.fs if self._manifest else None)
+            except KeyError:
+                raise IngestionUserError("ingestion user '{}' does not exist on this host, so "
+                                         "dataset directories cannot be checked"
+                                         .format(config.ingestion_user))
+            self._fingerprints = ValidationFingerprints(config.validation_records_dir,
+                                                        perms_checker.uid, perms_checker.gids)
+            self._fingerprints.checks = ['integrity'] if self._check_integrity else []
+            self._perms_checker = perms_checker
+        return self._perms_checker
+
+
+    def validate(self, path, file_stats=None, full_check=False):
+        """
+        Checks that a dataset directory can be ingested, returning (number
+        of files, total bytes) for the netCDF files, or raises
+        DatasetValidationError (or IngestionUserError).
+
+        file_stats is an optional dictionary of {path: stat_result} for
+        files (or directories) whose stat results are already known, which
+        are used instead of stat-ing them again.
+
+        Entries which passed on a previous run, and whose fingerprint (size,
+        times, mode and ownership) has not changed since, are not re-checked
+        unless full_check is set (though unless file_stats has them, they
+        are stat-ed to get the fingerprint).  The fingerprints of the
+        entries which pass are recorded for next time.
+        """
+        path = os.path.abspath(path)
+        perms_checker = self._get_perms_checker()
+        try:
+            return self._validate_dataset_dir(path, perms_checker, file_stats, full_check)
+        except PublicationError:
+            raise
+        except Exception as exc:
+            raise DatasetValidationError(str(exc)) from exc
+
+
+    def _validate_dataset_dir(self, path, perms_checker, file_stats, full_check):
+        "the main part of validate()"
+
+        # check that everything is readable by the ingestion user
+        errors = False
+        have_ncdf = False
+
+        messages = []
+        permissions = []
+        checker_args = {
+            'messages': messages,
+            'permissions': permissions,
+            'continue_on_error': True
+            }
+
+        if not self.fs.isdir(path):
+            raise DatasetValidationError("not a directory")
+
+        if not perms_checker.check_access(path, 'rx', **checker_args):
+            errors = True
+
+        previously_passed = self._fingerprints.load(path) if not full_check else {}
+        passed = {}
+        files_to_check = []
+        totals = [0, 0]
+
+        def check_entry(entry_path, access):
+            "check an entry, unless it passed before and is unchanged; returns whether it passes"
+            stat_data = file_stats.get(entry_path) if file_stats else None
+            if stat_data == None:
+                stat_data = self.fs.stat(entry_path)
+            if stat.S_ISREG(stat_data.st_mode):
+                totals[0] += 1
+                totals[1] += stat_data.st_size
+            fingerprint = get_fingerprint(stat_data)
+            if previously_passed.get(entry_path) == fingerprint:
+                passed[entry_path] = fingerprint
+                return True
+            if perms_checker.check_access(entry_path, access, stat_data=stat_data,
+                                          **checker_args):
+                passed[entry_path] = fingerprint
+                if entry_path.endswith('.nc'):
+                    files_to_check.append(entry_path)
+                return True
+            return False
+
+        for root, dirs, files in self.fs.walk(path):
+            for fn in files:
+                file_path = os.path.join(root, fn)
+                if fn.endswith('.nc'):
+                    have_ncdf = True
+                    if not check_entry(file_path, 'r'):
+                        errors = True
+                else:
+                    messages.append('invalid filename (not *.nc):\n   {}'.format(file_path))
+                    errors = True
+
+            # also check (non-recursively) that directories are readable and
+            # searchable (this cannot be left to the checks of the files in
+            # them, as unchanged files are not checked again)
+            for dn in dirs:
+                dir_path = os.path.join(root, dn)
+                if not check_entry(dir_path, 'rx'):
+                    errors = True
+
+        if self._check_integrity and files_to_check:
+            for file_path, problem in netcdf_integrity.check_files(files_to_check):
+                messages.append('{}:\n   {}'.format(problem, file_path))
+                del passed[file_path]
+                errors = True
+
+        try:
+            self._fingerprints.save(path, passed)
+        except OSError as exc:
+            print("WARNING: could not record validation results: {}".format(exc), file=sys.stderr)
+
+        if not have_ncdf:
+            messages.append("does not contain any valid files")
+            errors = True
+
+        if errors:
+            message = '\n'.join(['dataset cannot be ingested'] + messages)
+
+            for path, stat_data in permissions:
+                if stat_data.st_uid == 0:
+                    drawline = "=" * 80 + "\n"
+                    message += ("\n{}Please email support@jasmin.ac.uk "
+                                "to ask for user '{}' to be given access to\n"
+                                "{}\n{}").format(drawline, config.ingestion_user,
+                                                 path, drawline)
+
+            raise DatasetValidationError(message)
+
+        return tuple(totals)
+
+
+    def submit(self, path, dataset_id, replica=False):
+        """
+        Adds an already validated dataset directory to the publication
+        system as the given dataset ID, or raises SubmissionError or
+        ServiceError
+        """
+        params = {'chain': self.chain,
+                  'config': self._configuration,
+                  'dataset_id': dataset_id,
+                  'directory': os.path.abspath(path),
+                  'requester': self._requester,
+                  'is_replica': replica}
+
+        fields = util.do_post_expecting_json(self._api_url_root + config.api_add_suffix,
+                                             params,
+                                             description='publication system',
+                                             compulsory_fields=('status',),
+                                             session=self._session)
+
+        if fields['status'] != 0:
+            message = 'publication system did not accept dataset'
+            try:
+                message += ': ' + fields['message']
+            except KeyError:
+                pass
+            raise SubmissionError(message)
+
+
+    def add(self, path, dataset_id=None, replica=False, full_check=False, file_stats=None):
+        """
+        Validates a dataset directory (see validate) and adds it to the
+        publication system.  The dataset ID is taken from the path unless
+        given.  Returns the dataset ID, or raises InvalidDatasetIDError,
+        DatasetValidationError, IngestionUserError, SubmissionError or
+        ServiceError.
+        """
+        dataset_id = self.get_dataset_id(path, dataset_id)
+        self.validate(path, file_stats=file_stats, full_check=full_check)
+        self.submit(path, dataset_id, replica)
+        return dataset_id
+
+
+    def add_many(self, paths, replica=False, full_check=False):
+        """
+        Adds each of the dataset directories, carrying on after errors.
+        Returns a list of AddResult in the same order as paths.
+        """
+        results = []
+        for path in paths:
+            dataset_id = None
+            try:
+                dataset_id = self.get_dataset_id(path)
+                self.validate(path, full_check=full_check)
+                self.submit(path, dataset_id, replica)
+            except PublicationError as exc:
+                results.append(AddResult(path, dataset_id, exc))
+            else:
+                results.append(AddResult(path, dataset_id, None))
+        return results
+
+
+    def _query(self, query_params):
+        "POSTs a query to the API, returning the parsed JSON"
+        return util.do_post_expecting_json(self._api_url_root + config.api_query_suffix,
+                                           query_params,
+                                           description='publication system',
+                                           compulsory_fields=('datasets', 'num_found'),
+                                           session=self._session)
+
+
+    def _get_status_page(self, dataset_ids):
+        "Query the API for multiple datasets, returning a list of (dataset_id, status)"
+
+        query_params = { 'dataset_id': ','.join(dataset_ids),
+                         'chain': self.chain,
+                         'configuration': self._configuration,
+                         'requester': self._requester,
+                         'max_items': len(dataset_ids) }
+
+        fields = self._query(query_params)
+
+        # this following check would fail if either:
+        # - dataset ID matches more than one dataset (it shouldn't because configuration is in the query)
+        # - or if server disallows the number we asked for simultaneously
+        if len(fields['datasets']) != fields['num_found']:
+            raise ServiceError("publication system returned {} of {} datasets found"
+                               .format(len(fields['datasets']), fields['num_found']))
+
+        results_dict = dict((ds['dataset_id'], ds['status']) for ds in fields['datasets'])
+
+        return [(dataset_id, results_dict.get(dataset_id, 'UNKNOWN'))
+                for dataset_id in dataset_ids]
+
+
+    def _cached_pages(self, pages):
+        "Pass through pages of results, storing them in the cache (if in use) on the way"
+        for page in pages:
+            if self.cache:
+                self.cache.update(page)
+            yield page
+
+
+    def _query_status_pages(self, dataset_ids):
+        """
+        Query the API for the datasets a page at a time, with up to 'jobs'
+        pages in flight at once, recording the results in the cache
+        """
+        pages = util.paginate_list(dataset_ids, config.max_query_datasets)
+        return self._cached_pages(util.map_pages(self._get_status_page, pages, jobs=self._jobs))
+
+
+    def _refreshed_status_pages(self, dataset_ids, ttl):
+        """
+        Query the API only for those datasets whose status in the cache is
+        unknown, unfinished or older than ttl, and yield pages of
+        (dataset_id, status) for all the dataset_ids in order, merging the
+        new results with the cached ones.
+        """
+        to_query = self.cache.get_ids_to_query(dataset_ids, ttl)
+        fresh = {}
+        for page in self._query_status_pages(to_query):
+            fresh.update(page)
+
+        for page in util.paginate_list(dataset_ids, config.max_query_datasets):
+            cached = self.cache.get_many(dataset_id for dataset_id in page
+                                         if dataset_id not in fresh)
+            yield [(dataset_id, fresh[dataset_id] if dataset_id in fresh else cached[dataset_id][0])
+                   for dataset_id in page]
+
+
+    def status_pages(self, dataset_ids, refresh=False, cache_ttl=config.status_cache_ttl):
+        """
+        Yields a list of (dataset_id, status) for each page of the datasets
+        (given by dataset ID, see validate_specs) as the results arrive, in
+        the same order as dataset_ids, which may be a generator ('UNKNOWN'
+        for datasets that the publication system does not have).  If
+        refresh is set, then the statuses of finished datasets are taken
+        from the status cache where they are recent enough (and dataset_ids
+        is read in full first).
+        """
+        if refresh:
+            if not self.cache:
+                raise ValueError("refresh needs a status cache (cache_file)")
+            return self._refreshed_status_pages(list(dataset_ids), cache_ttl)
+        return self._query_status_pages(dataset_ids)
+
+
+    def status(self, dataset_spec):
+        "Returns the status of one dataset (given by dataset ID or directory)"
+        return self.status_many([dataset_spec])[0][1]
+
+
+    def status_many(self, dataset_specs, refresh=False, cache_ttl=config.status_cache_ttl):
+        """
+        Returns a list of (dataset_id, status) for the datasets, given by
+        dataset ID or directory, as status_pages.  Raises
+        InvalidDatasetIDError before making any queries if any of the specs
+        is invalid.
+        """
+        results = []
+        for page in self.status_pages(self.validate_specs(dataset_specs),
+                                      refresh=refresh, cache_ttl=cache_ttl):
+            results.extend(page)
+        return results
+
+
+    def iter_status_pages(self, status='ALL'):
+        """
+        Yields a list of (dataset_id, status) for each page of the
+        requester's datasets with the given status ('ALL' for any), as the
+        pages of results arrive
+        """
+        query_params = { 'dataset_id': '**',
+                         'chain': self.chain,
+                         'configuration': self._configuration,
+                         'requester': self._requester}
+
+        if status != 'ALL':
+            query_params['status'] = status
+
+        def get_pages():
+            # paginated query
+            # on the last page, 'cursor' is not set, and it will return
+            while True:
+                fields = self._query(query_params)
+
+                yield [(ds['dataset_id'], ds['status'])
+                       for ds in fields['datasets']]
+
+                if 'cursor' in fields:
+                    if 'cursor' in query_params:
+                        # sanity check against infinite loop
+                        assert(query_params['cursor'] != fields['cursor'])
+                    query_params['cursor'] = fields['cursor']
+                else:
+                    return
+
+        return self._cached_pages(get_pages())
+
+
+    def iter_status(self, status='ALL'):
+        """
+        Yields (dataset_id, status) for all of the requester's datasets with
+        the given status ('ALL' for any), as the pages of results arrive
+        """
+        for page in self.iter_status_pages(status):
+            yield from page
+
+
+    def watch(self, dataset_ids, min_interval=config.watch_min_interval,
+              max_interval=config.watch_max_interval, timeout=None, writer=print):
+        """
+        Polls the datasets that have not finished until all of them have,
+        writing a line for each status change.  The polling interval starts
+        at min_interval and grows (up to max_interval) for as long as nothing
+        changes.  Datasets unknown to the publication system are reported and
+        not polled again (and count as failed).  If a poll fails, it is
+        retried at the next interval.  Returns watch_exit_completed if all
+        completed, watch_exit_failed if any failed, or watch_exit_timeout.
+        """
+        start_time = time.time()
+        statuses = {}
+        remaining = list(dict.fromkeys(dataset_ids))
+        interval = min_interval
+        first_poll = True
+
+        while True:
+            changed = False
+            try:
+                for page in self._query_status_pages(remaining):
+                    for dataset_id, status in page:
+                        old_status = statuses.get(dataset_id)
+                        if status == 'UNKNOWN':
+                            if old_status == None:
+                                writer("{}: not known to the publication system".format(dataset_id))
+                        elif old_status != None and old_status != status:
+                            writer("{}  {}: {} -> {}".format(time.strftime('%Y-%m-%d %H:%M:%S'),
+                                                              dataset_id, old_status, status))
+                            changed = True
+                        statuses[dataset_id] = status
+            except ServiceError as exc:
+                writer("WARNING: poll failed ({}); will retry in {:g} seconds".format(exc, interval))
+                sys.stdout.flush()
+                if timeout != None and time.time() - start_time + interval > timeout:
+                    writer("Timed out with {} MIP datasets unfinished".format(len(remaining)))
+                    return watch_exit_timeout
+                time.sleep(interval)
+                continue
+
+            if first_poll:
+                first_poll = False
+                counts = collections.Counter(statuses.values())
+                writer("Watching {} MIP datasets ({})".format(
+                        len(statuses),
+                        ", ".join("{} {}".format(n, status) for status, n in sorted(counts.items()))))
+            elif changed:
+                interval = min_interval
+            else:
+                interval = min(interval * config.watch_backoff_factor, max_interval)
+
+            remaining = [dataset_id for dataset_id in remaining
+                         if statuses[dataset_id] not in status_cache.terminal_statuses
+                         and statuses[dataset_id] != 'UNKNOWN']
+            sys.stdout.flush()
+
+            if not remaining:
+                break
+
+            if timeout != None and time.time() - start_time + interval > timeout:
+                writer("Timed out with {} MIP datasets unfinished".format(len(remaining)))
+                return watch_exit_timeout
+
+            time.sleep(interval)
+
+        num_failed = sum(1 for status in statuses.values() if status == 'failed')
+        num_unknown = sum(1 for status in statuses.values() if status == 'UNKNOWN')
+        if num_failed or num_unknown:
+            writer("Finished: {} of {} MIP datasets failed{}".format(
+                    num_failed, len(statuses),
+                    ", {} unknown".format(num_unknown) if num_unknown else ""))
+            return watch_exit_failed
+        else:
+            writer("Finished: all {} MIP datasets completed".format(len(statuses)))
+            return watch_exit_completed
@@ -5,21 +5,70 @@ api_add_suffix = 'add_dataset/'
 api_query_suffix = 'dataset/'
 
 max_query_datasets = 200
+validation_chunk_size = 100000
+max_query_jobs = 16
+throttle_initial_delay = 1.
+throttle_max_retries = 6
 max_requester_len = 32
 ingestion_user = 'badc'
 timeout = 5.
+fixed_table_width = 100
+status_cache_file = '~/.cache/ceda_mip_tools/status_cache.sqlite'
+status_cache_ttl = 7 * 86400.
+watch_min_interval = 30.
+watch_max_interval = 900.
+watch_backoff_factor = 1.5
+# how long after submission mip-pipeline --track keeps polling a dataset
+# that the publication system does not know yet, before counting it as failed
+track_unknown_grace = 300.
+
+# directory of controlled vocabulary JSON files (can also be set with
+# the MIP_CV_DIR environment variable or --cv-dir option) and where the
+# compiled CVs are cached
+cv_dir = None
+cv_dir_env_var = 'MIP_CV_DIR'
+cv_cache_dir = '~/.cache/ceda_mip_tools/cv'
+
+# where add-to-mip records which files passed validation
+validation_records_dir = '~/.cache/ceda_mip_tools/validation'
+
+# number of files whose structure add-to-mip checks at once, and the most
+# it will read of any one file's header
+integrity_check_jobs = 8
+integrity_max_header_bytes = 16 * 1024 * 1024
+
+# chunking and compression audit (mip-chunk-audit):
+# number of files audited at once (in separate processes), the size below
+# which variables are not audited, the range of chunk sizes that is not
+# flagged, the most chunks a variable should have, and the highest deflate
+# level that is not flagged
+chunk_audit_jobs = 8
+chunk_audit_min_var_bytes = 1024 * 1024
+chunk_audit_min_chunk_bytes = 64 * 1024
+chunk_audit_max_chunk_bytes = 64 * 1024 * 1024
+chunk_audit_max_chunks = 100000
+chunk_audit_max_deflate_level = 5
 
 
 # A basic check that it looks like a plausible DRS. Does not include the whole DRS
 # Dictionary of 
 # (facet_number, allowed_values)
+#
+# facet_names gives the name of each facet of the dataset ID, in order
+#
+# cv_prefix is the prefix of the controlled vocabulary file names
+# (default: the project name), and cv_names (optional) maps facet names
+# to CV names where they differ
 
 projects = {
     'CMIP6': {
         'chain': 'CMIP6-fromdisk',
+        'cv_prefix': 'CMIP6',
 
         'drs': {
             'num_facets': 10,
+            'facet_names': """mip_era activity_id institution_id source_id experiment_id
+                              member_id table_id variable_id grid_label version""".split(),
             'facet_allowed_vals': { 0: ['CMIP6'] ,
                                     1: """AerChemMIP C4MIP CDRMIP CFMIP CMIP CORDEX DAMIP DCPP DynVarMIP
                                               FAFMIP GMMIP GeoMIP HighResMIP ISMIP6 LS3MIP LUMIP OMIP PAMIP
@@ -29,9 +78,12 @@ projects = {
 
     'PRIMAVERA': {
         'chain': 'PRIMAVERA-fromdisk',
+        'cv_prefix': 'CMIP6',
 
         'drs': {
             'num_facets': 10,
+            'facet_names': """mip_era activity_id institution_id source_id experiment_id
+                              member_id table_id variable_id grid_label version""".split(),
             'facet_allowed_vals': { 0: ['PRIMAVERA'] ,
                                     1: """AerChemMIP C4MIP CDRMIP CFMIP CMIP CORDEX DAMIP DCPP DynVarMIP
                                               FAFMIP GMMIP GeoMIP HighResMIP ISMIP6 LS3MIP LUMIP OMIP PAMIP
@@ -45,6 +97,8 @@ projects = {
 
         'drs': {
             'num_facets': 10,
+            'facet_names': """mip_era activity_id institution_id source_id experiment_id
+                              member_id table_id variable_id grid_label version""".split(),
             'facet_allowed_vals': { 0: ['EERIE'],
                                     1: ['EERIE'],
                                     2: ['MOHC']}
@@ -57,6 +111,8 @@ projects = {
 
         'drs': {
             'num_facets': 10,
+            'facet_names': """activity_id mip_era target_mip institution_id source_id
+                              realm frequency variable_id grid_label version""".split(),
             'facet_allowed_vals': { 0: ['input4MIPs'] ,
                                     1: ['CMIP6', 'CMIP6Plus', 'CMIP7'],
                                     2: """AerChemMIP AerChemMIP2 C4MIP CMIP DAMIP DCPP
@@ -69,6 +125,8 @@ projects = {
         'chain': 'CORDEX-fromdisk',
         'drs': {
             'num_facets': 12,
+            'facet_names': """project product domain institute driving_model experiment
+                              ensemble rcm_name rcm_version time_frequency variable version""".split(),
             'facet_allowed_vals': { 0: ['cordex'] ,
                                     2: """AFR-44 AFR-44i ANT-44 ANT-44i ARC-44 ARC-44i AUS-44 AUS-44i CAM-44
                                               CAM-44i CAS-44 CAS-44i EAS-44 EAS-44i EUR-11 EUR-11i EUR-44 EUR-44i MED-44
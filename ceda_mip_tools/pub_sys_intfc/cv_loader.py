@@ -0,0 +1,133 @@
+"""
+Loads the allowed values of DRS facets from local controlled vocabulary (CV)
+JSON files, such as a checkout of the WCRP CMIP6_CVs repository.
+
+The values are compiled into a dictionary of frozen sets which is cached on
+disk, and only rebuilt when the CV files change.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+
+
+# bump this if the format of the cached data changes
+_cache_format = 1
+
+
+class CVLoader(object):
+    """
+    For a DRS facet named e.g. 'source_id' in a project whose CV prefix is
+    'CMIP6', the CV file is looked for as CMIP6_source_id.json or
+    source_id.json in the CV directory.  The file should contain a JSON
+    object with a 'source_id' key whose value is either a list of allowed
+    values or an object whose keys are the allowed values.  Facets with no
+    CV file are not constrained by the CVs.
+    """
+
+    def __init__(self, cv_dir, cache_dir):
+        self._cv_dir = os.path.abspath(cv_dir)
+        self._cache_dir = os.path.expanduser(cache_dir)
+
+
+    def _get_cv_names(self, drs_config):
+        "returns list of (position, name of CV) for the facets of the DRS"
+        cv_names = drs_config.get('cv_names', {})
+        return [(pos, cv_names.get(name, name))
+                for pos, name in enumerate(drs_config['facet_names'])]
+
+
+    def _find_cv_files(self, prefix, drs_config):
+        "returns list of (position, cv_name, path) for the CV files that exist"
+        found = []
+        for pos, cv_name in self._get_cv_names(drs_config):
+            for filename in ('{}_{}.json'.format(prefix, cv_name),
+                             '{}.json'.format(cv_name)):
+                path = os.path.join(self._cv_dir, filename)
+                if os.path.isfile(path):
+                    found.append((pos, cv_name, path))
+                    break
+        return found
+
+
+    def _get_signature(self, cv_files):
+        "something that changes whenever any of the CV files change"
+        signature = [_cache_format]
+        for pos, cv_name, path in cv_files:
+            s = os.stat(path)
+            signature.append((pos, cv_name, path, s.st_size, s.st_mtime_ns))
+        return signature
+
+
+    def _get_cache_path(self, project):
+        dir_hash = hashlib.sha1(self._cv_dir.encode()).hexdigest()[:12]
+        return os.path.join(self._cache_dir, 'cv_{}_{}.pickle'.format(project, dir_hash))
+
+
+    def _read_cv_file(self, path, cv_name):
+        with open(path) as f:
+            content = json.load(f)
+        try:
+            vals = content[cv_name]
+        except (KeyError, TypeError):
+            raise ValueError("CV file {} does not contain '{}'".format(path, cv_name))
+        return frozenset(vals)
+
+
+    def _compile(self, cv_files):
+        return dict((pos, self._read_cv_file(path, cv_name))
+                    for pos, cv_name, path in cv_files)
+
+
+    def _read_cache(self, cache_path, signature):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            return None
+        if cached.get('signature') != signature:
+            return None
+        return cached['allowed_vals']
+
+
+    def _write_cache(self, cache_path, signature, allowed_vals):
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        tmp_path = '{}.tmp{}'.format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'signature': signature, 'allowed_vals': allowed_vals},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+    def load(self, project, project_config):
+        """
+        Returns a dictionary of {facet_position: frozenset_of_allowed_values}
+        for the facets of the project's DRS that have CV files, or None if
+        the project has no CV files in the CV directory
+        """
+        prefix = project_config.get('cv_prefix', project)
+        drs_config = project_config['drs']
+
+        cv_files = self._find_cv_files(prefix, drs_config)
+        if not cv_files:
+            return None
+
+        signature = self._get_signature(cv_files)
+        cache_path = self._get_cache_path(project)
+
+        allowed_vals = self._read_cache(cache_path, signature)
+        if allowed_vals == None:
+            allowed_vals = self._compile(cv_files)
+            try:
+                self._write_cache(cache_path, signature, allowed_vals)
+            except OSError:
+                # not being able to cache is not fatal
+                pass
+        return allowed_vals
@@ -1,39 +1,133 @@
 import os
 import re
+import collections
+
+
+class FacetError(collections.namedtuple('FacetError', 'position name value reason')):
+    """
+    Reason why a dataset ID or path failed validation.  The position and name
+    of the facet are None for problems that are not specific to one facet.
+    """
+    def __str__(self):
+        if self.position == None:
+            return self.reason
+        return "facet {} ({}) '{}': {}".format(self.position, self.name, self.value, self.reason)
+
+
+# result of validating one item: the item as given, the dataset ID
+# (or None if it could not be formed) and a list of FacetError
+ValidationResult = collections.namedtuple('ValidationResult', 'item dataset_id errors')
+
+
+class DRSValidator(object):
+    """
+    Validator compiled from a project's DRS config, with the allowed values
+    held as frozen sets and the version pattern precompiled, so that large
+    numbers of dataset IDs or paths can be checked cheaply.
+    """
+
+    is_version = re.compile('v[0-9]+').fullmatch
+
+    def __init__(self, drs_config, extra_allowed_vals=None):
+        self.num_facets = drs_config['num_facets']
+        self.facet_names = (drs_config.get('facet_names') or
+                            ['facet{}'.format(pos) for pos in range(self.num_facets)])
+        allowed = dict((pos, set(vals)) for pos, vals
+                       in drs_config['facet_allowed_vals'].items())
+        # (the lists in the DRS config are kept as they are, as a CV can be
+        # shared with another project, e.g. PRIMAVERA uses the CMIP6 CVs)
+        for pos, vals in (extra_allowed_vals or {}).items():
+            allowed.setdefault(pos, set(vals))
+        self._allowed = [(pos, self.facet_names[pos], frozenset(vals))
+                         for pos, vals in sorted(allowed.items())]
+
+
+    def validate_facets(self, facets):
+        "Returns a list of FacetError (empty if the list of facet values is valid)"
+        if len(facets) != self.num_facets:
+            return [FacetError(None, None, None,
+                               "has {} facets (expected {})".format(len(facets), self.num_facets))]
+        errors = []
+        names = self.facet_names
+        for pos, facet in enumerate(facets):
+            if not facet:
+                errors.append(FacetError(pos, names[pos], facet, "empty value"))
+        for pos, name, vals in self._allowed:
+            facet = facets[pos]
+            if facet and facet not in vals:
+                errors.append(FacetError(pos, name, facet, "not an allowed value"))
+        version = facets[-1]
+        if version and not self.is_version(version):
+            errors.append(FacetError(self.num_facets - 1, names[-1], version,
+                                     "not a version (v<number>)"))
+        return errors
+
+
+    def split_path(self, path):
+        "Returns the facets implied by the last elements of a directory path"
+        return os.path.normpath(path).split('/')[-self.num_facets :]
+
+
+    def validate_many(self, items):
+        """
+        Validates an iterable of dataset IDs and/or dataset directory paths
+        (anything containing '/' is taken to be a path), returning a list of
+        ValidationResult in the same order.
+        """
+        results = []
+        append = results.append
+        validate = self.validate_facets
+        split_path = self.split_path
+        num_facets = self.num_facets
+        allowed = [(pos, vals) for pos, name, vals in self._allowed]
+        is_version = self.is_version
+        for item in items:
+            if '/' in item:
+                facets = split_path(item)
+            else:
+                facets = item.split('.')
+            # fast path for valid items, falling back to the full diagnosis
+            if (len(facets) == num_facets and '' not in facets
+                and all(facets[pos] in vals for pos, vals in allowed)
+                and is_version(facets[-1])):
+                append(ValidationResult(item, '.'.join(facets), []))
+            else:
+                append(ValidationResult(item, None, validate(facets)))
+        return results
 
 
 class DatasetDRS(object):
     
-    def __init__(self, drs_config):
+    def __init__(self, drs_config, extra_allowed_vals=None):
+        """
+        extra_allowed_vals is an optional dictionary of {facet_position: values}
+        (e.g. from CV files) to allow for those facets that the DRS config
+        does not already give a list of allowed values for
+        """
         self._drs_config = drs_config
+        self.validator = DRSValidator(drs_config, extra_allowed_vals=extra_allowed_vals)
 
     def _plausible_facets(self, facets):
         """
         Test if a list of facet values is plausible.
         Returns a boolean
         """
+        return not self.validator.validate_facets(facets)
 
-        if len(facets) != self._drs_config['num_facets']:
-            return False
-
-        for facet in facets:
-            if not facet:
-                return False
 
-        for pos, vals in self._drs_config['facet_allowed_vals'].items():
+    def get_dataset_id_errors(self, dataset_id):
+        "Returns a list of FacetError describing why a dataset ID is not valid"
+        return self.validator.validate_facets(dataset_id.split('.'))
 
-            if facets[pos] not in vals:
-                return False
 
-        if not self._is_version_number_facet(facets[-1]):
-            return False
-
-        return True
+    def get_dir_errors(self, dirname):
+        "Returns a list of FacetError describing why a dataset directory is not valid"
+        return self.validator.validate_facets(self.validator.split_path(dirname))
 
 
     def _is_version_number_facet(self, val):
 
-        return re.match("^v[0-9]+$", val) != None
+        return self.validator.is_version(val) != None
 
 
     def plausible_dataset_id(self, dataset_id):
@@ -44,6 +138,46 @@ class DatasetDRS(object):
         return self._plausible_facets(dataset_id.split('.'))
 
 
+    @property
+    def num_facets(self):
+        return self._drs_config['num_facets']
+
+
+    def is_version_dir_name(self, name):
+        "whether a directory name looks like a version (v<number>)"
+        return self._is_version_number_facet(name)
+
+
+    @property
+    def facet_names(self):
+        "names of the facets of the dataset ID, in order"
+        return self._drs_config['facet_names']
+
+
+    def get_facet_position(self, name):
+        """
+        Returns the position of a facet in the dataset ID, given its name.
+        The '_id' suffix may be omitted (e.g. 'institution' for 'institution_id').
+        Raises ValueError if there is no such facet.
+        """
+        for pos, facet_name in enumerate(self.facet_names):
+            if facet_name in (name, name + '_id'):
+                return pos
+        raise ValueError("unknown facet '{}' (should be one of: {})"
+                         .format(name, ' '.join(self.facet_names)))
+
+
+    def split_dataset_id(self, dataset_id):
+        """
+        Splits a dataset ID into its list of facet values, or returns None if
+        it does not have the right number of facets
+        """
+        facets = dataset_id.split('.')
+        if len(facets) != self._drs_config['num_facets']:
+            return None
+        return facets
+
+
     def dir_to_dataset_id(self, dirname):
         """
         Converts a directory name to the dataset ID if it looks like a valid 
@@ -0,0 +1,127 @@
+"""
+Index of known dataset IDs, used to resolve wildcarded dataset specs.
+"""
+
+import os
+import re
+import array
+import fnmatch
+
+
+_wildcard_chars = re.compile(r'[*?[]')
+
+
+def is_wildcard_spec(spec):
+    "whether a dataset spec contains shell-style wildcards"
+    return _wildcard_chars.search(spec) != None
+
+
+class DatasetIDIndex(object):
+    """
+    Holds a set of dataset IDs for a project, with a posting list per facet
+    value (the numbers of the dataset IDs that have that value at that
+    position).  A facet-wise wildcard pattern is resolved by matching each
+    facet pattern against the distinct values of that facet only, and then
+    intersecting the posting lists, smallest first.
+    """
+
+    def __init__(self, drs):
+        self._drs = drs
+        self._ids = []
+        self._numbers = {}
+        self._postings = None
+
+
+    def add(self, dataset_id):
+        """
+        Adds a dataset ID to the index.  Returns False (and ignores it) if it
+        does not have the right number of facets for the project.
+        """
+        facets = self._drs.split_dataset_id(dataset_id)
+        if not facets:
+            return False
+        if dataset_id not in self._numbers:
+            if self._postings == None:
+                self._postings = [{} for _ in facets]
+            number = len(self._ids)
+            self._ids.append(dataset_id)
+            self._numbers[dataset_id] = number
+            for postings, val in zip(self._postings, facets):
+                try:
+                    postings[val].append(number)
+                except KeyError:
+                    postings[val] = array.array('L', [number])
+        return True
+
+
+    def add_many(self, dataset_ids):
+        for dataset_id in dataset_ids:
+            self.add(dataset_id)
+
+
+    def add_from_file(self, path):
+        "Adds dataset IDs listed one per line in a file"
+        with open(path) as f:
+            self.add_many(line.strip() for line in f)
+
+
+    def add_from_directory(self, path, fs=None):
+        """
+        Adds the dataset IDs of all DRS version directories found under a
+        directory.  Does not descend into version directories.  The walk uses
+        the filesystem object fs if given.
+        """
+        walk = fs.walk if fs else os.walk
+        for root, dirs, files in walk(path):
+            for dn in list(dirs):
+                if self._drs.is_version_dir_name(dn):
+                    dataset_id = self._drs.dir_to_dataset_id(os.path.join(root, dn))
+                    if dataset_id:
+                        self.add(dataset_id)
+                    dirs.remove(dn)
+
+
+    def __len__(self):
+        return len(self._ids)
+
+
+    def match(self, pattern):
+        """
+        Returns a list of the indexed dataset IDs matching a dot-separated
+        pattern of shell-style wildcards (one per facet), in the order in which
+        they were added.
+        """
+        facet_patterns = pattern.split('.')
+        if len(facet_patterns) != self._drs.num_facets:
+            raise ValueError("pattern {} should have {} dot-separated facets"
+                             .format(pattern, self._drs.num_facets))
+        if not self._ids:
+            return []
+
+        candidates = []
+        for postings, facet_pattern in zip(self._postings, facet_patterns):
+            if facet_pattern == '*':
+                continue
+            if is_wildcard_spec(facet_pattern):
+                matcher = re.compile(fnmatch.translate(facet_pattern)).match
+                lists = [numbers for val, numbers in postings.items() if matcher(val)]
+            else:
+                lists = [postings[facet_pattern]] if facet_pattern in postings else []
+            candidates.append(lists)
+
+        if not candidates:
+            return list(self._ids)
+
+        candidates.sort(key=lambda lists: sum(len(numbers) for numbers in lists))
+        matches = set()
+        for numbers in candidates[0]:
+            matches.update(numbers)
+        for lists in candidates[1:]:
+            if not matches:
+                break
+            allowed = set()
+            for numbers in lists:
+                allowed.update(matches.intersection(numbers))
+            matches = allowed
+
+        return [self._ids[number] for number in sorted(matches)]
@@ -0,0 +1,40 @@
+"""
+Exceptions raised when adding datasets to, or querying, the publication
+system.
+"""
+
+
+class PublicationError(Exception):
+    "Base class for the errors below"
+
+
+class InvalidDatasetIDError(PublicationError, ValueError):
+    "A dataset ID (or a directory path standing for one) does not fit the project's DRS"
+
+
+class DatasetValidationError(PublicationError):
+    """
+    A dataset directory cannot be ingested (e.g. it contains non-netCDF
+    files or files that the ingestion user cannot read)
+    """
+
+
+class IngestionUserError(PublicationError):
+    "The ingestion user, as whom dataset directories are checked, does not exist on this host"
+
+
+class ServiceError(PublicationError):
+    "The publication system web service could not be reached, or gave an unusable response"
+
+
+class ThrottledError(ServiceError):
+    "The web service has asked the client to slow down"
+
+    def __init__(self, message, retry_after=None, url=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.url = url
+
+
+class SubmissionError(PublicationError):
+    "The publication system did not accept a dataset"
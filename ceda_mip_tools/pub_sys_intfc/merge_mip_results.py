@@ -0,0 +1,147 @@
+"""
+Merges the per-shard result files from batch jobs run with --shard (the
+--report files from add-to-mip, or the --json, --csv or --ndjson output of
+mip-dataset-status) into one report, and shows the number of datasets
+in each status.
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+import collections
+
+
+class MIPResultsMerger(object):
+
+    def _parse_args(self, arg_list=None):
+
+        "Parses arguments and returns parsed args object."
+
+        parser = argparse.ArgumentParser(description=__doc__)
+
+        parser.add_argument('paths', nargs='+', metavar='filename',
+                            help=('result files to merge; the format of each is taken from its '
+                                  'extension (.json, .csv, otherwise newline-delimited JSON)'))
+
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--json', '-j', metavar='filename',
+                           help="write merged results in JSON format to specified file ('-' for standard output)")
+        group.add_argument('--csv', '-c', metavar='filename',
+                           help="write merged results in CSV format to specified file ('-' for standard output)")
+        group.add_argument('--ndjson', '-n', metavar='filename',
+                           help=("write merged results in newline-delimited JSON format "
+                                 "to specified file ('-' for standard output)"))
+
+        parser.add_argument('--overwrite', '-O', action='store_true', help='overwrite existing output file')
+
+        parser.add_argument('--sort', action='store_true',
+                            help='sort the merged results by dataset ID (default: in order of the input files)')
+
+        args = parser.parse_args(arg_list or sys.argv[1:])
+
+        for path in args.paths:
+            if not os.path.exists(path):
+                parser.error("Input file {} does not exist".format(path))
+
+        output = args.json or args.csv or args.ndjson
+        if output and output != '-' and os.path.exists(output) and not args.overwrite:
+            parser.error("Output file '{}' already exists".format(output))
+
+        return args
+
+
+    def _read_records(self, path):
+        "yields a dictionary for each dataset in a result file"
+        with open(path) as f:
+            if path.endswith('.json'):
+                yield from json.load(f)['datasets']
+            elif path.endswith('.csv'):
+                reader = csv.reader(f)
+                headers = [s.lower().replace(' ', '_') for s in next(reader)]
+                for row in reader:
+                    yield dict(zip(headers, row))
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+    def _merge(self, paths, sort=False):
+        """
+        Returns (fields, records) for all the input files.  Where the
+        records are numbered (as in mip-dataset-status output), they are
+        renumbered in order.
+        """
+        fields = []
+        records = []
+        for path in paths:
+            for record in self._read_records(path):
+                for field in record:
+                    if field not in fields:
+                        fields.append(field)
+                records.append(record)
+
+        if sort:
+            records.sort(key=lambda record: record.get('dataset_id') or '')
+
+        if 'count' in fields:
+            for count, record in enumerate(records, 1):
+                record['count'] = count
+
+        return fields, records
+
+
+    def _get_write_fh(self, path):
+        return sys.stdout if path == '-' else open(path, 'w')
+
+
+    def _write(self, args, fields, records):
+        if args.json:
+            with self._get_write_fh(args.json) as f:
+                json.dump({'datasets': records, 'num_found': len(records)}, f)
+                f.write("\n")
+        elif args.csv:
+            with self._get_write_fh(args.csv) as f:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                for record in records:
+                    writer.writerow([record.get(field) for field in fields])
+        elif args.ndjson:
+            with self._get_write_fh(args.ndjson) as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+        else:
+            return
+        path = args.json or args.csv or args.ndjson
+        if path != '-':
+            print('wrote ' + path)
+
+
+    def _show_counts(self, records, writer=print):
+        counts = collections.Counter(record.get('status') for record in records)
+        dataset_ids = [record['dataset_id'] for record in records if record.get('dataset_id')]
+        duplicates = len(dataset_ids) - len(set(dataset_ids))
+        writer("{} results:".format(len(records)))
+        for status, count in sorted(counts.items(), key=lambda item: str(item[0])):
+            writer("  {:15} {}".format(status, count))
+        if duplicates:
+            writer("WARNING: {} dataset IDs appear more than once".format(duplicates))
+
+
+    def run(self):
+        args = self._parse_args()
+        try:
+            fields, records = self._merge(args.paths, sort=args.sort)
+        except (KeyError, ValueError, StopIteration) as exc:
+            print("ERROR: could not read results: {}".format(exc))
+            sys.exit(1)
+        self._write(args, fields, records)
+        if not (args.json == '-' or args.csv == '-' or args.ndjson == '-'):
+            self._show_counts(records)
+
+
+def main():
+    merger = MIPResultsMerger()
+    merger.run()
@@ -0,0 +1,114 @@
+"""
+Audits the chunking and compression of the netCDF files in MIP dataset
+directories, reading only the variables' metadata, and summarises per
+dataset any layouts that will make reading slow or waste space.  The files
+of all the directories given are audited in parallel.
+"""
+
+import os
+import sys
+import json
+
+from ceda_mip_tools.pub_sys_intfc import config, util
+from ceda_mip_tools.pub_sys_intfc.chunk_audit import audit_files, summarise
+
+
+class MIPChunkAuditor(object):
+
+    def _parse_args(self, arg_list=None):
+
+        "Parses arguments and returns parsed args object."
+
+        dirs_help = ("Dataset directory with format ${BASEDIR}/${DRS_DIRS}/${VERSION_DIR} "
+                     "(or any directory containing netCDF files)")
+
+        parser = util.ArgsFromCmdLineOrFileParser('dirs', 'dataset directories',
+                                                  var_meta='dir',
+                                                  var_help=dirs_help,
+                                                  description=__doc__)
+
+        parser.add_standard_arguments()
+
+        parser.add_argument('--jobs', '-J', type=int, metavar='num',
+                            default=config.chunk_audit_jobs,
+                            help=("number of files to audit at a time, in separate processes "
+                                  "(default: {})").format(config.chunk_audit_jobs))
+
+        parser.add_argument('--verbose', '-v', action='store_true',
+                            help='also list the directories with nothing flagged')
+
+        parser.add_argument('--ndjson', '-n', metavar='filename',
+                            help=("write the findings for each file in newline-delimited JSON "
+                                  "format to specified file ('-' for standard output)"))
+
+        return parser.parse_args(arg_list or sys.argv[1:])
+
+
+    def _list_files(self, path):
+        "returns a sorted list of the netCDF files in and below a directory"
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names)
+                         if name.endswith('.nc'))
+        return files
+
+
+    def _report(self, path, results, verbose=False, ndjson_fh=None):
+        "Reports on the list of (file, findings) for one directory and returns whether any were flagged"
+        lines = summarise(results)
+        if not results:
+            print("NO FILES: {}".format(path))
+        elif lines:
+            print("FLAGGED: {}".format(path))
+            for line in lines:
+                print("    {}".format(line))
+        elif verbose:
+            print("OK: {}".format(path))
+        if ndjson_fh:
+            for file_path, findings in results:
+                ndjson_fh.write(json.dumps({'dir': path,
+                                            'path': file_path,
+                                            'findings': [finding._asdict()
+                                                         for finding in findings]}) + "\n")
+        return bool(lines)
+
+
+    def run(self):
+        args = self._parse_args()
+
+        dirs_files = []
+        for path in args.dirs:
+            if not os.path.isdir(path):
+                print("{} is not a directory".format(path))
+                sys.exit(1)
+            dirs_files.append((path, self._list_files(path)))
+
+        if args.ndjson == '-':
+            ndjson_fh = sys.stdout
+        elif args.ndjson:
+            ndjson_fh = open(args.ndjson, 'w')
+        else:
+            ndjson_fh = None
+
+        # the files of all the directories go through one pool of processes,
+        # and each directory is reported as soon as its files are done
+        all_files = [file_path for _, files in dirs_files for file_path in files]
+        audited = audit_files(all_files, jobs=args.jobs)
+        num_flagged = 0
+        for path, files in dirs_files:
+            results = [next(audited) for _ in files]
+            if self._report(path, results, verbose=args.verbose, ndjson_fh=ndjson_fh):
+                num_flagged += 1
+
+        if ndjson_fh and ndjson_fh != sys.stdout:
+            ndjson_fh.close()
+
+        print("{} directories ({} files) audited, {} flagged".format(
+                len(dirs_files), len(all_files), num_flagged))
+        sys.exit(1 if num_flagged else 0)
+
+
+def main():
+    auditor = MIPChunkAuditor()
+    auditor.run()
@@ -4,22 +4,36 @@ Checks the publication status of MIP dataset(s)
 
 import os
 import sys
+import time
+import datetime
 import requests
 import argparse
 import json
 import csv
+import contextlib
+import collections
 
 from ceda_mip_tools.pub_sys_intfc import config, util
+from ceda_mip_tools.pub_sys_intfc import status_cache, client
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.dataset_index import DatasetIDIndex, is_wildcard_spec
 
 
 _statuses = ['not_started', 'in_progress', 'completed', 'failed', 'ALL']
 
+
 class MIPStatusChecker(object):
+    """
+    The mip-dataset-status command: the queries are made through a
+    PublicationClient, and this handles the arguments, the resolution of
+    wildcarded dataset specs and the output
+    """
 
     def __init__(self,
                  configuration=config.configuration):
         self._configuration = configuration
-        self._api_url_root = None        
+        self._client = None
+        self._index = None
 
 
     def _parse_args(self, arg_list=None):
@@ -31,23 +45,40 @@ class MIPStatusChecker(object):
                              "add-mip-dataset although a directory path with the format "
                              "${BASEDIR}/${DRS_DIRS}/${VERSION_DIR} "
                              "will be accepted as an alternative. "
-                             "Any number of dataset IDs may be specified.")
+                             "Any number of dataset IDs may be specified. "
+                             "A dataset ID may contain shell-style wildcards in any of its "
+                             "facets (e.g. CMIP6.CMIP.MOHC.*.historical.*.Amon.*.*.v*), "
+                             "which are matched against the dataset IDs known from the status "
+                             "cache, --id-index files and --index-dir directories.")
 
         parser = util.ArgsFromCmdLineOrFileParser('dataset_specs', 'dataset specifiers', 
                                                   var_meta='dataset_spec',
                                                   var_help=dataset_spec_help,
                                                   description=__doc__,
-                                                  allow_empty_list=True)
+                                                  allow_empty_list=True,
+                                                  allow_lazy=True)
 
         util.add_project_arg(parser)
         parser.add_standard_arguments()
+        util.add_cv_dir_arg(parser)
         util.add_api_root_arg(parser)
+        util.add_jobs_arg(parser)
+        util.add_stats_args(parser)
 
         group = parser.add_mutually_exclusive_group()
         group.add_argument('--json', '-j', metavar='filename', 
                            help="write output in JSON format to specified file ('-' for standard output)")
         group.add_argument('--csv', '-c', metavar='filename', 
                            help="write output in CSV format to specified file ('-' for standard output)")
+        group.add_argument('--ndjson', '-n', metavar='filename', 
+                           help=("write output in newline-delimited JSON format (one dataset per line) "
+                                 "to specified file ('-' for standard output)"))
+        group.add_argument('--fixed-width', '-w', metavar='width', type=int,
+                           nargs='?', const=config.fixed_table_width,
+                           help=("write the table to standard output as results arrive, with the "
+                                 "dataset ID column fixed at this width (default {}) instead of "
+                                 "waiting for all results to find the longest ID"
+                                 ).format(config.fixed_table_width))
 
         parser.add_argument('--overwrite', '-O', action='store_true', help='overwrite existing output file')
 
@@ -60,6 +91,66 @@ class MIPStatusChecker(object):
         parser.add_argument('--requester', type=str, metavar='requester',
                             help='show datasets for another requester')
 
+        parser.add_argument('--cache', metavar='filename', nargs='?',
+                            const=config.status_cache_file,
+                            help=('record the statuses found in a local cache file (default {}); '
+                                  'this is implied by --refresh and --changed-since'
+                                  ).format(config.status_cache_file))
+
+        parser.add_argument('--refresh', '-r', action='store_true',
+                            help=('only query datasets whose cached status is not {} or whose '
+                                  'cache entry is older than --cache-ttl, and take the other '
+                                  'statuses from the cache').format(' or '.join(status_cache.terminal_statuses)))
+
+        parser.add_argument('--cache-ttl', type=float, metavar='seconds',
+                            default=config.status_cache_ttl,
+                            help=('with --refresh, re-query finished datasets whose cache entry '
+                                  'is older than this (default {:g})').format(config.status_cache_ttl))
+
+        parser.add_argument('--changed-since', metavar='when',
+                            help=("after the output, report status changes recorded in the cache since "
+                                  "this time ('YYYY-MM-DD[THH:MM[:SS]]' local time, or 'last' for "
+                                  "the start of the previous run)"))
+
+        parser.add_argument('--id-index', metavar='filename', action='append', default=[],
+                            help=('file listing known dataset IDs (one per line), against which '
+                                  'wildcarded dataset IDs are matched (may be repeated)'))
+
+        parser.add_argument('--index-dir', metavar='directory', action='append', default=[],
+                            help=('directory to scan for DRS version directories, whose dataset IDs '
+                                  'are used for matching wildcarded dataset IDs (may be repeated)'))
+
+        util.add_manifest_arg(parser)
+        util.add_shard_arg(parser)
+
+        parser.add_argument('--summary-by', metavar='facets',
+                            help=('instead of listing the datasets, show counts of datasets in each '
+                                  'status, broken down by these comma-separated DRS facets '
+                                  "(e.g. 'institution_id,experiment_id'); use '' for overall counts. "
+                                  'Output is a table unless --csv or --json is used'))
+
+        parser.add_argument('--watch', action='store_true',
+                            help=('keep polling the specified datasets that have not yet finished, '
+                                  'printing only status changes, until all have finished. '
+                                  'Exits with status {} if all completed, {} if any failed or are '
+                                  'unknown, or {} if --watch-timeout was reached'
+                                  ).format(client.watch_exit_completed, client.watch_exit_failed,
+                                           client.watch_exit_timeout))
+
+        parser.add_argument('--watch-interval', type=float, metavar='seconds',
+                            default=config.watch_min_interval,
+                            help=('with --watch, initial polling interval, to which it returns '
+                                  'whenever a status changes (default {:g})'
+                                  ).format(config.watch_min_interval))
+
+        parser.add_argument('--watch-max-interval', type=float, metavar='seconds',
+                            default=config.watch_max_interval,
+                            help=('with --watch, the polling interval grows while no statuses change, '
+                                  'up to this value (default {:g})').format(config.watch_max_interval))
+
+        parser.add_argument('--watch-timeout', type=float, metavar='seconds',
+                            help='with --watch, give up after this long')
+
         args = parser.parse_args(arg_list or sys.argv[1:])
 
         if not args.dataset_specs and not args.status:
@@ -69,124 +160,197 @@ class MIPStatusChecker(object):
         if args.dataset_specs and args.status:
             raise ValueError("You cannot specify both the dataset IDs and the processing status to search for.")
 
-        return args
-
-    
-    def _get_dataset_id(self, dataset_spec):
-        "Turn a dataset spec (dataset ID or doc string) into a dataset ID"
-
-        if '/' in dataset_spec:
-            dataset_id = self._drs.dir_to_dataset_id(dataset_spec)
-            if dataset_id == None:
-                raise ValueError(("{} looks like a directory but cannot be mapped into a dataset ID"
-                                  ).format(dataset_spec))
-            else:
-                return dataset_id
-        elif '*' in dataset_spec:
-            raise ValueError('wildcard in dataset spec is not supported')
-        elif self._drs.plausible_dataset_id(dataset_spec):
-            return dataset_spec
-
-        else:
-            raise ValueError(("{} does not looks like a valid dataset identifier"
-                              ).format(dataset_spec))
+        if args.watch and not args.dataset_specs:
+            raise ValueError("--watch can only be used when dataset IDs are specified.")
 
+        if args.watch and (args.json or args.csv or args.ndjson or args.fixed_width):
+            raise ValueError("--watch cannot be used with an output format option.")
 
-    def _get_dataset_ids(self, args):
-        return [self._get_dataset_id(spec) for spec in args.dataset_specs]
-
+        if args.summary_by != None:
+            if args.ndjson or args.fixed_width:
+                raise ValueError("--summary-by can only be used with --csv or --json output.")
+            if args.watch:
+                raise ValueError("--summary-by cannot be used with --watch.")
+            args.summary_by = [name for name in args.summary_by.split(',') if name]
 
-    def _get_dataset_statuses_page(self, dataset_ids):
-        "Query the API for multiple datasets, and get the status string (or None if not found)"
+        if args.refresh and not args.dataset_specs:
+            raise ValueError("--refresh can only be used when dataset IDs are specified.")
 
-        query_params = { 'dataset_id': ','.join(dataset_ids),
-                         'chain': self._chain,
-                         'configuration': self._configuration,
-                         'requester': self._requester,
-                         'max_items': len(dataset_ids) }
+        if args.lazy and (args.watch or args.refresh):
+            raise ValueError("--lazy cannot be used with --watch or --refresh, which need "
+                             "the whole list of dataset IDs.")
 
-        fields = self._get_response(query_params)
+        if args.changed_since:
+            args.changed_since = self._parse_time_arg(args.changed_since)
 
-        # this following assertion would fail if either:
-        # - dataset ID matches more than one dataset (it shouldn't because configuration is in the query)
-        # - or if server disallows the number we asked for simultaneously
-        assert(len(fields['datasets']) == fields['num_found'])
+        if (args.refresh or args.changed_since) and not args.cache:
+            args.cache = config.status_cache_file
 
-        results_dict = dict((ds['dataset_id'], ds['status']) for ds in fields['datasets'])
-
-        return [(dataset_id, results_dict.get(dataset_id, 'UNKNOWN'))
-                for dataset_id in dataset_ids]
+        util.parse_jobs_arg(args)
 
+        return args
 
-    def _get_dataset_statuses(self, dataset_ids):
-        results = []
-        for page in util.paginate_list(dataset_ids, config.max_query_datasets):
-            results.extend(self._get_dataset_statuses_page(page))
-        return results
 
+    _time_formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d']
 
-    def _get_results_for_status(self, status):
-        """Query the API for all datasets with specified status, 
-        and translate the results into a _Results object"""
+    def _parse_time_arg(self, when):
+        "Returns 'last' unchanged, or converts a local time string to seconds since the epoch"
+        if when == 'last':
+            return when
+        for fmt in self._time_formats:
+            try:
+                return time.mktime(datetime.datetime.strptime(when, fmt).timetuple())
+            except ValueError:
+                pass
+        raise ValueError("could not parse time '{}'".format(when))
 
-        query_params = { 'dataset_id': '**',
-                         'chain': self._chain,
-                         'configuration': self._configuration,
-                         'requester': self._requester}
-        
-        if status != 'ALL':
-            query_params['status'] = status
-
-
-        # paginated query
-        # on the last page, 'cursor' is not set, and it will return
-        all = []
-        while True:
-            fields = self._get_response(query_params)
-            
-            all.extend(((ds['dataset_id'], ds['status'])
-                        for ds in fields['datasets']))
-            
-            if 'cursor' in fields:
-                if 'cursor' in query_params:
-                    # sanity check against infinite loop
-                    assert(query_params['cursor'] != fields['cursor'])
-                query_params['cursor'] = fields['cursor']
+    
+    def _get_dataset_ids(self, args):
+        """
+        Turn the dataset specs into dataset IDs, expanding any wildcards.
+        Other specs are validated in bulk between wildcards.
+        """
+        return list(self._iter_dataset_ids(args, config.validation_chunk_size))
+
+
+    def _iter_dataset_ids(self, args, chunk_size):
+        """
+        As _get_dataset_ids, but yields the dataset IDs as the specs are
+        read, validating up to chunk_size specs at a time, so that with
+        --lazy, queries start before the whole list has been read.  An
+        invalid spec raises InvalidDatasetIDError when it is reached.
+        """
+        specs = []
+        for spec in args.dataset_specs:
+            if is_wildcard_spec(spec) and '/' not in spec:
+                yield from self._client.validate_specs(specs)
+                specs = []
+                yield from self._resolve_wildcard_spec(spec, args)
             else:
-                return all
+                specs.append(spec)
+                if len(specs) >= chunk_size:
+                    yield from self._client.validate_specs(specs)
+                    specs = []
+        yield from self._client.validate_specs(specs)
+
+
+    def _get_index(self, args):
+        """
+        Build (on first use) the index of known dataset IDs, from the status cache
+        (if in use, or if the default cache exists) and the --id-index and
+        --index-dir options
+        """
+        if self._index == None:
+            index = DatasetIDIndex(self._client.drs)
+            cache = self._client.cache
+            if not cache and os.path.exists(os.path.expanduser(config.status_cache_file)):
+                cache = status_cache.StatusCache(config.status_cache_file,
+                                                 self._configuration, self._client.chain)
+            if cache:
+                index.add_many(cache.get_dataset_ids())
+                if cache != self._client.cache:
+                    cache.close()
+            for path in args.id_index:
+                index.add_from_file(path)
+            for path in args.index_dir:
+                index.add_from_directory(path, fs=self._client.fs)
+            self._index = index
+        return self._index
+
+
+    def _resolve_wildcard_spec(self, spec, args):
+        "Returns the known dataset IDs matching a wildcarded dataset spec"
+        index = self._get_index(args)
+        if not index:
+            raise ValueError(("cannot resolve wildcarded dataset spec {} as no dataset IDs are known "
+                              "(use --id-index or --index-dir, or a status cache)").format(spec))
+        dataset_ids = index.match(spec)
+        if not dataset_ids:
+            raise ValueError("no known dataset IDs match {}".format(spec))
+        return dataset_ids
+
+
+    def _report_changes(self, since, writer=print):
+        transitions = self._client.cache.get_transitions_since(since)
+        writer()
+        writer("Status changes since {}:".format(time.strftime('%Y-%m-%d %H:%M:%S',
+                                                               time.localtime(since))))
+        for dataset_id, old_status, new_status, when in transitions:
+            writer("{}  {}: {} -> {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)),
+                                              dataset_id, old_status, new_status))
+        if not transitions:
+            writer("(none)")
+
+
+    def _select_shard(self, pages, sharder):
+        "filters pages of (dataset_id, status) to those in one shard"
+        for page in pages:
+            yield [result for result in page if sharder.includes(result[0])]
 
 
-    def _get_response(self, query_params):
-        
-        return util.do_post_expecting_json(self._api_url_root + config.api_query_suffix,
-                                           query_params,
-                                           description='publication system',
-                                           compulsory_fields=('datasets', 'num_found'))
-
     def run(self):
+        summary_positions = None
         try:
             args = self._parse_args()
-            self._drs, self._chain = util.parse_project_arg(args)
-            dataset_ids = self._get_dataset_ids(args)
+            self._client = PublicationClient(args.project, api_url_root=args.api_url_root,
+                                             requester=args.requester, jobs=args.jobs,
+                                             cv_dir=args.cv_dir, manifest=args.manifest,
+                                             cache_file=args.cache,
+                                             configuration=self._configuration)
+            if args.lazy:
+                dataset_ids = self._iter_dataset_ids(args, config.max_query_datasets)
+            else:
+                dataset_ids = self._get_dataset_ids(args)
+            sharder = util.parse_shard_arg(args)
+            if sharder:
+                dataset_ids = sharder.select(dataset_ids)
+                if not args.lazy:
+                    dataset_ids = list(dataset_ids)
+            if args.summary_by != None:
+                summary_positions = [self._client.drs.get_facet_position(name)
+                                     for name in args.summary_by]
         except ValueError as exc:
             print(exc)
             sys.exit(1)
 
-        self._api_url_root = args.api_url_root
+        util.start_request_stats(args)
+        try:
+            self._run(args, dataset_ids, sharder, summary_positions)
+        except ValueError as exc:
+            # with --lazy, invalid dataset specs are only found as they are read
+            # (by which time the output, possibly standard output, has been closed)
+            print("{}; stopping".format(exc), file=sys.stderr)
+            sys.exit(1)
+        finally:
+            util.finish_request_stats(args)
+            self._client.close()
 
-        if args.requester:
-            self._requester = args.requester
-        else:
-            self._requester = util.get_user_name()
 
-        dataset_ids = self._get_dataset_ids(args)
+    def _run(self, args, dataset_ids, sharder, summary_positions):
+        "the main part of run(), once the arguments have been checked"
+        if self._client.cache:
+            previous_run = self._client.cache.record_run()
+            if args.changed_since == 'last':
+                args.changed_since = previous_run or 0.
         
-        if dataset_ids:
-            results = self._get_dataset_statuses(dataset_ids)
+        if args.watch:
+            exit_status = self._client.watch(dataset_ids, args.watch_interval,
+                                             args.watch_max_interval, timeout=args.watch_timeout)
+            sys.exit(exit_status)
+
+        if args.refresh:
+            pages = self._client.status_pages(dataset_ids, refresh=True, cache_ttl=args.cache_ttl)
+        elif args.dataset_specs:
+            pages = self._client.status_pages(dataset_ids)
         else:
-            results = self._get_results_for_status(args.status)
+            pages = self._client.iter_status_pages(args.status)
+            if sharder:
+                pages = self._select_shard(pages, sharder)
 
-        results = _ResultsWriter(results)
+        if args.summary_by != None:
+            results = _SummaryWriter(pages, self._client.drs, summary_positions)
+        else:
+            results = _ResultsWriter(pages)
         
         if args.overwrite:
             results.allow_overwrite()
@@ -197,66 +361,250 @@ class MIPStatusChecker(object):
         elif args.json:
             results.write_json(args.json)
 
+        elif args.summary_by != None:
+            results.dump()
+
+        elif args.ndjson:
+            results.write_ndjson(args.ndjson)
+
+        elif args.fixed_width:
+            results.dump_fixed_width(args.fixed_width)
+
         else:
             results.dump()
 
+        if args.changed_since != None:
+            self._report_changes(args.changed_since)
 
 
-class _ResultsWriter(object):
 
-    def __init__(self, results):
-        self.results = list(results)
+class _OutputWriter(object):
+    """
+    Base class for writers of results supplied as an iterable of pages, where
+    each page is a list of (dataset_id, status).
+    """
+
+    def __init__(self, pages):
+        self._pages = pages
         self._overwrite = False
 
+    def allow_overwrite(self, val=True):
+        self._overwrite = val
+
+    def _get_write_fh(self, path):
+        if path == '-':
+            return sys.stdout
+        else:
+            if os.path.exists(path) and not self._overwrite:
+                raise Exception("Not overwriting file {}".format(path))
+            return open(path, "w")            
+
+    @contextlib.contextmanager
+    def _open_output(self, path):
+        """
+        opens the output as _get_write_fh, removing the file if it is not
+        completed (e.g. with --lazy, if an invalid dataset spec is read)
+        """
+        with self._get_write_fh(path) as f:
+            try:
+                yield f
+            except BaseException:
+                if path != '-':
+                    f.close()
+                    os.remove(path)
+                raise
+
+
+class _ResultsWriter(_OutputWriter):
+    """
+    Writes the status of each dataset.  Apart from dump(), which needs all
+    the results to size the table, the writers handle each page as it
+    arrives and do not keep the results in memory.
+    """
+
     _headers = ['Count', 'Dataset ID', 'Status']
 
+    def _get_row_pages(self):
+        "yields list of (count, dataset_id, status) rows for each page"
+        count = 0
+        for page in self._pages:
+            rows = []
+            for dsid, status in page:
+                count += 1
+                rows.append((count, dsid, status))
+            yield rows
+
     def _get_rows(self):
-        for i, (dsid, status) in enumerate(self.results, start=1):
-            yield (i, dsid, status)
+        for rows in self._get_row_pages():
+            yield from rows
+
+    def _get_json_row_pages(self):
+        headers = [s.lower().replace(' ', '_') for s in self._headers]
+        for rows in self._get_row_pages():
+            yield [dict(zip(headers, row)) for row in rows]
 
     def dump(self, writer=print):
-        if self.results:
-            writer("Publication status for {} MIP datasets:".format(len(self.results)))
-            width = max((len(dsid) for dsid, status in self.results))
+        rows = list(self._get_rows())
+        if rows:
+            writer("Publication status for {} MIP datasets:".format(len(rows)))
+            width = max((len(dsid) for count, dsid, status in rows))
             formatter = "{:5}  {:{width}}  {}".format
             writer(formatter(*self._headers, width=width))
             line = "=" * (20 + width)
             writer(line)
-            for row in self._get_rows():
+            for row in rows:
                 writer(formatter(*row, width=width))
             writer(line)
         else:
             writer("No matching datasets")
 
-    def allow_overwrite(self, val=True):
-        self._overwrite = val
-
-    def _get_write_fh(self, path):
-        if path == '-':
-            return sys.stdout
+    def dump_fixed_width(self, width, writer=print):
+        "like dump(), but writes each page as it arrives, using a fixed column width"
+        formatter = "{:5}  {:{width}}  {}".format
+        line = "=" * (20 + width)
+        count = 0
+        for rows in self._get_row_pages():
+            for row in rows:
+                if not count:
+                    writer("Publication status for MIP datasets:")
+                    writer(formatter(*self._headers, width=width))
+                    writer(line)
+                writer(formatter(*row, width=width))
+                count += 1
+            sys.stdout.flush()
+        if count:
+            writer(line)
+            writer("{} MIP datasets".format(count))
         else:
-            if os.path.exists(path) and not self._overwrite:
-                raise Exception("Not overwriting file {}".format(path))
-            return open(path, "w")            
+            writer("No matching datasets")
 
     def write_csv(self, path):
-        with self._get_write_fh(path) as f:
+        with self._open_output(path) as f:
             row_writer = csv.writer(f).writerow
             row_writer(self._headers)
-            for row in self._get_rows():
+            for rows in self._get_row_pages():
+                for row in rows:
+                    row_writer(row)
+                f.flush()
+        if path != '-':
+            print('wrote ' + path)
+
+    def write_ndjson(self, path):
+        with self._open_output(path) as f:
+            for datasets in self._get_json_row_pages():
+                for dataset in datasets:
+                    f.write(json.dumps(dataset) + "\n")
+                f.flush()
+        if path != '-':
+            print('wrote ' + path)
+
+    def write_json(self, path):
+        """
+        Writes the same JSON document as serialising
+        {'datasets': [...], 'num_found': N} in one go, but a page at a time,
+        with num_found written at the end once it is known.
+        """
+        num_found = 0
+        with self._open_output(path) as f:
+            f.write('{"datasets": [')
+            for datasets in self._get_json_row_pages():
+                for dataset in datasets:
+                    if num_found:
+                        f.write(', ')
+                    f.write(json.dumps(dataset))
+                    num_found += 1
+                f.flush()
+            f.write('], "num_found": {}}}\n'.format(num_found))
+        if path != '-':
+            print('wrote ' + path)
+
+
+class _SummaryWriter(_OutputWriter):
+    """
+    Writes counts of datasets in each status, grouped by the values of the
+    facets at the given positions in the dataset ID.  The counts are
+    accumulated in a single pass over the pages, without keeping the
+    individual results.
+    """
+
+    def __init__(self, pages, drs, positions):
+        super().__init__(pages)
+        self._facet_names = [drs.facet_names[pos] for pos in positions]
+        self._positions = positions
+        self._split = drs.split_dataset_id
+
+    def _get_counts(self):
+        "returns dictionary of {facet_values_tuple: Counter of statuses}"
+        counts = collections.defaultdict(collections.Counter)
+        for page in self._pages:
+            for dataset_id, status in page:
+                facets = self._split(dataset_id)
+                if facets:
+                    key = tuple(facets[pos] for pos in self._positions)
+                else:
+                    key = ('?',) * len(self._positions)
+                counts[key][status] += 1
+        return counts
+
+    def _get_table(self):
+        "returns (headers, rows) for the summary table"
+        counts = self._get_counts()
+        statuses = [status for status in _statuses if status != 'ALL']
+        seen = set()
+        for counter in counts.values():
+            seen.update(counter)
+        statuses += sorted(seen - set(statuses))
+
+        headers = self._facet_names + statuses + ['total']
+        rows = []
+        for key in sorted(counts):
+            counter = counts[key]
+            rows.append(list(key) + [counter[status] for status in statuses]
+                        + [sum(counter.values())])
+        return headers, rows
+
+    def dump(self, writer=print):
+        headers, rows = self._get_table()
+        if not rows:
+            writer("No matching datasets")
+            return
+        widths = [max(len(str(val)) for val in column)
+                  for column in zip(headers, *rows)]
+        num_facets = len(self._facet_names)
+        def format_row(row):
+            return "  ".join(("{:<{}}" if i < num_facets else "{:>{}}").format(val, width)
+                             for i, (val, width) in enumerate(zip(row, widths)))
+        writer(format_row(headers))
+        line = "=" * (sum(widths) + 2 * (len(widths) - 1))
+        writer(line)
+        for row in rows:
+            writer(format_row(row))
+        writer(line)
+
+    def write_csv(self, path):
+        headers, rows = self._get_table()
+        with self._open_output(path) as f:
+            row_writer = csv.writer(f).writerow
+            row_writer(headers)
+            for row in rows:
                 row_writer(row)
         if path != '-':
             print('wrote ' + path)
 
     def write_json(self, path):
-        all = {}
-        datasets = []
-        headers = [s.lower().replace(' ', '_') for s in self._headers]
-        for row in self._get_rows():
-            datasets.append(dict(zip(headers, row)))
-        all['datasets'] = datasets
-        all['num_found'] = len(datasets)
-        with self._get_write_fh(path) as f:
+        headers, rows = self._get_table()
+        num_facets = len(self._facet_names)
+        groups = []
+        for row in rows:
+            group = dict(zip(self._facet_names, row[:num_facets]))
+            group['counts'] = dict((status, n) for status, n
+                                   in zip(headers[num_facets:-1], row[num_facets:-1]) if n)
+            group['total'] = row[-1]
+            groups.append(group)
+        all = {'summary_by': self._facet_names,
+               'groups': groups,
+               'num_found': sum(group['total'] for group in groups)}
+        with self._open_output(path) as f:
             f.write(json.dumps(all) + "\n")
         if path != '-':
             print('wrote ' + path)
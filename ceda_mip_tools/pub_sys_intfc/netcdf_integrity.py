@@ -0,0 +1,245 @@
+"""
+Cheap structural checks for truncated or partially copied netCDF files,
+which read only the file header (never the data):
+
+  - netCDF-4 (HDF5) files: the end-of-file address in the superblock
+    must not be beyond the actual end of the file
+
+  - classic, 64-bit offset and CDF-5 files: the header is parsed, and the
+    size implied by the variables, their start offsets and the number of
+    records must not be more than the actual file size
+"""
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from ceda_mip_tools.pub_sys_intfc import config
+
+
+_hdf5_signature = b'\x89HDF\r\n\x1a\n'
+
+# the HDF5 superblock may be after a user block of 512 bytes or more
+# (0, 512, 1024, 2048 ...); this is as far as we look for it
+_hdf5_max_signature_offset = 1 << 20
+
+_classic_versions = {1: 'classic', 2: '64-bit offset', 5: 'CDF-5'}
+
+_nc_dimension = 10
+_nc_variable = 11
+_nc_attribute = 12
+
+# sizes of the netCDF external types, by nc_type
+_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8,
+               7: 1, 8: 2, 9: 4, 10: 8, 11: 8}
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class _HeaderReader(object):
+    "Reads a file sequentially in blocks, up to a maximum number of bytes"
+
+    _block_size = 65536
+
+    def __init__(self, f, max_bytes):
+        self._f = f
+        self._max_bytes = max_bytes
+        self._buf = b''
+        self._pos = 0
+        self._read = 0
+
+    def read(self, n):
+        while len(self._buf) - self._pos < n:
+            if self._read >= self._max_bytes:
+                raise IntegrityError("header is larger than {} bytes".format(self._max_bytes))
+            block = self._f.read(min(self._block_size, self._max_bytes - self._read))
+            if not block:
+                raise IntegrityError("file ends within the header")
+            self._read += len(block)
+            self._buf = self._buf[self._pos:] + block
+            self._pos = 0
+        data = self._buf[self._pos : self._pos + n]
+        self._pos += n
+        return data
+
+
+class _ClassicHeader(object):
+    "Parser of the header of a classic, 64-bit offset or CDF-5 format file"
+
+    def __init__(self, reader, version):
+        self._read = reader.read
+        self._non_neg = '>Q' if version == 5 else '>I'
+        self._offset = '>I' if version == 1 else '>Q'
+        self.streaming = False
+        self.numrecs = self._read_non_neg()
+        if self.numrecs == (1 << (64 if version == 5 else 32)) - 1:
+            self.streaming = True
+        self.dims = self._read_list(_nc_dimension, self._read_dim)
+        self._read_list(_nc_attribute, self._read_att)
+        self.vars = self._read_list(_nc_variable, self._read_var)
+
+    def _unpack(self, fmt):
+        return struct.unpack(fmt, self._read(struct.calcsize(fmt)))[0]
+
+    def _read_non_neg(self):
+        return self._unpack(self._non_neg)
+
+    def _read_padded(self, nbytes):
+        self._read(nbytes + (-nbytes % 4))
+
+    def _read_name(self):
+        self._read_padded(self._read_non_neg())
+
+    def _read_list(self, tag, read_item):
+        found_tag = self._unpack('>I')
+        nelems = self._read_non_neg()
+        if found_tag == 0 and nelems == 0:
+            return []
+        if found_tag != tag:
+            raise IntegrityError("corrupt header (unexpected tag {})".format(found_tag))
+        return [read_item() for _ in range(nelems)]
+
+    def _read_dim(self):
+        self._read_name()
+        return self._read_non_neg()
+
+    def _read_att(self):
+        self._read_name()
+        nc_type = self._unpack('>I')
+        nelems = self._read_non_neg()
+        if nc_type not in _type_sizes:
+            raise IntegrityError("corrupt header (unknown type {})".format(nc_type))
+        self._read_padded(nelems * _type_sizes[nc_type])
+
+    def _read_var(self):
+        self._read_name()
+        dimids = [self._read_non_neg() for _ in range(self._read_non_neg())]
+        self._read_list(_nc_attribute, self._read_att)
+        nc_type = self._unpack('>I')
+        self._read_non_neg()  # vsize (recomputed below, as it can overflow)
+        begin = self._unpack(self._offset)
+        if nc_type not in _type_sizes:
+            raise IntegrityError("corrupt header (unknown type {})".format(nc_type))
+        return dimids, nc_type, begin
+
+    def get_min_file_size(self):
+        "size that the file must have if all its data have been written"
+        record_vars = []
+        min_size = 0
+        for dimids, nc_type, begin in self.vars:
+            if any(dimid >= len(self.dims) for dimid in dimids):
+                raise IntegrityError("corrupt header (bad dimension ID)")
+            size = _type_sizes[nc_type]
+            is_record = dimids and self.dims[dimids[0]] == 0
+            for dimid in (dimids[1:] if is_record else dimids):
+                size *= self.dims[dimid]
+            if is_record:
+                record_vars.append((begin, size))
+            else:
+                min_size = max(min_size, begin + size)
+
+        if record_vars and self.numrecs and not self.streaming:
+            if len(record_vars) == 1:
+                rec_size = record_vars[0][1]
+            else:
+                rec_size = sum(size + (-size % 4) for begin, size in record_vars)
+            for begin, size in record_vars:
+                min_size = max(min_size, begin + (self.numrecs - 1) * rec_size + size)
+        return min_size
+
+
+def _check_hdf5(f, offset, file_size):
+    "checks the end-of-file address in an HDF5 superblock at the given offset"
+    f.seek(offset + len(_hdf5_signature))
+    version = f.read(1)
+    if not version:
+        raise IntegrityError("file ends within the HDF5 superblock")
+    version = version[0]
+    if version in (0, 1):
+        # versions of the free-space storage, root group symbol table and
+        # shared header message formats, sizes of offsets and lengths, B-tree
+        # K values and consistency flags (and in v1, indexed storage K)
+        head_size = 15 if version == 0 else 19
+        head = f.read(head_size)
+        if len(head) < head_size:
+            raise IntegrityError("file ends within the HDF5 superblock")
+        offset_size = head[4]
+    elif version in (2, 3):
+        head = f.read(3)
+        if len(head) < 3:
+            raise IntegrityError("file ends within the HDF5 superblock")
+        offset_size = head[0]
+    else:
+        raise IntegrityError("unknown HDF5 superblock version {}".format(version))
+
+    if offset_size not in (2, 4, 8):
+        raise IntegrityError("corrupt HDF5 superblock (size of offsets {})".format(offset_size))
+    # the superblock continues with (at least) three addresses
+    data = f.read(offset_size * 3)
+    if len(data) < offset_size * 3:
+        raise IntegrityError("file ends within the HDF5 superblock")
+    addresses = [int.from_bytes(data[i * offset_size : (i + 1) * offset_size], 'little')
+                 for i in range(3)]
+    # base address, then (v0/1) free-space info or (v2/3) superblock extension, then EOF
+    base_address, eof_address = addresses[0], addresses[2]
+    undefined = (1 << (8 * offset_size)) - 1
+    if eof_address == undefined:
+        return
+    expected = base_address + eof_address
+    if expected > file_size:
+        raise IntegrityError("truncated: HDF5 superblock gives end of file at {} bytes but "
+                             "file has {} bytes".format(expected, file_size))
+
+
+def _find_hdf5_signature(f, file_size):
+    "returns the offset of the HDF5 signature, or None"
+    offset = 0
+    while offset + len(_hdf5_signature) <= min(file_size, _hdf5_max_signature_offset):
+        f.seek(offset)
+        if f.read(len(_hdf5_signature)) == _hdf5_signature:
+            return offset
+        offset = 512 if offset == 0 else offset * 2
+    return None
+
+
+def check_file(path, max_header_bytes=config.integrity_max_header_bytes):
+    """
+    Checks the structure of a netCDF file.  Returns None if it looks
+    complete, otherwise a description of the problem.
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            magic = f.read(4)
+            if magic[:3] == b'CDF' and len(magic) == 4:
+                version = magic[3]
+                if version not in _classic_versions:
+                    raise IntegrityError("unknown netCDF format version {}".format(version))
+                header = _ClassicHeader(_HeaderReader(f, max_header_bytes), version)
+                expected = header.get_min_file_size()
+                if expected > file_size:
+                    raise IntegrityError(("truncated: {} header implies at least {} bytes but "
+                                          "file has {} bytes")
+                                         .format(_classic_versions[version], expected, file_size))
+            else:
+                offset = _find_hdf5_signature(f, file_size)
+                if offset == None:
+                    raise IntegrityError("not a netCDF file (no netCDF or HDF5 signature found)")
+                _check_hdf5(f, offset, file_size)
+    except IntegrityError as exc:
+        return str(exc)
+    except (OSError, struct.error) as exc:
+        return "could not check structure: {}".format(exc)
+    return None
+
+
+def check_files(paths, jobs=config.integrity_check_jobs):
+    """
+    Checks the structure of the files, up to 'jobs' at a time.  Returns a
+    list of (path, problem) for those with problems, in the order given.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        problems = executor.map(check_file, paths)
+        return [(path, problem) for path, problem in zip(paths, problems) if problem]
@@ -2,12 +2,18 @@ import pwd
 import grp
 import os
 
+from ceda_mip_tools.fs_utils.filesystem import LocalFilesystem
+from ceda_mip_tools.fs_utils.dir_fds import DirFDCache
+
 
 class UserPermissionsChecker(object):
 
-    def __init__(self, username):
+    def __init__(self, username, fs=None):
 
         self.username = username
+        # the same parent directories are checked for every file, so keep
+        # them open to stat the files relative to them
+        self._fs = fs or LocalFilesystem(dir_fds=DirFDCache())
         self.uid, gid = self._get_uid_gid(username)
         self.gids = [gid] + self._get_supplementary_gids(username)
 
@@ -56,7 +62,7 @@ class UserPermissionsChecker(object):
 
 
     def check_access(self, path, access, continue_on_error=False,
-                     **kwargs):
+                     stat_data=None, **kwargs):
         """
         Checks if the user can access a given path with the required level of 
         access.  Raise an exception if not.
@@ -78,6 +84,9 @@ class UserPermissionsChecker(object):
         error, instead of raising an exception, the processing will
         continue scanning parent directories.  (Other exceptions are
         not affected.)
+
+        If stat_data is given, it is used instead of calling os.stat on the
+        path itself (but not on its parent directories).
         """
         if isinstance(access, int):
             if not 0 <= access <= 7:
@@ -94,6 +103,7 @@ class UserPermissionsChecker(object):
         if cache_key not in self._cache:
             self._cache[cache_key] = self._check_access(path, access, 
                                                         continue_on_error=continue_on_error,
+                                                        stat_data=stat_data,
                                                         **kwargs)
 
         ret_val = self._cache[cache_key]
@@ -108,12 +118,12 @@ class UserPermissionsChecker(object):
 
     def _check_access(self, path, access, check_dir_access=True, 
                       messages=None, permissions=None,
-                      continue_on_error=False):
+                      continue_on_error=False, stat_data=None):
 
 
         errors = False
 
-        s = os.stat(path)
+        s = stat_data or self._fs.stat(path)
         uid = s.st_uid
         gid = s.st_gid
         mode = s.st_mode
@@ -155,9 +165,9 @@ class UserPermissionsChecker(object):
             parent = os.path.dirname(path)
             recurse.append(parent)
         
-            if os.path.islink(path):
+            if self._fs.islink(path):
 
-                path2 = self._abs_path(parent, os.readlink(path))
+                path2 = self._abs_path(parent, self._fs.readlink(path))
                 parent2 = os.path.dirname(path2)
                 recurse.append(parent2)
 
@@ -0,0 +1,175 @@
+"""
+Statistics on the requests made to the publication system web service:
+per-endpoint latency percentiles, byte counts and retry counts, and
+optionally a trace log with one line of newline-delimited JSON per request.
+"""
+
+import json
+import time
+import threading
+import collections
+from urllib.parse import urlparse
+
+
+# percentiles shown in the summary
+_percentiles = (50, 95, 99)
+
+
+def _percentile(sorted_vals, pct):
+    "nearest-rank percentile of a sorted list"
+    if not sorted_vals:
+        return None
+    rank = max(1, -(-pct * len(sorted_vals) // 100))
+    return sorted_vals[rank - 1]
+
+
+class _EndpointStats(object):
+
+    def __init__(self):
+        self.totals = []
+        self.waits = []
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_retries = 0
+        self.status_codes = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class RequestStats(object):
+    """
+    Collects the timings of requests (from any thread).  For each request,
+    the time is split into:
+
+      wait      - from sending the request until the response headers have
+                  been parsed (requests' Response.elapsed), which includes
+                  any DNS lookup, connection and TLS set-up as well as the
+                  server's processing time, since requests does not time
+                  these separately
+      download  - reading the response body
+      parse     - decoding the JSON
+    """
+
+    def __init__(self, trace_path=None):
+        self._lock = threading.Lock()
+        self._endpoints = collections.OrderedDict()
+        self._trace_fh = open(trace_path, 'w') if trace_path else None
+
+
+    def _get_endpoint(self, url):
+        path = urlparse(url).path
+        try:
+            return path, self._endpoints[path]
+        except KeyError:
+            return path, self._endpoints.setdefault(path, _EndpointStats())
+
+
+    def record(self, url, start_time, total, wait=None, download=None, parse=None,
+               status_code=None, bytes_sent=0, bytes_received=0, error=None):
+        "records one request (status_code is None if no response was received)"
+        with self._lock:
+            endpoint, stats = self._get_endpoint(url)
+            stats.num_requests += 1
+            stats.totals.append(total)
+            if wait != None:
+                stats.waits.append(wait)
+            if status_code != None:
+                stats.status_codes[status_code] += 1
+            if error:
+                stats.num_errors += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+
+            if self._trace_fh:
+                self._trace_fh.write(json.dumps({
+                    'time': start_time,
+                    'endpoint': endpoint,
+                    'thread': threading.current_thread().name,
+                    'status_code': status_code,
+                    'wait': wait,
+                    'download': download,
+                    'parse': parse,
+                    'total': total,
+                    'bytes_sent': bytes_sent,
+                    'bytes_received': bytes_received,
+                    'error': error}) + "\n")
+                self._trace_fh.flush()
+
+
+    def record_retry(self, url):
+        with self._lock:
+            self._get_endpoint(url)[1].num_retries += 1
+
+
+    def close(self):
+        if self._trace_fh:
+            self._trace_fh.close()
+            self._trace_fh = None
+
+
+    def get_summary(self):
+        "returns a list of lines summarising the requests to each endpoint"
+        lines = []
+        with self._lock:
+            for endpoint, stats in self._endpoints.items():
+                lines.append("{}: {} requests, {} retries, {} errors, {} bytes sent, {} bytes received"
+                             .format(endpoint, stats.num_requests, stats.num_retries,
+                                     stats.num_errors, stats.bytes_sent, stats.bytes_received))
+                if stats.status_codes:
+                    lines.append("  HTTP status: {}".format(
+                        ", ".join("{} x {}".format(code, count)
+                                  for code, count in sorted(stats.status_codes.items()))))
+                for label, vals in (('total', stats.totals), ('wait', stats.waits)):
+                    if vals:
+                        vals = sorted(vals)
+                        lines.append("  {:5} seconds: {}, max {:.3f}".format(
+                            label,
+                            ", ".join("p{} {:.3f}".format(pct, _percentile(vals, pct))
+                                      for pct in _percentiles),
+                            vals[-1]))
+        if not lines:
+            lines.append("no requests made")
+        return lines
+
+
+def timed_post(poster, url, data, timeout, stats):
+    """
+    Calls poster(url, data=data, timeout=timeout) and reads the body,
+    recording the timings in stats.  Returns (response, parse) where
+    parse() decodes the JSON and records its timing.
+    """
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        response = poster(url, data=data, timeout=timeout)
+        content = response.content
+    except Exception as exc:
+        stats.record(url, start_time, time.perf_counter() - start, error=str(exc))
+        raise
+    received = time.perf_counter() - start
+    wait = response.elapsed.total_seconds()
+    body = response.request.body if response.request is not None else None
+    details = dict(wait=wait,
+                   download=max(0., received - wait),
+                   status_code=response.status_code,
+                   bytes_sent=len(body) if body else 0,
+                   bytes_received=len(content))
+
+    if response.status_code != 200:
+        stats.record(url, start_time, received, **details)
+        return response, response.json
+
+    def parse():
+        parse_start = time.perf_counter()
+        error = None
+        try:
+            return response.json()
+        except ValueError as exc:
+            error = "could not parse response: {}".format(exc)
+            raise
+        finally:
+            parse_time = time.perf_counter() - parse_start
+            stats.record(url, start_time, received + parse_time,
+                         parse=parse_time, error=error, **details)
+
+    return response, parse
@@ -0,0 +1,84 @@
+"""
+Deterministic partitioning of lists of datasets over several batch jobs,
+each of which is run with --shard i/N and handles only its own share.
+"""
+
+import heapq
+import hashlib
+
+
+def parse_shard_spec(spec):
+    """
+    Parses a shard specification 'i/N' (1 <= i <= N), returning (i, N).
+    Raises ValueError if it is invalid.
+    """
+    try:
+        index, num_shards = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError("shard should be given as i/N, e.g. 3/10 (not {})".format(spec))
+    if not 1 <= index <= num_shards:
+        raise ValueError("in shard {}, i should be between 1 and N".format(spec))
+    return index, num_shards
+
+
+def get_shard(key, num_shards):
+    """
+    Returns the shard number (1 to num_shards) for a key (normally a
+    dataset ID).  This depends only on the key, so is the same for any run
+    and whatever else is in the list.
+    """
+    digest = hashlib.md5(key.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards + 1
+
+
+def get_balanced_shards(weights, num_shards):
+    """
+    Given {key: weight} (e.g. the number of files in each dataset), returns
+    {key: shard number}, assigning the heaviest items first, each to the
+    shard with the least total weight so far.  Ties are broken by the key
+    hash, so the result depends only on the set of keys and weights, and
+    not on the order of the input list.
+    """
+    items = sorted(weights.items(),
+                   key=lambda item: (-item[1], get_shard(item[0], 1 << 30), item[0]))
+    loads = [(0, shard) for shard in range(1, num_shards + 1)]
+    shards = {}
+    for key, weight in items:
+        load, shard = heapq.heappop(loads)
+        shards[key] = shard
+        heapq.heappush(loads, (load + weight, shard))
+    return shards
+
+
+class Sharder(object):
+    """
+    Selects the items that belong to one shard.  By default this uses the
+    hash of each item's key only; if weights are supplied for all the keys,
+    the shards are balanced by weight instead.
+    """
+
+    def __init__(self, index, num_shards):
+        self.index = index
+        self.num_shards = num_shards
+        self._balanced = None
+
+    def balance(self, weights):
+        "use balanced assignment, given {key: weight} for every key that will be looked up"
+        self._balanced = get_balanced_shards(weights, self.num_shards)
+
+    def get_shard(self, key):
+        if self._balanced != None and key in self._balanced:
+            return self._balanced[key]
+        return get_shard(key, self.num_shards)
+
+    def includes(self, key):
+        return self.get_shard(key) == self.index
+
+    def select(self, items, key=None):
+        "yields the items in this shard, where key(item) gives the key (default the item itself)"
+        for item in items:
+            if self.includes(key(item) if key else item):
+                yield item
+
+    def __str__(self):
+        return "{}/{}".format(self.index, self.num_shards)
@@ -0,0 +1,154 @@
+"""
+Local cache of dataset publication statuses, so that datasets which have
+already finished processing need not be queried again.
+"""
+
+import os
+import time
+import sqlite3
+
+from ceda_mip_tools.pub_sys_intfc import util
+
+
+terminal_statuses = ('completed', 'failed')
+
+# keep the number of SQL parameters per statement below SQLite's limit
+_max_sql_params = 500
+
+
+class StatusCache(object):
+    """
+    An SQLite database of the last seen status of each dataset, keyed by
+    (configuration, chain, dataset_id), together with a log of the status
+    transitions seen between runs.
+    """
+
+    _schema = [
+        """CREATE TABLE IF NOT EXISTS statuses (
+               configuration TEXT NOT NULL,
+               chain TEXT NOT NULL,
+               dataset_id TEXT NOT NULL,
+               status TEXT NOT NULL,
+               checked REAL NOT NULL,
+               PRIMARY KEY (configuration, chain, dataset_id))""",
+
+        """CREATE TABLE IF NOT EXISTS transitions (
+               configuration TEXT NOT NULL,
+               chain TEXT NOT NULL,
+               dataset_id TEXT NOT NULL,
+               old_status TEXT NOT NULL,
+               new_status TEXT NOT NULL,
+               time REAL NOT NULL)""",
+
+        """CREATE INDEX IF NOT EXISTS transitions_by_time
+               ON transitions (configuration, chain, time)""",
+
+        """CREATE TABLE IF NOT EXISTS runs (
+               configuration TEXT NOT NULL,
+               chain TEXT NOT NULL,
+               time REAL NOT NULL)""",
+        ]
+
+    def __init__(self, path, configuration, chain):
+        path = os.path.expanduser(path)
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._key = (configuration, chain)
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            for statement in self._schema:
+                self._conn.execute(statement)
+
+
+    def close(self):
+        self._conn.close()
+
+
+    def get_many(self, dataset_ids):
+        """
+        Returns a dictionary of {dataset_id: (status, checked_time)} for those
+        of the dataset IDs that are in the cache
+        """
+        found = {}
+        for page in util.paginate_list(list(dataset_ids), _max_sql_params):
+            sql = ("SELECT dataset_id, status, checked FROM statuses "
+                   "WHERE configuration = ? AND chain = ? AND dataset_id IN ({})"
+                   ).format(','.join('?' * len(page)))
+            for dataset_id, status, checked in self._conn.execute(sql, self._key + tuple(page)):
+                found[dataset_id] = (status, checked)
+        return found
+
+
+    def get_dataset_ids(self):
+        "Yields all dataset IDs in the cache"
+        for dataset_id, in self._conn.execute(
+                "SELECT dataset_id FROM statuses WHERE configuration = ? AND chain = ?",
+                self._key):
+            yield dataset_id
+
+
+    def get_ids_to_query(self, dataset_ids, ttl, now=None):
+        """
+        Returns the subset of the dataset IDs (in the same order) whose status
+        needs querying: those not in the cache, not yet in a terminal status,
+        or last checked longer ago than ttl seconds
+        """
+        if now == None:
+            now = time.time()
+        cached = self.get_many(dataset_ids)
+        to_query = []
+        for dataset_id in dataset_ids:
+            try:
+                status, checked = cached[dataset_id]
+            except KeyError:
+                to_query.append(dataset_id)
+                continue
+            if status not in terminal_statuses or checked < now - ttl:
+                to_query.append(dataset_id)
+        return to_query
+
+
+    def update(self, results, now=None):
+        """
+        Stores a list of (dataset_id, status), recording any status
+        transitions from previously stored values.
+        """
+        if now == None:
+            now = time.time()
+        results = list(results)
+        previous = self.get_many(dataset_id for dataset_id, status in results)
+        transitions = [self._key + (dataset_id, previous[dataset_id][0], status, now)
+                       for dataset_id, status in results
+                       if dataset_id in previous and previous[dataset_id][0] != status]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO statuses VALUES (?, ?, ?, ?, ?)",
+                [self._key + (dataset_id, status, now) for dataset_id, status in results])
+            self._conn.executemany(
+                "INSERT INTO transitions VALUES (?, ?, ?, ?, ?, ?)",
+                transitions)
+
+
+    def get_transitions_since(self, since):
+        "Returns a list of (dataset_id, old_status, new_status, time) in time order"
+        return list(self._conn.execute(
+                "SELECT dataset_id, old_status, new_status, time FROM transitions "
+                "WHERE configuration = ? AND chain = ? AND time >= ? "
+                "ORDER BY time, dataset_id",
+                self._key + (since,)))
+
+
+    def record_run(self, now=None):
+        """
+        Records the start of a run, and returns the start time of the
+        previous run (or None if there was none)
+        """
+        if now == None:
+            now = time.time()
+        previous, = self._conn.execute(
+            "SELECT MAX(time) FROM runs WHERE configuration = ? AND chain = ?",
+            self._key).fetchone()
+        with self._conn:
+            self._conn.execute("INSERT INTO runs VALUES (?, ?, ?)", self._key + (now,))
+        return previous
@@ -1,10 +1,19 @@
 import os
 import pwd
+import re
 import sys
+import time
 import argparse
+import itertools
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
-from ceda_mip_tools.pub_sys_intfc import config, dataset_drs
+from ceda_mip_tools.pub_sys_intfc import config, dataset_drs, cv_loader, sharding, request_stats
+from ceda_mip_tools.pub_sys_intfc.errors import ServiceError, ThrottledError
 
 
 def get_user_name():
@@ -13,31 +22,253 @@ def get_user_name():
     return name[: config.max_requester_len]
 
 
+_throttle_status_codes = (429, 503)
+
+# request_stats.RequestStats object, if statistics are being collected
+_request_stats = None
+
+
+def _parse_retry_after(response):
+    "number of seconds from a Retry-After header (or None if absent or not in seconds)"
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_session(pool_size=1):
+    """
+    Returns a requests session whose connection pool can keep pool_size
+    connections open to the web service, for use by concurrent requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 def do_post_expecting_json(url, params, 
                            description="web service",
-                           compulsory_fields=()):
+                           compulsory_fields=(),
+                           session=None):
     """
-    POST the params to the specified URL.
+    POST the params to the specified URL (using the session if one is given).
     Return the parsed JSON.
-    Raise an exception if any required fields are missing.
+    Raise ServiceError if the request fails or any required fields are
+    missing, or ThrottledError if the server is asking us to slow down.
     """
-    response = requests.post(url, data=params, timeout=config.timeout)
+    poster = session.post if session else requests.post
+    try:
+        if _request_stats:
+            response, parse = request_stats.timed_post(poster, url, params, config.timeout,
+                                                       _request_stats)
+        else:
+            response = poster(url, data=params, timeout=config.timeout)
+            parse = response.json
+    except requests.RequestException as exc:
+        raise ServiceError("Could not talk to {}: {}".format(description, exc))
+
+    if response.status_code in _throttle_status_codes:
+        raise ThrottledError("{} is throttling requests (HTTP {})"
+                             .format(description, response.status_code),
+                             retry_after=_parse_retry_after(response),
+                             url=url)
 
     if response.status_code != 200:
-        raise Exception("Could not talk to {}".format(description))
+        raise ServiceError("Could not talk to {}".format(description))
         
     try:
-        fields = response.json()
+        fields = parse()
         for key in compulsory_fields:
             dummy = fields[key]
     except (ValueError, KeyError):
-        raise Exception("Could not parse response from {}".format(description))
+        raise ServiceError("Could not parse response from {}".format(description))
     return fields
     
 
+_size_units = ['bytes', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB']
+_size_re = re.compile(r'(\d+(?:\.\d*)?)\s*([KMGTP]?)(?:I?B)?$')
+
+
+def format_size(num_bytes):
+    "formats a number of bytes for people to read, e.g. '1.5 TiB'"
+    size = float(num_bytes)
+    for unit in _size_units:
+        if size < 1024 or unit == _size_units[-1]:
+            break
+        size /= 1024
+    return "{} bytes".format(num_bytes) if unit == 'bytes' else "{:.1f} {}".format(size, unit)
+
+
+def parse_size(text):
+    """
+    parses a size such as '500G' or '2.5T' (K, M, G, T and P are powers of
+    1024, and may be followed by 'iB' or 'B'), returning the number of bytes
+    """
+    match = _size_re.match(text.strip().upper())
+    if not match:
+        raise ValueError("cannot parse size {}".format(text))
+    number, prefix = match.groups()
+    multiplier = 1024 ** ('KMGTP'.index(prefix) + 1) if prefix else 1
+    return int(float(number) * multiplier)
+
+
 def paginate_list(lst, count):
-    for i in range(0, len(lst), count):
-        yield lst[i : i+count]
+    "yields lists of up to count items; lst may be any iterable, including a generator"
+    if isinstance(lst, list):
+        for i in range(0, len(lst), count):
+            yield lst[i : i+count]
+        return
+    it = iter(lst)
+    while True:
+        page = list(itertools.islice(it, count))
+        if not page:
+            return
+        yield page
+
+
+class _AdaptiveLimiter(object):
+    """
+    Limits the number of calls in flight.  The limit starts at the maximum,
+    is halved each time the server throttles a call, and grows back by one
+    after each run of as many successful calls as the current limit.
+    """
+    def __init__(self, max_limit):
+        self._max_limit = max_limit
+        self._limit = max_limit
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._active -= 1
+            if throttled:
+                self._limit = max(1, self._limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._limit < self._max_limit and self._successes >= self._limit:
+                    self._limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+def _call_with_limiter(func, page, limiter):
+    "call func(page), retrying with backoff for as long as the server throttles it"
+    delay = config.throttle_initial_delay
+    for attempt in range(config.throttle_max_retries + 1):
+        limiter.acquire()
+        throttled = False
+        try:
+            return func(page)
+        except ThrottledError as exc:
+            throttled = True
+            if attempt == config.throttle_max_retries:
+                raise
+            if _request_stats:
+                _request_stats.record_retry(exc.url)
+            wait = exc.retry_after or delay
+        finally:
+            limiter.release(throttled=throttled)
+        # (sleep without holding a place, so that other calls can go ahead)
+        time.sleep(wait)
+        delay *= 2
+
+
+def map_pages(func, pages, jobs=1):
+    """
+    Calls func on each of the pages, yielding the return values in the same
+    order as the pages.  If the server throttles a call, it is retried
+    after a backoff.
+
+    If jobs > 1, then up to that many calls are run concurrently in worker
+    threads (so func should use a session with a big enough connection pool).
+    If the server throttles the calls, the concurrency is also reduced.
+    Only a bounded number of pages are read ahead, so pages may be a
+    generator.
+    """
+    limiter = _AdaptiveLimiter(max(jobs, 1))
+    if jobs <= 1:
+        for page in pages:
+            yield _call_with_limiter(func, page, limiter)
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for page in pages:
+            pending.append(executor.submit(_call_with_limiter, func, page, limiter))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _ValuesFromFile(object):
+    """
+    The values in a file (or standard input), read only as they are
+    iterated over, so that a long list need not be held in memory.  The file
+    is opened, and the first value read, when this is created, so that a
+    missing file or an empty list is reported before any work is done.  It
+    can only be iterated over once.
+    """
+
+    _block_size = 65536
+
+    def __init__(self, filename, null_separated=False):
+        if filename == '-':
+            self._fh = sys.stdin.buffer if null_separated else sys.stdin
+        else:
+            self._fh = open(filename, 'rb' if null_separated else 'r')
+        self._values = self._read_values(null_separated)
+        self._first = next(self._values, None)
+        self._empty = self._first == None
+
+    def _read_values(self, null_separated):
+        with self._fh:
+            if null_separated:
+                yield from self._read_null_separated()
+            else:
+                for line in self._fh:
+                    val = line.strip()
+                    if val:
+                        yield val
+
+    def _read_null_separated(self):
+        """
+        values are separated by NUL characters (as from 'find -print0'), and
+        are not stripped, so may contain any other characters; bytes that
+        are not valid in the filesystem encoding are kept as os.fsdecode does
+        """
+        partial = b''
+        while True:
+            block = self._fh.read(self._block_size)
+            if not block:
+                break
+            items = (partial + block).split(b'\0')
+            partial = items.pop()
+            for item in items:
+                if item:
+                    yield os.fsdecode(item)
+        if partial:
+            yield os.fsdecode(partial)
+
+    def __bool__(self):
+        return not self._empty
+
+    def __iter__(self):
+        if self._first == None:
+            return
+        first, self._first = self._first, None
+        yield first
+        yield from self._values
 
 
 class ArgsFromCmdLineOrFileParser(object):
@@ -46,7 +277,14 @@ class ArgsFromCmdLineOrFileParser(object):
     the program to take a list of things that are specified either on the command
     line or in a file which is referenced with --file-from / -f argument, with 
     the special filename "-" for standard input.  Lines from the file are stripped
-    of leading/trailing whitespace, and any blank lines are ignored.
+    of leading/trailing whitespace, and any blank lines are ignored.  With
+    --null / -0, the file is instead split on NUL characters (for the output of
+    'find -print0'), and the values are used exactly as given.
+
+    If allow_lazy is set, then a --lazy option is also added, with which the
+    values from the file are read as they are used instead of all at the
+    start (see _ValuesFromFile); the program must then only iterate over
+    the list once.
 
     Example:
 
@@ -65,14 +303,18 @@ class ArgsFromCmdLineOrFileParser(object):
     
     """
     def __init__(self, var_opt, var_desc, var_meta=None, var_help=None, 
-                 allow_empty_list=False, **kwargs):
+                 allow_empty_list=False, allow_lazy=False, **kwargs):
         self._var_opt = var_opt
         self._var_desc = var_desc
         self._var_help = var_help
         self._var_meta = var_meta
         self._allow_empty_list = allow_empty_list
+        self._allow_lazy = allow_lazy
         self._file_opt = '--from-file'
         self._file_short_opt = '-f'
+        self._null_opt = '--null'
+        self._null_short_opt = '-0'
+        self._lazy_opt = '--lazy'
         self._parser = argparse.ArgumentParser(**kwargs)
 
 
@@ -104,6 +346,20 @@ class ArgsFromCmdLineOrFileParser(object):
         self._parser.add_argument(self._file_opt, self._file_short_opt,
                                  metavar='filename',
                                  help=help)
+        help = ("{} in the file are separated by NUL characters (as output by "
+                "'find -print0') instead of newlines, and are used without stripping "
+                "whitespace").format(self._var_desc)
+        self._parser.add_argument(self._null_opt, self._null_short_opt,
+                                  action='store_true',
+                                  help=help)
+        if self._allow_lazy:
+            help = ("read {} from the file as they are needed, so that work starts at once "
+                    "and a long list is not held in memory. An invalid entry then stops "
+                    "the run, with exit status 1, as soon as it is read: nothing is done "
+                    "for it or for the entries after it, but those before it may already "
+                    "have been processed").format(self._var_desc)
+            self._parser.add_argument(self._lazy_opt, action='store_true',
+                                      help=help)
 
 
     def _add_values_from_file(self, args, abort_on_error=True):
@@ -119,23 +375,26 @@ class ArgsFromCmdLineOrFileParser(object):
 
     def _add_values_from_file_core(self, args):
         """
-        appends to list based on the --file-option option
+        appends to list based on the --file-option option (or with --lazy,
+        replaces the list with a _ValuesFromFile)
         """
         filename = getattr(args, self._file_opt[2:].replace('-', '_'))
+        null_separated = getattr(args, self._null_opt[2:])
+        lazy = self._allow_lazy and getattr(args, self._lazy_opt[2:])
         values = getattr(args, self._var_opt)
         if values and (filename != None):
             raise ValueError(('{} cannot be given on command line if {} is used'
                               ).format(self._var_desc, self._file_opt))
+        if (null_separated or lazy) and filename == None:
+            raise ValueError('{} can only be used with {}'.format(
+                self._null_opt if null_separated else self._lazy_opt, self._file_opt))
         if filename:
-            if filename == '-':
-                fh = sys.stdin    
+            file_values = _ValuesFromFile(filename, null_separated)
+            if lazy:
+                values = file_values
+                setattr(args, self._var_opt, values)
             else:
-                fh = open(filename)
-            with fh:
-                for line in fh:
-                    val = line.strip()
-                    if val:
-                        values.append(val)
+                values.extend(file_values)
 
         if not values and not self._allow_empty_list:
             raise ValueError(('no {} specified - must specify one or more on command line '
@@ -150,11 +409,109 @@ def add_api_root_arg(parser):
                         help=argparse.SUPPRESS)
 
 
+def add_jobs_arg(parser):
+    parser.add_argument('--jobs', '-J', type=int, metavar='N', default=1,
+                        help=('number of queries to the publication system to run '
+                              'concurrently (at most {})').format(config.max_query_jobs))
+
+
+def parse_jobs_arg(args):
+    if not 1 <= args.jobs <= config.max_query_jobs:
+        raise ValueError("--jobs must be between 1 and {}".format(config.max_query_jobs))
+    return args.jobs
+
+
+def add_manifest_arg(parser):
+    parser.add_argument('--manifest', metavar='filename',
+                        help=('scan manifest (from mip-scan) to consult instead '
+                              'of the filesystem'))
+
+
+def add_stats_args(parser):
+    parser.add_argument('--stats', action='store_true',
+                        help=('at the end, show the latency percentiles, byte counts and retry '
+                              'counts of the requests to the publication system'))
+    parser.add_argument('--trace-log', metavar='filename',
+                        help=('write the timings, HTTP status and size of each request to the '
+                              'publication system to this file (newline-delimited JSON)'))
+
+
+def start_request_stats(args):
+    "starts collecting request statistics if --stats or --trace-log was given"
+    global _request_stats
+    if args.stats or args.trace_log:
+        _request_stats = request_stats.RequestStats(trace_path=args.trace_log)
+
+
+def finish_request_stats(args):
+    """
+    shows the request statistics on standard error (if --stats was given)
+    and closes the trace log
+    """
+    global _request_stats
+    if not _request_stats:
+        return
+    if args.stats:
+        print("Request statistics:", file=sys.stderr)
+        for line in _request_stats.get_summary():
+            print(line, file=sys.stderr)
+    _request_stats.close()
+    _request_stats = None
+
+
+def add_shard_arg(parser):
+    parser.add_argument('--shard', metavar='i/N',
+                        help=('only handle the datasets in shard i of N (1 <= i <= N), chosen by '
+                              'a hash of the dataset ID, for splitting one list over N batch jobs'))
+
+
+def parse_shard_arg(args):
+    "returns a sharding.Sharder for the --shard argument, or None"
+    if not args.shard:
+        return None
+    return sharding.Sharder(*sharding.parse_shard_spec(args.shard))
+
+
 def add_project_arg(parser):
     parser.add_argument('project', type=str, metavar='project',
                         help='project',
                         choices=config.projects.keys())
 
+def add_cv_dir_arg(parser):
+    parser.add_argument('--cv-dir', metavar='directory',
+                        default=config.cv_dir or os.environ.get(config.cv_dir_env_var),
+                        help=('directory of controlled vocabulary JSON files (e.g. CMIP6_source_id.json) '
+                              'used to check the DRS facets (default: ${})').format(config.cv_dir_env_var))
+
+
+def get_project_drs(project, cv_dir=None):
+    """
+    Returns (drs_obj, chain) for a project, using the controlled vocabulary
+    files in cv_dir (if given) to check the DRS facets.  (As the CV
+    directory may be set for all projects, a project with no CV files in it
+    just gets the built-in checks, with a warning.)
+    """
+    if project not in config.projects:
+        raise ValueError("unknown project {} (should be one of: {})"
+                         .format(project, ", ".join(sorted(config.projects))))
+    project_config = config.projects[project]
+
+    if cv_dir:
+        loader = cv_loader.CVLoader(cv_dir, config.cv_cache_dir)
+        extra_allowed_vals = loader.load(project, project_config)
+        if extra_allowed_vals == None:
+            print("WARNING: no CV files for project {} found in {}, so using the built-in "
+                  "DRS checks only".format(project, cv_dir), file=sys.stderr)
+    else:
+        extra_allowed_vals = None
+
+    drs_obj = dataset_drs.DatasetDRS(project_config["drs"],
+                                     extra_allowed_vals=extra_allowed_vals)
+    chain = project_config["chain"]
+
+    return(drs_obj, chain)
+
+
 def parse_project_arg(args):
 
     valid_projects = sorted(config.projects.keys())
@@ -163,9 +520,4 @@ def parse_project_arg(args):
 #        raise ValueError("one of these projects: must be specified {}"
 #                         .format(", ".join(valid_projects)))
 #
-    project_config = config.projects[args.project]
-
-    drs_obj = dataset_drs.DatasetDRS(project_config["drs"])
-    chain = project_config["chain"]
-
-    return(drs_obj, chain)
+    return get_project_drs(args.project, getattr(args, 'cv_dir', None))
@@ -0,0 +1,72 @@
+"""
+Records of which entries in a dataset directory passed validation, so that
+a re-run of add-to-mip need only re-check entries that have changed since.
+"""
+
+import os
+import json
+import hashlib
+
+
+# bump this if the format of the records changes
+_record_format = 1
+
+
+def get_fingerprint(stat_data):
+    """
+    The parts of a stat result which, if unchanged, mean that an entry
+    which passed validation before will pass again (ctime changes on any
+    chmod, chown, write or rename)
+    """
+    return [stat_data.st_size, stat_data.st_mtime, stat_data.st_ctime,
+            stat_data.st_mode, stat_data.st_uid, stat_data.st_gid]
+
+
+class ValidationFingerprints(object):
+    """
+    Stores, for each dataset directory, a JSON file of {path: fingerprint}
+    for the entries that passed validation.  The records are only used if
+    they were made for the same ingestion user and groups, and with (at
+    least) the same optional checks, named in the checks attribute.
+    """
+
+    def __init__(self, records_dir, uid, gids):
+        self._records_dir = os.path.expanduser(records_dir)
+        self._user_key = [uid, sorted(gids)]
+        self.checks = []
+
+
+    def _get_record_path(self, dataset_dir):
+        dir_hash = hashlib.sha1(os.path.abspath(dataset_dir).encode()).hexdigest()
+        return os.path.join(self._records_dir, dir_hash + '.json')
+
+
+    def load(self, dataset_dir):
+        "Returns {path: fingerprint} for entries that previously passed validation"
+        try:
+            with open(self._get_record_path(dataset_dir)) as f:
+                record = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if (record.get('format') != _record_format
+            or record.get('dataset_dir') != os.path.abspath(dataset_dir)
+            or record.get('user') != self._user_key
+            or not set(self.checks).issubset(record.get('checks', []))):
+            return {}
+        return record['passed']
+
+
+    def save(self, dataset_dir, passed):
+        "Stores {path: fingerprint} for entries that passed validation"
+        if not os.path.isdir(self._records_dir):
+            os.makedirs(self._records_dir)
+        record = {'format': _record_format,
+                  'dataset_dir': os.path.abspath(dataset_dir),
+                  'user': self._user_key,
+                  'checks': sorted(self.checks),
+                  'passed': passed}
+        record_path = self._get_record_path(dataset_dir)
+        tmp_path = '{}.tmp{}'.format(record_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f, separators=(',', ':'))
+        os.rename(tmp_path, record_path)
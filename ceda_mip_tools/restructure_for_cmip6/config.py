@@ -5,3 +5,19 @@ filename_formats = [_filename_format_stem + '_{period_start}-{period_end}.nc',
                     _filename_format_stem + '.nc']
 
 dataset_id_format = '{mip_era}.{activity_id}.{institution_id}.{source_id}.{experiment_id}.{member_id}.{table_id}.{variable_id}.{grid_label}'
+
+# number of directories scanned at once when indexing the output tree
+scan_jobs = 16
+
+# --watch: files are restructured in batches of up to this many, or once the
+# first file in the queue has waited this long (seconds)
+watch_batch_size = 1000
+watch_batch_delay = 5
+
+# --watch: default interval (seconds) between rescans of the whole landing
+# area, to catch any files whose events were missed
+watch_rescan_interval = 600
+
+# --watch: files found by a rescan (rather than an event) are only moved
+# once they have not been modified for this long (seconds)
+watch_settle_time = 60
@@ -16,7 +16,12 @@ class DatasetIDGetterException(Exception):
 
 class DatasetIDGetter(object):
 
-    def __init__(self, version=None):
+    def __init__(self, version=None, fs=None):
+        """
+        fs is an optional filesystem object (see ceda_mip_tools.fs_utils) which
+        may already know the netCDF attributes of the files
+        """
+        self._fs = fs
 
         self._dataset_id_facets = \
             self._get_facet_names_from_template(config.dataset_id_format)
@@ -31,6 +36,11 @@ class DatasetIDGetter(object):
 
     _token_re = '{([^}]+)}'
 
+    @property
+    def attribute_names(self):
+        "names of the netCDF attributes used to construct dataset IDs"
+        return list(self._dataset_id_facets)
+
     def get_dataset_id(self, path, version=None):
         "get dataset ID for path"
         facets = self._get_facets(path)
@@ -71,6 +81,11 @@ class DatasetIDGetter(object):
         attributes, based on the set of facets needed to construct 
         a dataset ID, with None for any that were not found
         """
+        if self._fs:
+            attributes = self._fs.get_attributes(path)
+            if attributes != None and all(key in attributes for key in self._dataset_id_facets):
+                return dict((key, attributes[key]) for key in self._dataset_id_facets)
+
         with netCDF4.Dataset(path) as ds:
             return dict([(key, getattr(ds, key, None)) 
                          for key in self._dataset_id_facets])
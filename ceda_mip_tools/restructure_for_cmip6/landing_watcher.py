@@ -0,0 +1,182 @@
+"""
+Watches a landing area (recursively) with Linux inotify, reporting the
+files which have been completely written into it or moved into it.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_watch_mask = (_IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+               | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+# struct inotify_event, without the name which follows it
+_event_struct = struct.Struct('iIII')
+
+_read_size = 65536
+
+
+class InotifyUnavailable(Exception):
+    pass
+
+
+def is_wanted_file(name):
+    "whether a file name is one to restructure (netCDF, and not a hidden temporary file)"
+    return name.endswith('.nc') and not name.startswith('.')
+
+
+class LandingWatcher(object):
+    """
+    Watches the directory trees under the given paths.  get_files() returns
+    the paths of wanted files (see is_wanted_file) that have been closed
+    after writing or moved into a watched directory.  New subdirectories
+    are watched as they appear, and the files already in them (e.g. in a
+    directory tree moved in whole) are reported if they have not been
+    modified for settle_time seconds (the others will be reported when they
+    are closed).  Anything under an excluded path is ignored.
+
+    If the kernel's event queue overflows, events have been lost, and the
+    overflowed attribute is set until the caller clears it (after
+    rescanning).
+    """
+
+    def __init__(self, paths, exclude=(), settle_time=60):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise InotifyUnavailable("inotify is not available on this system")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self._fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._exclude = [os.path.realpath(path) for path in exclude]
+        self._settle_time = settle_time
+        self._dirs = {}
+        self.overflowed = False
+        for path in paths:
+            if os.path.isdir(path):
+                self._watch_tree(path, report_existing=False)
+
+
+    def _is_excluded(self, path):
+        real_path = os.path.realpath(path)
+        return any(real_path == excl or real_path.startswith(excl + '/')
+                   for excl in self._exclude)
+
+
+    def _watch_dir(self, path):
+        "adds a watch on one directory; returns whether it is (still) a directory"
+        wd = self._add_watch(self._fd, os.fsencode(path), _watch_mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(err, "cannot watch {}: {}".format(path, os.strerror(err)))
+        self._dirs[wd] = path
+        return True
+
+
+    def _watch_tree(self, top, report_existing=True):
+        """
+        watches a directory and its subdirectories, returning the settled
+        wanted files already in them if report_existing is set
+        """
+        files = []
+        if self._is_excluded(top) or not self._watch_dir(top):
+            return files
+        now = time.time()
+        for root, dirs, names in os.walk(top):
+            dirs[:] = [name for name in dirs
+                       if not self._is_excluded(os.path.join(root, name))
+                       and self._watch_dir(os.path.join(root, name))]
+            if report_existing:
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        if is_wanted_file(name) and now - os.stat(path).st_mtime >= self._settle_time:
+                            files.append(path)
+                    except FileNotFoundError:
+                        pass
+        return files
+
+
+    def _read_events(self):
+        "yields (wd, mask, name) for the events waiting to be read"
+        while True:
+            try:
+                data = os.read(self._fd, _read_size)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = _event_struct.unpack_from(data, pos)
+                pos += _event_struct.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b'\0'))
+                pos += length
+                yield wd, mask, name
+
+
+    def get_files(self, timeout):
+        """
+        Waits up to timeout seconds for events, and returns a list of the
+        paths of the files that have arrived (possibly empty).
+        """
+        readable, _, _ = select.select([self._fd], [], [], max(0, timeout))
+        if not readable:
+            return []
+        files = []
+        for wd, mask, name in self._read_events():
+            if mask & _IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            dir_path = self._dirs.get(wd)
+            if dir_path == None:
+                continue
+            if mask & _IN_IGNORED:
+                del self._dirs[wd]
+                continue
+            if mask & _IN_DELETE_SELF:
+                # (followed by _IN_IGNORED)
+                continue
+            if mask & _IN_MOVE_SELF:
+                # if moved within the tree, the watch has already been
+                # given the new path by the new parent's event
+                if not os.path.isdir(dir_path):
+                    self._rm_watch(self._fd, wd)
+                    del self._dirs[wd]
+                continue
+            path = os.path.join(dir_path, name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    files.extend(self._watch_tree(path))
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO) and is_wanted_file(name):
+                if not self._is_excluded(path):
+                    files.append(path)
+        return files
+
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -1,9 +1,27 @@
 import os
 import sys
+import json
+import time
+import errno
+import shutil
+import signal
 import argparse
+import collections
 
+from ceda_mip_tools.restructure_for_cmip6 import config
 from ceda_mip_tools.restructure_for_cmip6.dataset_id_getter \
-    import DatasetIDGetter
+    import DatasetIDGetter, DatasetIDGetterException
+from ceda_mip_tools.restructure_for_cmip6.target_index import TargetIndex
+from ceda_mip_tools.restructure_for_cmip6.version_linker import VersionLinker
+from ceda_mip_tools.restructure_for_cmip6.landing_watcher \
+    import LandingWatcher, InotifyUnavailable, is_wanted_file
+from ceda_mip_tools.fs_utils.manifest import get_filesystem
+from ceda_mip_tools.fs_utils.dir_fds import DirFDCache
+from ceda_mip_tools.pub_sys_intfc.util import format_size
+
+
+# name of the file in the --quarantine directory recording why each file is there
+_quarantine_report_name = 'quarantine-report.ndjson'
 
 
 class InvalidMove(Exception):
@@ -15,7 +33,24 @@ class RestructureForCMIP6(object):
     def __init__(self):
         self._args = None
         self._stat_dev_cache = {}
+        self._file_stats = {}
+        self._dir_moves = {}
+        # {incoming_path: previous_version_path} for unchanged files
+        self._links = {}
+        # [number of files, bytes] hard-linked instead of moved
+        self._linked = [0, 0]
+        self._target_index = None
         self._id_getter = None
+        self._fs = None
+        # the file operations are done relative to open descriptors of the
+        # (deep) source and target directories
+        self._dir_fds = DirFDCache()
+        self._allow_dir_moves = True
+        # {path: mtime} of files that could not be restructured in --watch mode
+        self._failed = {}
+        # {path: reason} for files skipped with --keep-going
+        self._file_errors = collections.OrderedDict()
+        self._error_fh = None
 
 
     def _parse_args(self, arg_list=None):
@@ -47,6 +82,59 @@ class RestructureForCMIP6(object):
                             help=('permit adding to existing '
                                   '(non-empty) version directory'))
 
+        parser.add_argument('--manifest',
+                            metavar='path',
+                            help=('scan manifest (from mip-scan) to consult '
+                                  'instead of scanning the input paths'))
+
+        parser.add_argument('--link-unchanged',
+                            action='store_true',
+                            help=('where a file looks unchanged from the latest earlier '
+                                  'version of its dataset (same name, size and '
+                                  'tracking_id), hard-link the earlier version\'s file '
+                                  'into the new version and delete the incoming copy. '
+                                  'Re-processing tools often copy tracking_id along, so '
+                                  'only --link-checksum proves that the contents are '
+                                  'the same'))
+
+        parser.add_argument('--link-checksum',
+                            action='store_true',
+                            help=('with --link-unchanged, also require the files to have '
+                                  'the same checksum (this reads both files in full)'))
+
+        parser.add_argument('-k', '--keep-going',
+                            action='store_true',
+                            help=('carry on if the dataset ID of a file cannot be worked '
+                                  'out (e.g. its name cannot be parsed, or does not match '
+                                  'its attributes), leaving the file where it is and '
+                                  'exiting with status 1 at the end'))
+
+        parser.add_argument('--quarantine',
+                            metavar='path',
+                            help=('directory to move such files into (implies '
+                                  '--keep-going); the reasons are recorded in {} there'
+                                  ).format(_quarantine_report_name))
+
+        parser.add_argument('--error-file',
+                            metavar='path',
+                            help=('file to list such files in, with the reasons, as '
+                                  'newline-delimited JSON (implies --keep-going)'))
+
+        parser.add_argument('--watch',
+                            action='store_true',
+                            help=('keep running, moving the *.nc files into place in '
+                                  'small batches as they are written to (or moved into) '
+                                  'the input directories, until interrupted; implies '
+                                  '--merge, and the output list is appended to'))
+
+        parser.add_argument('--rescan-interval',
+                            type=float,
+                            metavar='seconds',
+                            default=config.watch_rescan_interval,
+                            help=('with --watch, interval between rescans of the '
+                                  'input directories for files that were missed '
+                                  '(default {:g})').format(config.watch_rescan_interval))
+
         parser.add_argument('paths', nargs='+',
                             type=lambda path: self._is_valid_path(parser, path),
                             metavar='path',
@@ -54,9 +142,21 @@ class RestructureForCMIP6(object):
 
         args = parser.parse_args(arg_list or sys.argv[1:])
 
-        if args.output and not args.overwrite and os.path.exists(args.output):
+        if args.output and not args.overwrite and not args.watch and os.path.exists(args.output):
             parser.error(f"Output file '{args.output}' already exists")
 
+        if args.quarantine or args.error_file:
+            args.keep_going = True
+
+        if args.link_checksum and not args.link_unchanged:
+            parser.error("--link-checksum needs --link-unchanged")
+
+        if args.watch:
+            if args.manifest:
+                parser.error("--watch cannot be used with --manifest")
+            if not all(os.path.isdir(path) for path in args.paths):
+                parser.error("the input paths must be directories with --watch")
+
         self._args = args
         return args
 
@@ -74,19 +174,28 @@ class RestructureForCMIP6(object):
         s.add(val)
 
 
-    def _get_paths(self):
+    def _get_paths(self, input_paths):
         """
         turn list of paths into set of files, by recursing over any dirs
+        (but not into the output or quarantine directory, or the error file)
         """
+        excluded = self._get_excluded(self._args.error_file)
         all = set()
-        for path in self._args.paths:
+        for path in input_paths:
                 
-            if os.path.isfile(path):
-                self._add_to_file_set(all, path)
+            if self._fs.isfile(path):
+                if not self._is_excluded(path, excluded, self._fs.stat):
+                    self._add_to_file_set(all, path)
             else:
-                for root, dirs, files in os.walk(path):
+                for root, dirs, files in self._fs.walk(path):
+                    if excluded:
+                        dirs[:] = [name for name in dirs
+                                   if not self._is_excluded(os.path.join(root, name), excluded,
+                                                            self._fs.stat)]
                     for name in files:
-                        self._add_to_file_set(all, os.path.join(root, name))
+                        file_path = os.path.join(root, name)
+                        if not self._is_excluded(file_path, excluded, self._fs.stat):
+                            self._add_to_file_set(all, file_path)
         return all
                         
 
@@ -95,15 +204,58 @@ class RestructureForCMIP6(object):
         return os.path.join(root, *dataset_id.split("."))
 
 
+    def _check_output_dirs(self, paths_to_dataset_dirs):
+        """
+        check, using the index of the output tree, that no version directory
+        is added to without --merge, and that no file would overwrite another
+        (either one already there, or another of the input files)
+        """
+        targets = {}
+        collisions = []
+        for path in sorted(paths_to_dataset_dirs):
+            dataset_dir = paths_to_dataset_dirs[path]
+            existing = self._target_index.get_files(dataset_dir)
+            if existing and not self._args.merge:
+                raise InvalidMove(("adding to non-empty version directory {} "
+                                   "not permitted without --merge")
+                                  .format(dataset_dir))
+            name = os.path.basename(path)
+            target = os.path.join(dataset_dir, name)
+            if name in existing:
+                collisions.append("{} -> {} (already exists)".format(path, target))
+            elif target in targets:
+                collisions.append("{} -> {} (also the target of {})".format(path, target,
+                                                                            targets[target]))
+            targets[target] = path
+
+        if collisions:
+            raise InvalidMove("{} files would overwrite others:\n{}"
+                              .format(len(collisions), "\n".join(collisions)))
+
+
+    def _get_existing_versions(self, dataset_dirs):
+        "returns {dataset_dir: [other existing version directory names]}"
+        existing_versions = {}
+        for dataset_dir in dataset_dirs:
+            versions = self._target_index.get_other_versions(dataset_dir)
+            if versions:
+                existing_versions[dataset_dir] = versions
+        return existing_versions
+
+
     def _create_output_dirs(self, dataset_dirs):
+        "create the output directories, except those to be made by renaming a source directory"
         for path in dataset_dirs:
-            if os.path.exists(path):
-                if os.listdir(path) and not self._args.merge:
-                    raise Exception(("adding to non-empty version directory {} "
-                                    "not permitted without --merge")
-                                    .format(path))
-            else:
-                os.makedirs(path)
+            if self._target_index.version_dir_exists(path):
+                continue
+            if self._target_index.dataset_dir_exists(path):
+                if path not in self._dir_moves:
+                    self._dir_fds.mkdir(path)
+                continue
+            if path in self._dir_moves:
+                path = os.path.dirname(path)
+            if not self._dir_fds.exists(path):
+                self._dir_fds.makedirs(path)
 
 
     def _write_output(self, dataset_dirs):
@@ -121,7 +273,7 @@ class RestructureForCMIP6(object):
         parent_dirs = set((os.path.dirname(path) if '/' in path else '.'
                            for path in paths))
         for parent in parent_dirs:
-            if not os.access(parent, os.W_OK):
+            if not self._dir_fds.access(parent, os.W_OK):
                 raise InvalidMove("no write permission on '{}'".format(parent))
     
 
@@ -132,25 +284,183 @@ class RestructureForCMIP6(object):
 
 
     def _stat_dev(self, path):
-        return os.stat(path).st_dev
+        "device of a path, or if it does not exist yet, of its nearest existing ancestor"
+        while not self._dir_fds.exists(path or '.'):
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return self._dir_fds.stat(path or '.').st_dev
+
+
+    def _stat_file(self, path):
+        "stat a file to be moved, keeping the result for later stages"
+        if path not in self._file_stats:
+            self._file_stats[path] = self._fs.stat(path)
+        return self._file_stats[path]
 
 
     def _check_same_filesystem(self, path, target_dir):
-        if self._stat_dev(path) != self._stat_dev_with_cache(target_dir):
+        if self._stat_file(path).st_dev != self._stat_dev_with_cache(target_dir):
             raise InvalidMove("output is not on same filesystem: {} -> {}"
                               .format(path, target_dir))
             
 
-    def _do_renames(self, paths_to_dataset_dirs):
-        for path in sorted(paths_to_dataset_dirs.keys()):
-            dataset_dir = paths_to_dataset_dirs[path]
-            target = os.path.join(dataset_dir, os.path.basename(path))
-            os.rename(path, target)
+    def _do_renames(self, paths_to_dataset_dirs, on_dataset_done=None):
+        """
+        Moves the files into their dataset directories, one dataset directory
+        at a time (renaming the whole source directory where this was found
+        to be possible by _get_dir_moves).  If on_dataset_done is given, it is called as
+        on_dataset_done(dataset_dir, file_stats) as soon as all the files for
+        a dataset directory have been moved, where file_stats is a dictionary
+        of {new_path: stat_result} for the files whose stat results are
+        already known.
+        """
+        dataset_dirs_to_paths = {}
+        for path, dataset_dir in paths_to_dataset_dirs.items():
+            dataset_dirs_to_paths.setdefault(dataset_dir, []).append(path)
+
+        for dataset_dir in sorted(dataset_dirs_to_paths.keys()):
+            file_stats = {}
+            if dataset_dir in self._dir_moves:
+                self._dir_fds.rename(self._dir_moves[dataset_dir], dataset_dir, is_dir=True)
+            for path in sorted(dataset_dirs_to_paths[dataset_dir]):
+                target = os.path.join(dataset_dir, os.path.basename(path))
+                if path in self._links and self._link_unchanged(path, target):
+                    continue
+                if dataset_dir not in self._dir_moves:
+                    self._dir_fds.rename(path, target, is_dir=False)
+                if path in self._file_stats:
+                    file_stats[target] = self._file_stats[path]
+            if on_dataset_done:
+                on_dataset_done(dataset_dir, file_stats)
+
+
+    def _link_unchanged(self, path, target):
+        """
+        hard-links the previous version of an unchanged file to the target
+        and, once the link is confirmed, removes the incoming file; returns
+        False (having printed a warning) if the link cannot be made, so that
+        the file is moved instead
+        """
+        previous = self._links[path]
+        try:
+            self._dir_fds.link(previous, target)
+            if not os.path.samefile(previous, target):
+                raise OSError("{} is not a link to {}".format(target, previous))
+        except OSError as exc:
+            # (the rename replaces anything left at the target)
+            print("warning: could not link {} (moving it instead): {}".format(path, exc))
+            return False
+        self._dir_fds.remove(path)
+        self._linked[0] += 1
+        self._linked[1] += self._file_stats[path].st_size
+        return True
+
+
+    def _find_unchanged_files(self, paths_to_dataset_dirs):
+        """
+        with --link-unchanged, finds the files which are unchanged from the
+        previous version of their dataset; their version directories are then
+        made file by file, not by renaming a whole source directory
+        """
+        if not self._args.link_unchanged:
+            return {}
+        linker = VersionLinker(self._fs, checksum=self._args.link_checksum)
+        links = linker.find_unchanged(paths_to_dataset_dirs, self._target_index, self._file_stats)
+        for path in links:
+            self._dir_moves.pop(paths_to_dataset_dirs[path], None)
+        return links
+
+
+    def _report_links(self):
+        if self._linked[0]:
+            print("{} unchanged files hard-linked from previous versions "
+                  "({} not stored again)".format(self._linked[0], format_size(self._linked[1])))
+            self._linked = [0, 0]
+
+
+    def _get_dataset_ids(self, paths):
+        """
+        returns {path: dataset_id}; with --keep-going, files whose dataset ID
+        cannot be worked out are left out, and recorded in _file_errors
+        """
+        if not self._args.keep_going:
+            return dict(((path, self._dataset_id_getter(path))
+                         for path in paths))
+        paths_to_ids = {}
+        for path in sorted(paths):
+            try:
+                paths_to_ids[path] = self._dataset_id_getter(path)
+            except (DatasetIDGetterException, OSError) as exc:
+                self._file_errors[path] = str(exc)
+        return paths_to_ids
+
+
+    def _handle_file_errors(self):
+        """
+        reports the files recorded in _file_errors, moving them to the
+        quarantine directory and listing them in the error file if these
+        were given; returns {path: quarantined_path or None}
+        """
+        errors = self._file_errors
+        self._file_errors = collections.OrderedDict()
+        quarantine = self._args.quarantine
+        handled = collections.OrderedDict()
+        for path, reason in errors.items():
+            quarantined_as = None
+            if quarantine:
+                try:
+                    quarantined_as = self._quarantine_file(path, quarantine, reason)
+                except OSError as exc:
+                    print("warning: could not move {} to quarantine: {}".format(path, exc))
+            print("error: {}: {}{}".format(path, reason,
+                                           " (moved to {})".format(quarantined_as)
+                                           if quarantined_as else ""))
+            if self._error_fh:
+                self._error_fh.write(json.dumps({'path': path,
+                                                 'reason': reason,
+                                                 'quarantined_as': quarantined_as,
+                                                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}) + "\n")
+            handled[path] = quarantined_as
+        if self._error_fh:
+            self._error_fh.flush()
+        return handled
+
+
+    def _quarantine_file(self, path, quarantine, reason):
+        "moves a file into the quarantine directory (under a new name if needed), returning its new path"
+        name = os.path.basename(path)
+        stem, ext = os.path.splitext(name)
+        target = os.path.join(quarantine, name)
+        count = 0
+        while os.path.lexists(target):
+            count += 1
+            target = os.path.join(quarantine, "{}.{}{}".format(stem, count, ext))
+        try:
+            self._dir_fds.rename(path, target, is_dir=False)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            shutil.move(path, target)
+        with open(os.path.join(quarantine, _quarantine_report_name), 'a') as fh:
+            fh.write(json.dumps({'file': os.path.basename(target),
+                                 'original_path': os.path.abspath(path),
+                                 'reason': reason,
+                                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}) + "\n")
+        return target
+
+
+    def _open_error_file(self):
+        args = self._args
+        if args.quarantine:
+            os.makedirs(args.quarantine, exist_ok=True)
+        if args.error_file:
+            self._error_fh = open(args.error_file, 'a' if args.watch else 'w')
 
 
     def _get_dataset_dirs(self, paths):
-        paths_to_ids = dict(((path, self._dataset_id_getter(path))
-                                     for path in paths))
+        paths_to_ids = self._get_dataset_ids(paths)
 
         ids = set(paths_to_ids.values())
         ids_to_dirs = dict((id, self._get_output_dir(id))
@@ -162,44 +472,382 @@ class RestructureForCMIP6(object):
             dict((path, ids_to_dirs[id])
                  for path, id in paths_to_ids.items())
 
+        self._target_index = TargetIndex(dirs)
+        self._dir_moves = self._get_dir_moves(paths_to_dirs) if self._allow_dir_moves else {}
+
         return dirs, paths_to_dirs
-        
 
-    def run(self):
 
-        self._parse_args()
+    def _get_dir_moves(self, paths_to_dirs):
+        """
+        Finds source directories that can be renamed as a whole to become a
+        version directory, instead of moving their files one by one: those
+        where every file maps to the same version directory, there is
+        nothing else in the directory, the version directory does not exist
+        yet, no files from anywhere else go to it, and it is not one of the
+        input paths (or above one).  Returns a dictionary of
+        {dataset_dir: source_dir}.
+        """
+        source_dirs_to_paths = {}
+        dataset_dirs_to_sources = {}
+        for path, dataset_dir in paths_to_dirs.items():
+            source_dir = os.path.dirname(path) or '.'
+            source_dirs_to_paths.setdefault(source_dir, []).append(path)
+            dataset_dirs_to_sources.setdefault(dataset_dir, set()).add(source_dir)
+
+        # (the current directory and the input paths must stay where they are)
+        fixed_paths = [os.path.realpath(path) for path in ['.'] + list(self._args.paths)]
+        dir_moves = {}
+        for dataset_dir, source_dirs in dataset_dirs_to_sources.items():
+            if len(source_dirs) != 1 or self._target_index.path_exists(dataset_dir):
+                continue
+            source_dir = source_dirs.pop()
+            paths = source_dirs_to_paths[source_dir]
+            if any(paths_to_dirs[path] != dataset_dir for path in paths):
+                continue
+            real_source = os.path.realpath(source_dir)
+            real_target = os.path.realpath(dataset_dir)
+            # cannot rename the current directory or an input path (or one
+            # above them), or a directory into itself
+            if (any(path == real_source or path.startswith(real_source + '/')
+                    for path in fixed_paths)
+                or real_target.startswith(real_source + '/')):
+                continue
+            if not (self._dir_fds.access(source_dir, os.W_OK)
+                    and self._dir_fds.access(os.path.dirname(real_source), os.W_OK)):
+                continue
+            try:
+                contents = set(self._fs.listdir(source_dir))
+            except OSError:
+                continue
+            if contents == set(os.path.basename(path) for path in paths):
+                dir_moves[dataset_dir] = source_dir
+        return dir_moves
+        
+
+    def _plan(self, input_paths):
+        """
+        Works out where all the files under the input paths will go and
+        checks that they can be moved, without changing anything.  Returns
+        (dataset_dirs, paths_to_dataset_dirs), or raises InvalidMove.
+        """
+        self._fs = get_filesystem(self._args.manifest, dir_fds=self._dir_fds)
         self._dataset_id_getter = \
-            DatasetIDGetter(version=self._args.version).get_dataset_id
+            DatasetIDGetter(version=self._args.version, fs=self._fs).get_dataset_id
 
-        paths = self._get_paths()
+        paths = self._get_paths(input_paths)
         dataset_dirs, paths_to_dataset_dirs = self._get_dataset_dirs(paths)
 
+        self._check_write_permissions(paths)
+        self._check_output_dirs(paths_to_dataset_dirs)
+        for path, dataset_dir in paths_to_dataset_dirs.items():
+            self._check_same_filesystem(path, dataset_dir)
+
+        self._links = self._find_unchanged_files(paths_to_dataset_dirs)
+
+        return dataset_dirs, paths_to_dataset_dirs
+
+
+    def _prepare(self):
+        """
+        Works out where all the files will go, checks that they can be moved,
+        and creates the output directories.  Exits on error.  Returns
+        (dataset_dirs, paths_to_dataset_dirs).
+        """
         try:
-            self._check_write_permissions(paths)
+            dataset_dirs, paths_to_dataset_dirs = self._plan(self._args.paths)
         except InvalidMove as err:
             print(f"file move would fail for following reason:\n{err}")
             sys.exit(1)
 
+        for dataset_dir, versions in sorted(self._get_existing_versions(dataset_dirs).items()):
+            print("note: {} already has version(s) {}".format(os.path.dirname(dataset_dir),
+                                                             ", ".join(versions)))
 
         self._create_output_dirs(dataset_dirs)
 
-        try:
-            for path, dataset_dir in paths_to_dataset_dirs.items():
-                self._check_same_filesystem(path, dataset_dir)
+        return dataset_dirs, paths_to_dataset_dirs
 
-        except InvalidMove as err:
-            print(f"file move would fail for following reason:\n{err}")
-            print("warning: one or more empty output directories may have "
-                  f"been created under {self._args.directory} but no "
-                  "files have been moved")
-            sys.exit(1)
 
+    def run(self):
+
+        self._parse_args()
+        self._open_error_file()
+        if self._args.watch:
+            self._watch()
+            return
+        dataset_dirs, paths_to_dataset_dirs = self._prepare()
         
         self._do_renames(paths_to_dataset_dirs)
-        
+        if self._dir_moves:
+            print("{} source directories moved whole".format(len(self._dir_moves)))
+        self._report_links()
+        num_errors = len(self._handle_file_errors())
 
         self._write_output(dataset_dirs)
-        
+        self._dir_fds.close()
+        if self._error_fh:
+            self._error_fh.close()
+        if num_errors:
+            print("{} files could not be restructured".format(num_errors))
+            sys.exit(1)
+
+
+    def _watch(self):
+        """
+        Restructures the files arriving in the input directories (found with
+        inotify, plus periodic rescans) in small batches, until SIGINT or
+        SIGTERM is received, appending new version directories to the output
+        list as they are made.
+        """
+        args = self._args
+        # the files of a dataset may arrive in several batches
+        args.merge = True
+        # the source directories are being watched, and may receive more files
+        self._allow_dir_moves = False
+        try:
+            watcher = LandingWatcher(args.paths, exclude=self._get_excluded_dirs(),
+                                     settle_time=config.watch_settle_time)
+        except InotifyUnavailable as exc:
+            print(exc)
+            sys.exit(1)
+
+        stop_signals = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: stop_signals.append(signum))
+
+        output_fh = open(args.output, 'w' if args.overwrite else 'a') if args.output else None
+        written = set()
+        # {path: time queued}
+        queued = collections.OrderedDict()
+        next_rescan = 0
+        print("watching {} for files to restructure".format(", ".join(args.paths)))
+
+        while not stop_signals:
+            now = time.time()
+            if now >= next_rescan or watcher.overflowed:
+                watcher.overflowed = False
+                for path in self._rescan_landing_area():
+                    queued.setdefault(path, now)
+                next_rescan = now + args.rescan_interval
+
+            timeout = min(next_rescan - now, 1.)
+            if queued:
+                timeout = min(timeout, next(iter(queued.values())) + config.watch_batch_delay - now)
+            for path in watcher.get_files(timeout):
+                queued.setdefault(path, time.time())
+
+            if queued and (len(queued) >= config.watch_batch_size
+                           or time.time() - next(iter(queued.values())) >= config.watch_batch_delay):
+                batch = [queued.popitem(last=False)[0]
+                         for _ in range(min(len(queued), config.watch_batch_size))]
+                self._restructure_batch(batch, output_fh, written)
+                # other processes may rename or remove the directories
+                # before the next batch
+                self._dir_fds.close()
+
+        # the queued files are complete, so finish them before exiting
+        while queued:
+            batch = [queued.popitem(last=False)[0]
+                     for _ in range(min(len(queued), config.watch_batch_size))]
+            self._restructure_batch(batch, output_fh, written)
+
+        watcher.close()
+        if output_fh:
+            output_fh.close()
+        if self._error_fh:
+            self._error_fh.close()
+        self._dir_fds.close()
+
+
+    def _get_excluded(self, error_file=None):
+        """
+        the output and quarantine directories if they are under the input
+        paths, so that files moved into them are not picked up again, and
+        the error file if given, as a dictionary of {name: set of (st_dev,
+        st_ino)}, so that only the entries with one of those names need to
+        be stat-ed to see whether they are excluded (see _is_excluded)
+        """
+        excluded = {}
+        real_tops = [os.path.realpath(top) + '/' for top in self._args.paths]
+        for path in (self._args.directory, self._args.quarantine, error_file):
+            if path:
+                real_path = os.path.realpath(path)
+                if path != error_file and not any(real_path.startswith(top) for top in real_tops):
+                    continue
+                try:
+                    stat_data = os.stat(real_path)
+                except FileNotFoundError:
+                    # (nothing to find under the input paths yet)
+                    continue
+                excluded.setdefault(os.path.basename(real_path), set()).add(
+                    (stat_data.st_dev, stat_data.st_ino))
+        return excluded
+
+
+    def _is_excluded(self, path, excluded, stat_func):
+        "whether a path is one of the excluded entries (see _get_excluded)"
+        ids = excluded.get(os.path.basename(path))
+        if not ids:
+            return False
+        try:
+            stat_data = stat_func(path)
+        except OSError:
+            return False
+        return (stat_data.st_dev, stat_data.st_ino) in ids
+
+
+    def _rescan_landing_area(self):
+        "yields the files in the input directories which have not been modified recently"
+        excluded = self._get_excluded()
+        settled_time = time.time() - config.watch_settle_time
+        for top in self._args.paths:
+            for root, dirs, files in os.walk(top):
+                if excluded:
+                    dirs[:] = [name for name in dirs
+                               if not self._is_excluded(os.path.join(root, name), excluded,
+                                                        self._dir_fds.stat)]
+                for name in files:
+                    path = os.path.join(root, name)
+                    if not is_wanted_file(name):
+                        continue
+                    try:
+                        mtime = self._dir_fds.stat(path).st_mtime
+                    except FileNotFoundError:
+                        continue
+                    if mtime <= settled_time and self._failed.get(path) != mtime:
+                        yield path
+
+
+    def _restructure_batch(self, paths, output_fh, written):
+        """
+        Restructures a batch of files (those which still exist, and have not
+        already failed unless they have changed since).  If the batch fails,
+        the files are retried one by one, and those which fail are reported
+        (and quarantined if --quarantine was given) or left where they are.
+        """
+        batch = []
+        for path in paths:
+            try:
+                mtime = self._dir_fds.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if self._failed.get(path) != mtime:
+                batch.append(path)
+        if not batch:
+            return
+
+        self._file_stats = {}
+        paths_to_dataset_dirs = {}
+        try:
+            dataset_dirs, paths_to_dataset_dirs = self._plan(batch)
+            self._create_output_dirs(dataset_dirs)
+            self._do_renames(paths_to_dataset_dirs)
+        except (InvalidMove, DatasetIDGetterException, OSError) as err:
+            # the files already moved will not be found to retry, so their
+            # version directories are recorded now
+            moved = [path for path, dataset_dir in paths_to_dataset_dirs.items()
+                     if not os.path.lexists(path)
+                     and os.path.exists(os.path.join(dataset_dir, os.path.basename(path)))]
+            if moved:
+                self._record_dirs(set(paths_to_dataset_dirs[path] for path in moved),
+                                  len(moved), output_fh, written)
+            if len(batch) > 1:
+                for path in batch:
+                    self._restructure_batch([path], output_fh, written)
+                return
+            if not moved:
+                self._file_errors[batch[0]] = str(err)
+                self._handle_watch_errors()
+            return
+
+        for path in batch:
+            self._failed.pop(path, None)
+        self._handle_watch_errors()
+        self._record_dirs(dataset_dirs, len(paths_to_dataset_dirs), output_fh, written)
+
+
+    def _record_dirs(self, dataset_dirs, num_files, output_fh, written):
+        "appends the version directories not already in 'written' to the output list, and reports them"
+        new_dirs = sorted(path for path in dataset_dirs if path not in written)
+        if output_fh:
+            for path in new_dirs:
+                output_fh.write(path + "\n")
+            output_fh.flush()
+        written.update(new_dirs)
+        print("{}: moved {} files into {} versioned directories ({} new)".format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), num_files,
+                len(dataset_dirs), len(new_dirs)))
+        self._report_links()
+
+
+    def _handle_watch_errors(self):
+        "handles the files in _file_errors, remembering those left in place so as not to retry them until they change"
+        for path, quarantined_as in self._handle_file_errors().items():
+            if not quarantined_as:
+                try:
+                    self._failed[path] = self._dir_fds.stat(path).st_mtime
+                except FileNotFoundError:
+                    pass
+
+
+RestructurePlan = collections.namedtuple('RestructurePlan',
+                                         'dataset_dirs moves dir_moves existing_versions links')
+RestructurePlan.__doc__ = """
+The result of Restructurer.plan: the sorted list of version directories to
+be created, a dictionary of {file_path: version_directory}, a dictionary
+of {version_directory: source_directory} for the version directories that
+will be made by renaming a whole source directory, a dictionary of
+{version_directory: [names of other versions already present]}, and (with
+link_unchanged) a dictionary of {file_path: previous_version_file_path}
+for the unchanged files to be hard-linked from the previous version
+"""
+
+
+class Restructurer(object):
+    """
+    Python interface to restructure-for-cmip6.  plan() works out where the
+    files would go and checks that they can be moved, raising InvalidMove
+    (or DatasetIDGetterException for files whose dataset ID cannot be
+    worked out) without changing anything; execute() then creates the
+    directories and moves the files.  The stat results of the files are
+    kept between the calls.
+    """
+
+    def __init__(self, directory='.', version=None, merge=False, manifest=None,
+                 link_unchanged=False, link_checksum=False):
+        self._restructurer = RestructureForCMIP6()
+        self._settings = dict(directory=directory, version=version,
+                              merge=merge, manifest=manifest, output=None,
+                              link_unchanged=link_unchanged, link_checksum=link_checksum,
+                              keep_going=False, quarantine=None, error_file=None, watch=False)
+
+
+    def plan(self, paths):
+        "Returns a RestructurePlan for moving the files under the given paths"
+        for path in paths:
+            if not os.path.exists(path):
+                raise InvalidMove("input file/directory {} does not exist".format(path))
+        self._restructurer._args = argparse.Namespace(paths=list(paths), **self._settings)
+        dataset_dirs, moves = self._restructurer._plan(self._restructurer._args.paths)
+        return RestructurePlan(dataset_dirs, moves, dict(self._restructurer._dir_moves),
+                               self._restructurer._get_existing_versions(dataset_dirs),
+                               dict(self._restructurer._links))
+
+
+    def execute(self, plan, on_dataset_done=None):
+        """
+        Creates the version directories and moves the files, calling
+        on_dataset_done(dataset_dir, file_stats) after each version directory
+        is complete, as for RestructureForCMIP6._do_renames.  Returns the list
+        of version directories.
+        """
+        self._restructurer._dir_moves = plan.dir_moves
+        self._restructurer._links = plan.links
+        self._restructurer._create_output_dirs(plan.dataset_dirs)
+        self._restructurer._do_renames(plan.moves, on_dataset_done=on_dataset_done)
+        return plan.dataset_dirs
+
 
 def main():
     rs = RestructureForCMIP6()
@@ -0,0 +1,84 @@
+"""
+Index of what already exists in the output tree for the datasets being
+restructured: for each dataset, which version directories exist and which
+files are in the version directory being written to.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from ceda_mip_tools.restructure_for_cmip6 import config
+
+
+_version_dir_re = re.compile(r'v\d+$')
+
+
+class _DatasetEntry(object):
+
+    def __init__(self):
+        self.exists = False
+        self.names = set()
+        self.versions = []
+        self.files = None
+
+
+class TargetIndex(object):
+    """
+    Built with one scandir of each dataset directory (the parent of the
+    version directories) and of each target version directory that already
+    exists, run in parallel.
+    """
+
+    def __init__(self, version_dirs, jobs=config.scan_jobs):
+        self._entries = {}
+        version_dirs = sorted(set(version_dirs))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for version_dir, entry in zip(version_dirs,
+                                          executor.map(self._scan, version_dirs)):
+                self._entries[version_dir] = entry
+
+
+    def _scan(self, version_dir):
+        entry = _DatasetEntry()
+        dataset_dir, version = os.path.split(version_dir)
+        try:
+            with os.scandir(dataset_dir or '.') as it:
+                subdirs = []
+                for e in it:
+                    entry.names.add(e.name)
+                    if e.is_dir():
+                        subdirs.append(e.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return entry
+        entry.exists = True
+        entry.versions = sorted(name for name in subdirs if _version_dir_re.match(name))
+        if version in subdirs:
+            with os.scandir(version_dir) as it:
+                entry.files = set(e.name for e in it)
+        return entry
+
+
+    def dataset_dir_exists(self, version_dir):
+        "whether the parent of the version directory exists"
+        return self._entries[version_dir].exists
+
+
+    def version_dir_exists(self, version_dir):
+        return self._entries[version_dir].files != None
+
+
+    def path_exists(self, version_dir):
+        "whether anything (directory or not) exists at the version directory path"
+        return os.path.basename(version_dir) in self._entries[version_dir].names
+
+
+    def get_files(self, version_dir):
+        "names of the entries already in the version directory (empty if it does not exist)"
+        return self._entries[version_dir].files or set()
+
+
+    def get_other_versions(self, version_dir):
+        "names of the other version directories that exist for the same dataset"
+        version = os.path.basename(version_dir)
+        return [name for name in self._entries[version_dir].versions if name != version]
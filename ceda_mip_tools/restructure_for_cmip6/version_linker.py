@@ -0,0 +1,119 @@
+"""
+Finds incoming files which are unchanged from the previous version of
+their dataset already in the output tree, so that the previous version's
+file can be hard-linked into the new version instead of keeping another
+copy.
+"""
+
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from ceda_mip_tools.restructure_for_cmip6 import config
+from ceda_mip_tools.fs_utils.manifest import read_netcdf_attributes
+
+
+_checksum_block_size = 1 << 20
+
+
+def _version_number(version):
+    "'v20240101' -> 20240101"
+    return int(version[1:])
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_checksum_block_size), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+class VersionLinker(object):
+    """
+    An incoming file is taken to be unchanged if the latest earlier version
+    of its dataset has a file of the same name and size, on the same
+    device, with the same (non-empty) tracking_id global attribute, and, if
+    checksum is set, the same SHA-256 checksum.  The attributes (and
+    checksums) are read up to 'jobs' files at a time.
+    """
+
+    def __init__(self, fs, checksum=False, jobs=config.scan_jobs):
+        self._fs = fs
+        self._checksum = checksum
+        self._jobs = jobs
+
+
+    def _get_tracking_id(self, path):
+        attributes = self._fs.get_attributes(path)
+        if attributes == None or 'tracking_id' not in attributes:
+            attributes = read_netcdf_attributes(path, ['tracking_id'])
+        return attributes['tracking_id']
+
+
+    def _get_previous_files(self, version_dir, target_index):
+        """
+        returns (directory, {name: stat_result}) for the files in the
+        latest version earlier than version_dir, or (None, {}) if there is none
+        """
+        dataset_dir, version = os.path.split(version_dir)
+        earlier = [name for name in target_index.get_other_versions(version_dir)
+                   if _version_number(name) < _version_number(version)]
+        if not earlier:
+            return None, {}
+        previous_dir = os.path.join(dataset_dir, max(earlier, key=_version_number))
+        files = {}
+        try:
+            with os.scandir(previous_dir) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        files[entry.name] = entry.stat(follow_symlinks=False)
+        except OSError:
+            pass
+        return previous_dir, files
+
+
+    def _is_unchanged(self, pair):
+        path, previous_path = pair
+        try:
+            tracking_id = self._get_tracking_id(path)
+            if not tracking_id or tracking_id != self._get_tracking_id(previous_path):
+                return False
+            if self._checksum and _checksum(path) != _checksum(previous_path):
+                return False
+        except Exception:
+            # (e.g. an unreadable file): not known to be unchanged
+            return False
+        return True
+
+
+    def find_unchanged(self, paths_to_dataset_dirs, target_index, file_stats):
+        """
+        Returns {incoming_path: previous_version_path} for the incoming
+        files which are unchanged.  file_stats is {path: stat_result} for
+        the incoming files.
+        """
+        dataset_dirs_to_paths = {}
+        for path, dataset_dir in paths_to_dataset_dirs.items():
+            dataset_dirs_to_paths.setdefault(dataset_dir, []).append(path)
+
+        candidates = []
+        for dataset_dir, paths in sorted(dataset_dirs_to_paths.items()):
+            previous_dir, previous_files = self._get_previous_files(dataset_dir, target_index)
+            if not previous_files:
+                continue
+            for path in paths:
+                name = os.path.basename(path)
+                previous = previous_files.get(name)
+                if previous == None:
+                    continue
+                stat_data = file_stats[path]
+                if (previous.st_size == stat_data.st_size
+                        and previous.st_dev == stat_data.st_dev
+                        and previous.st_ino != stat_data.st_ino):
+                    candidates.append((path, os.path.join(previous_dir, name)))
+
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            return dict(pair for pair, unchanged in zip(candidates,
+                                                        executor.map(self._is_unchanged, candidates))
+                        if unchanged)
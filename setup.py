@@ -28,7 +28,12 @@ setup(
         'console_scripts': [
             'add-to-mip = ceda_mip_tools.pub_sys_intfc.add_mip_dataset:main',
             'mip-dataset-status = ceda_mip_tools.pub_sys_intfc.mip_dataset_status:main',
-            'restructure-for-cmip6 = ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6:main'
+            'check-mip-drs = ceda_mip_tools.pub_sys_intfc.check_mip_drs:main',
+            'restructure-for-cmip6 = ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6:main',
+            'mip-pipeline = ceda_mip_tools.pipeline.mip_pipeline:main',
+            'mip-scan = ceda_mip_tools.fs_utils.mip_scan:main',
+            'mip-merge-results = ceda_mip_tools.pub_sys_intfc.merge_mip_results:main',
+            'mip-chunk-audit = ceda_mip_tools.pub_sys_intfc.mip_chunk_audit:main',
             ],
         }
 )
@@ -0,0 +1,243 @@
+import os
+import sys
+import pwd
+import json
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import config
+from ceda_mip_tools.pub_sys_intfc.add_mip_dataset import MIPAdder
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.errors import DatasetValidationError, ServiceError
+
+
+@pytest.fixture
+def pub_client(tmp_path, monkeypatch):
+    # (the files are checked as being for ingestion by whoever runs the tests)
+    monkeypatch.setattr(config, 'ingestion_user', pwd.getpwuid(os.getuid()).pw_name)
+    monkeypatch.setattr(config, 'validation_records_dir', str(tmp_path / 'records'))
+    pub_client = PublicationClient('CMIP6', requester='tester', check_integrity=False)
+    pub_client.checked = []
+    perms_checker = pub_client._get_perms_checker()
+    real_check_access = perms_checker.check_access
+
+    def check_access(path, access, **kwargs):
+        # (leaving out the checks of the parent directories)
+        if access != 'x':
+            pub_client.checked.append(os.path.basename(path))
+        return real_check_access(path, access, **kwargs)
+    perms_checker.check_access = check_access
+    return pub_client
+
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    dataset_dir = tmp_path / 'v20200101'
+    (dataset_dir / 'sub').mkdir(parents=True)
+    for name in ('a.nc', 'b.nc', os.path.join('sub', 'c.nc')):
+        (dataset_dir / name).write_bytes(b'x' * 10)
+    return str(dataset_dir)
+
+
+def _validate(pub_client, dataset_dir, **kwargs):
+    pub_client.checked = []
+    pub_client._get_perms_checker().clear_cache()
+    return pub_client.validate(dataset_dir, **kwargs)
+
+
+def test_only_changed_entries_are_rechecked(pub_client, dataset_dir):
+    assert _validate(pub_client, dataset_dir) == (3, 30)
+    assert sorted(pub_client.checked) == ['a.nc', 'b.nc', 'c.nc', 'sub', 'v20200101']
+
+    assert _validate(pub_client, dataset_dir) == (3, 30)
+    assert pub_client.checked == ['v20200101']
+
+    os.chmod(os.path.join(dataset_dir, 'b.nc'), 0o600)
+    _validate(pub_client, dataset_dir)
+    assert pub_client.checked == ['v20200101', 'b.nc']
+
+    _validate(pub_client, dataset_dir, full_check=True)
+    assert len(pub_client.checked) == 5
+
+
+def test_failed_entries_are_rechecked(pub_client, dataset_dir):
+    path = os.path.join(dataset_dir, 'a.nc')
+    os.chmod(path, 0)
+    with pytest.raises(DatasetValidationError):
+        _validate(pub_client, dataset_dir)
+    with pytest.raises(DatasetValidationError):
+        _validate(pub_client, dataset_dir)
+    assert 'a.nc' in pub_client.checked
+    os.chmod(path, 0o644)
+    _validate(pub_client, dataset_dir)
+
+
+def test_directories_need_search_permission(pub_client, dataset_dir):
+    _validate(pub_client, dataset_dir)
+    os.chmod(os.path.join(dataset_dir, 'sub'), 0o644)
+    try:
+        with pytest.raises(DatasetValidationError):
+            _validate(pub_client, dataset_dir)
+    finally:
+        os.chmod(os.path.join(dataset_dir, 'sub'), 0o755)
+
+
+def test_records_are_per_set_of_checks(pub_client, dataset_dir):
+    _validate(pub_client, dataset_dir)
+    pub_client._fingerprints.checks = ['integrity', 'something-new']
+    _validate(pub_client, dataset_dir)
+    assert len(pub_client.checked) == 5
+
+
+def test_known_stat_results_are_used(pub_client, dataset_dir):
+    file_stats = dict((os.path.join(root, name), os.stat(os.path.join(root, name)))
+                      for root, dirs, files in os.walk(dataset_dir) for name in files + dirs)
+    _validate(pub_client, dataset_dir)
+    stated = []
+    real_stat = pub_client.fs.stat
+    pub_client.fs.stat = lambda path: stated.append(path) or real_stat(path)
+    assert _validate(pub_client, dataset_dir, file_stats=file_stats) == (3, 30)
+    assert stated == []
+
+
+def test_non_netcdf_files(pub_client, dataset_dir):
+    open(os.path.join(dataset_dir, 'notes.txt'), 'w').close()
+    with pytest.raises(DatasetValidationError) as exc_info:
+        _validate(pub_client, dataset_dir)
+    assert 'invalid filename (not *.nc)' in str(exc_info.value)
+
+
+def _dataset_dirs(tmp_path, sizes):
+    "a dataset directory for each size, with one file of that size"
+    paths = []
+    for i, size in enumerate(sizes):
+        path = tmp_path.joinpath('CMIP6', 'CMIP', 'MOHC', 'M{}'.format(i), 'historical',
+                                 'r1i1p1f1', 'Amon', 'tas', 'gn', 'v20200101')
+        path.mkdir(parents=True)
+        (path / 'a.nc').write_bytes(b'x' * size)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def submitted(tmp_path, monkeypatch):
+    "the dataset IDs submitted by add-to-mip, in order"
+    monkeypatch.setattr(config, 'ingestion_user', pwd.getpwuid(os.getuid()).pw_name)
+    monkeypatch.setattr(config, 'validation_records_dir', str(tmp_path / 'records'))
+    submitted = []
+    monkeypatch.setattr(PublicationClient, 'submit',
+                        lambda self, path, dataset_id, replica=False: submitted.append(dataset_id))
+    return submitted
+
+
+def _run(tmp_path, monkeypatch, options, paths):
+    "runs add-to-mip, returning its exit status and the statuses from its report"
+    report = str(tmp_path / 'report.ndjson')
+    monkeypatch.setattr(sys, 'argv', ['add-to-mip', '--no-integrity-check', '--report', report]
+                        + options + ['CMIP6'] + paths)
+    with pytest.raises(SystemExit) as exc_info:
+        MIPAdder().run()
+    with open(report) as f:
+        return exc_info.value.code, [json.loads(line)['status'] for line in f]
+
+
+def _source_ids(dataset_ids):
+    return [dataset_id.split('.')[3] for dataset_id in dataset_ids]
+
+
+def test_schedules():
+    checked = [('a', 'A', (1, 20)), ('b', 'B', (1, 10)), ('c', 'C', (1, 40)),
+               ('d', 'D', (1, 30))]
+    adder = MIPAdder()
+
+    def order(policy):
+        return ''.join(path for path, _, _ in adder._schedule(checked, policy))
+    assert order('input') == 'abcd'
+    assert order('smallest-first') == 'badc'
+    assert order('largest-first') == 'cdab'
+    assert order('interleaved') == 'cbda'
+
+
+def test_byte_budget(tmp_path, monkeypatch, submitted):
+    paths = _dataset_dirs(tmp_path, [30, 10, 20])
+    exit_status, statuses = _run(tmp_path, monkeypatch,
+                                 ['--schedule', 'smallest-first', '--byte-budget', '35'], paths)
+    assert exit_status == 0
+    assert _source_ids(submitted) == ['M1', 'M2']
+    assert statuses == ['added', 'added', 'deferred']
+
+
+def test_byte_budget_in_input_order(tmp_path, monkeypatch, submitted):
+    paths = _dataset_dirs(tmp_path, [30, 10, 5])
+    exit_status, statuses = _run(tmp_path, monkeypatch, ['--byte-budget', '35'], paths)
+    assert exit_status == 0
+    # (a smaller directory later on can still fit)
+    assert _source_ids(submitted) == ['M0', 'M2']
+    assert statuses == ['added', 'deferred', 'added']
+
+
+def test_lazy_list_stops_at_invalid_directory(tmp_path, monkeypatch, submitted):
+    paths = _dataset_dirs(tmp_path, [10, 10])
+    list_file = tmp_path / 'dirs'
+    list_file.write_bytes(b'\0'.join(path.encode() for path in
+                                     [paths[0], str(tmp_path / 'not-a-dataset'), paths[1]]))
+    exit_status, statuses = _run(tmp_path, monkeypatch,
+                                 ['--lazy', '--null', '--from-file', str(list_file)], [])
+    assert exit_status == 1
+    # (the directories before it are processed, and none after it)
+    assert _source_ids(submitted) == ['M0']
+    assert statuses == ['added']
+
+
+@pytest.fixture
+def known(monkeypatch):
+    """
+    the statuses the publication system has, by source ID ('error' for the
+    query to fail), and the lists of source IDs looked up
+    """
+    known = {}
+    known['queries'] = queries = []
+
+    def status_many(self, dataset_specs, refresh=False, cache_ttl=None):
+        queries.append(_source_ids(dataset_specs))
+        if known.get('error'):
+            raise ServiceError("unreachable")
+        return [(dataset_id, known.get(dataset_id.split('.')[3], 'UNKNOWN'))
+                for dataset_id in dataset_specs]
+    monkeypatch.setattr(PublicationClient, 'status_many', status_many)
+    monkeypatch.setattr(config, 'max_query_datasets', 2)
+    return known
+
+
+@pytest.mark.parametrize('policy, added, statuses', [
+    ('report', ['M0', 'M1', 'M2', 'M3'], ['added'] * 4),
+    ('skip', ['M0', 'M3'], ['added', 'skipped', 'skipped', 'added']),
+    ('skip-unless-failed', ['M0', 'M2', 'M3'], ['added', 'skipped', 'added', 'added'])])
+def test_preflight(tmp_path, monkeypatch, submitted, known, policy, added, statuses):
+    known.update(M1='completed', M2='failed')
+    paths = _dataset_dirs(tmp_path, [10] * 4)
+    exit_status, reported = _run(tmp_path, monkeypatch, ['--preflight', policy], paths)
+    assert exit_status == 0
+    assert _source_ids(submitted) == added
+    assert reported == statuses
+    # (a page at a time)
+    assert known['queries'] == [['M0', 'M1'], ['M2', 'M3']]
+
+
+def test_preflight_passes_on_errors(tmp_path, monkeypatch, submitted, known, capsys):
+    paths = _dataset_dirs(tmp_path, [10, 10])
+    known['M0'] = 'completed'
+    exit_status, reported = _run(tmp_path, monkeypatch, ['--preflight', 'skip'],
+                                 [str(tmp_path)] + paths)
+    # (the invalid directory is not looked up, but reported as usual)
+    assert known['queries'] == [['M0'], ['M1']]
+    assert exit_status == 1
+    assert reported == ['error', 'skipped', 'added']
+
+    # if the publication system cannot be reached, everything is submitted
+    known['error'] = True
+    del submitted[:]
+    exit_status, reported = _run(tmp_path, monkeypatch, ['--preflight', 'skip'], paths)
+    assert exit_status == 0
+    assert reported == ['added', 'added']
+    assert 'WARNING: pre-flight status check failed' in capsys.readouterr().out
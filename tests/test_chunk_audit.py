@@ -0,0 +1,79 @@
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+numpy = pytest.importorskip('numpy')
+
+from ceda_mip_tools.pub_sys_intfc import chunk_audit
+
+
+def _write_file(path, data_model='NETCDF4', **var_kwargs):
+    "a file with a 4 MiB float variable tas(t, y, x)"
+    with netCDF4.Dataset(path, 'w', format=data_model) as ds:
+        ds.createDimension('t', 128)
+        ds.createDimension('y', 64)
+        ds.createDimension('x', 128)
+        var = ds.createVariable('tas', 'f4', ('t', 'y', 'x'), **var_kwargs)
+        var[:] = numpy.zeros((128, 64, 128))
+        # (too small to be audited)
+        ds.createVariable('lat', 'f8', ('y',))[:] = numpy.arange(64)
+    return path
+
+
+def _codes(findings):
+    return sorted(finding.code for finding in findings)
+
+
+def test_good_layout(tmp_path):
+    path = _write_file(str(tmp_path / 'good.nc'), zlib=True, shuffle=True, complevel=4,
+                       chunksizes=(16, 64, 128))
+    assert chunk_audit.audit_file(path) == []
+
+
+def test_uncompressed(tmp_path):
+    findings = chunk_audit.audit_file(_write_file(str(tmp_path / 'f.nc')))
+    assert _codes(findings) == ['uncompressed']
+    assert findings[0].variable == 'tas'
+
+
+def test_deflate_settings(tmp_path):
+    path = _write_file(str(tmp_path / 'f.nc'), zlib=True, shuffle=False, complevel=9,
+                       chunksizes=(16, 64, 128))
+    assert _codes(chunk_audit.audit_file(path)) == ['high-deflate', 'no-shuffle']
+
+
+def test_small_chunks(tmp_path):
+    path = _write_file(str(tmp_path / 'f.nc'), zlib=True, shuffle=True,
+                       chunksizes=(1, 8, 8))
+    assert _codes(chunk_audit.audit_file(path)) == ['small-chunks']
+
+
+def test_classic_format(tmp_path):
+    path = _write_file(str(tmp_path / 'f.nc'), data_model='NETCDF3_CLASSIC')
+    assert _codes(chunk_audit.audit_file(path)) == ['classic-format']
+
+
+def test_unreadable(tmp_path):
+    path = tmp_path / 'junk.nc'
+    path.write_bytes(b'junk')
+    assert _codes(chunk_audit.audit_file(str(path))) == ['unreadable']
+
+
+def test_audit_files_in_order(tmp_path):
+    paths = [_write_file(str(tmp_path / 'good.nc'), zlib=True, shuffle=True,
+                         chunksizes=(16, 64, 128)),
+             _write_file(str(tmp_path / 'plain.nc'))]
+    for jobs in (1, 2):
+        results = list(chunk_audit.audit_files(paths, jobs=jobs))
+        assert [path for path, findings in results] == paths
+        assert [_codes(findings) for path, findings in results] == [[], ['uncompressed']]
+
+
+def test_summarise():
+    Finding = chunk_audit.Finding
+    results = [('a.nc', [Finding('uncompressed', 'tas', '4.0 MiB')]),
+               ('b.nc', [Finding('uncompressed', 'tas', '4.0 MiB'),
+                         Finding('no-shuffle', 'pr', 'deflate level 4')]),
+               ('c.nc', [])]
+    assert chunk_audit.summarise(results) == [
+        'uncompressed: 2 of 3 files (e.g. tas: 4.0 MiB)',
+        'no-shuffle: 1 of 3 files (e.g. pr: deflate level 4)']
@@ -0,0 +1,82 @@
+import os
+import pwd
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import config
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.errors import (IngestionUserError, InvalidDatasetIDError,
+                                                 DatasetValidationError, SubmissionError)
+
+
+_dataset_path = os.path.join('CMIP6', 'CMIP', 'MOHC', 'UKESM1-0-LL', 'historical', 'r1i1p1f2',
+                             'Amon', 'tas', 'gn', 'v20200101')
+
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    dataset_dir = tmp_path / _dataset_path
+    dataset_dir.mkdir(parents=True)
+    (dataset_dir / 'a.nc').write_bytes(b'x' * 10)
+    return str(dataset_dir)
+
+
+def _client(monkeypatch, tmp_path, **kwargs):
+    "a client that checks the files for whoever runs the tests, and records its submissions"
+    monkeypatch.setattr(config, 'ingestion_user', pwd.getpwuid(os.getuid()).pw_name)
+    monkeypatch.setattr(config, 'validation_records_dir', str(tmp_path / 'records'))
+    pub_client = PublicationClient('CMIP6', requester='tester', check_integrity=False, **kwargs)
+    pub_client.submitted = []
+
+    def submit(path, dataset_id, replica=False):
+        if 'reject' in path:
+            raise SubmissionError("publication system did not accept dataset")
+        pub_client.submitted.append(dataset_id)
+    pub_client.submit = submit
+    return pub_client
+
+
+def test_ingestion_user_looked_up_on_first_validation(dataset_dir, monkeypatch):
+    monkeypatch.setattr(config, 'ingestion_user', 'no-such-user-for-the-tests')
+    # (a client that only queries does not need the user)
+    pub_client = PublicationClient('CMIP6', requester='tester')
+    assert pub_client.get_dataset_id(dataset_dir) == _dataset_path.replace(os.sep, '.')
+    with pytest.raises(IngestionUserError):
+        pub_client.validate(dataset_dir)
+    with pytest.raises(IngestionUserError):
+        pub_client.add(dataset_dir)
+
+
+def test_add(dataset_dir, tmp_path, monkeypatch):
+    pub_client = _client(monkeypatch, tmp_path)
+    dataset_id = _dataset_path.replace(os.sep, '.')
+    assert pub_client.add(dataset_dir) == dataset_id
+    assert pub_client.submitted == [dataset_id]
+    with pytest.raises(InvalidDatasetIDError):
+        pub_client.add(str(tmp_path))
+
+
+def test_add_many_carries_on_after_errors(dataset_dir, tmp_path, monkeypatch):
+    pub_client = _client(monkeypatch, tmp_path)
+    dataset_id = _dataset_path.replace(os.sep, '.')
+    rejected_dir = os.path.join(str(tmp_path), 'reject', _dataset_path)
+    os.makedirs(rejected_dir)
+    open(os.path.join(rejected_dir, 'a.nc'), 'w').close()
+    notes_path = os.path.join(dataset_dir, 'notes.txt')
+    open(notes_path, 'w').close()
+
+    results = pub_client.add_many([str(tmp_path), rejected_dir, dataset_dir])
+    assert [result.directory for result in results] == [str(tmp_path), rejected_dir, dataset_dir]
+    assert isinstance(results[0].error, InvalidDatasetIDError)
+    assert results[0].dataset_id == None
+    # (the dataset ID is kept for errors after it was found)
+    assert isinstance(results[1].error, SubmissionError)
+    assert results[1].dataset_id == dataset_id
+    assert isinstance(results[2].error, DatasetValidationError)
+    assert results[2].dataset_id == dataset_id
+    assert not any(result.added for result in results)
+    assert pub_client.submitted == []
+
+    os.remove(notes_path)
+    assert [result.added for result in pub_client.add_many([dataset_dir])] == [True]
+    assert pub_client.submitted == [dataset_id]
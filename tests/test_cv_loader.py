@@ -0,0 +1,85 @@
+import os
+import json
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import config, cv_loader
+from ceda_mip_tools.pub_sys_intfc.cv_loader import CVLoader
+from ceda_mip_tools.pub_sys_intfc.dataset_drs import DRSValidator
+
+
+_cvs = {'mip_era': ['CMIP6'],
+        'activity_id': {'CMIP': 'DECK', 'ScenarioMIP': 'scenarios'},
+        'source_id': {'UKESM1-0-LL': {}, 'HadGEM3-GC31-LL': {}}}
+
+
+@pytest.fixture
+def cv_dir(tmp_path):
+    cv_dir = tmp_path / 'cvs'
+    cv_dir.mkdir()
+    for name, vals in _cvs.items():
+        (cv_dir / 'CMIP6_{}.json'.format(name)).write_text(json.dumps({name: vals}))
+    return str(cv_dir)
+
+
+def _loader(cv_dir, tmp_path):
+    return CVLoader(cv_dir, str(tmp_path / 'cache'))
+
+
+def test_load(cv_dir, tmp_path):
+    allowed_vals = _loader(cv_dir, tmp_path).load('CMIP6', config.projects['CMIP6'])
+    assert allowed_vals == {0: frozenset(['CMIP6']),
+                            1: frozenset(['CMIP', 'ScenarioMIP']),
+                            3: frozenset(['UKESM1-0-LL', 'HadGEM3-GC31-LL'])}
+
+
+def test_no_cv_files(tmp_path):
+    (tmp_path / 'empty').mkdir()
+    assert _loader(str(tmp_path / 'empty'), tmp_path).load('EERIE', config.projects['EERIE']) == None
+
+
+def test_cache_is_used_until_a_file_changes(cv_dir, tmp_path, monkeypatch):
+    compiled = []
+    real_compile = CVLoader._compile
+
+    def compile(self, cv_files):
+        compiled.append(1)
+        return real_compile(self, cv_files)
+    monkeypatch.setattr(CVLoader, '_compile', compile)
+
+    project_config = config.projects['CMIP6']
+    first = _loader(cv_dir, tmp_path).load('CMIP6', project_config)
+    assert _loader(cv_dir, tmp_path).load('CMIP6', project_config) == first
+    assert len(compiled) == 1
+
+    path = os.path.join(cv_dir, 'CMIP6_source_id.json')
+    with open(path, 'w') as f:
+        json.dump({'source_id': ['NEW-MODEL']}, f)
+    os.utime(path, ns=(0, 10 ** 9))
+    assert _loader(cv_dir, tmp_path).load('CMIP6', project_config)[3] == frozenset(['NEW-MODEL'])
+    assert len(compiled) == 2
+
+
+def test_failed_cache_write_leaves_no_temporary_file(cv_dir, tmp_path, monkeypatch):
+    def rename(src, dst):
+        raise OSError("simulated failure")
+    monkeypatch.setattr(cv_loader.os, 'rename', rename)
+    allowed_vals = _loader(cv_dir, tmp_path).load('CMIP6', config.projects['CMIP6'])
+    assert allowed_vals[0] == frozenset(['CMIP6'])
+    assert os.listdir(str(tmp_path / 'cache')) == []
+
+
+def test_cv_values_do_not_loosen_the_built_in_lists(cv_dir, tmp_path):
+    project_config = config.projects['PRIMAVERA']
+    allowed_vals = _loader(cv_dir, tmp_path).load('PRIMAVERA', project_config)
+    validator = DRSValidator(project_config['drs'], extra_allowed_vals=allowed_vals)
+    template = '{}.primWP5.MOHC.{}.highres-future.r1i1p1f1.Amon.tas.gn.v20200101'
+
+    def errors(*facets):
+        [result] = validator.validate_many([template.format(*facets)])
+        return [(error.name, error.value) for error in result.errors]
+    assert errors('PRIMAVERA', 'HadGEM3-GC31-LL') == []
+    # (the built-in lists are not widened or narrowed by the CVs...)
+    assert errors('CMIP6', 'HadGEM3-GC31-LL') == [('mip_era', 'CMIP6')]
+    # (...but facets without one are checked against the CV)
+    assert errors('PRIMAVERA', 'NOT-A-MODEL') == [('source_id', 'NOT-A-MODEL')]
@@ -0,0 +1,45 @@
+from ceda_mip_tools.pub_sys_intfc import config
+from ceda_mip_tools.pub_sys_intfc.dataset_drs import DatasetDRS, DRSValidator
+
+
+_drs_config = config.projects['CMIP6']['drs']
+_good_id = 'CMIP6.CMIP.MOHC.UKESM1-0-LL.historical.r1i1p1f2.Amon.tas.gn.v20190406'
+
+
+def _reasons(errors):
+    return [(error.name, error.value, error.reason) for error in errors]
+
+
+def test_valid_ids_and_paths():
+    validator = DRSValidator(_drs_config)
+    path = '/badc/cmip6/data/' + _good_id.replace('.', '/')
+    results = validator.validate_many([_good_id, path])
+    assert [result.dataset_id for result in results] == [_good_id, _good_id]
+    assert [result.errors for result in results] == [[], []]
+    assert results[1].item == path
+
+
+def test_per_facet_diagnostics():
+    validator = DRSValidator(_drs_config)
+    bad_id = 'CMIP5.CMIP..UKESM1-0-LL.historical.r1i1p1f2.Amon.tas.gn.latest'
+    [result] = validator.validate_many([bad_id])
+    assert result.dataset_id == None
+    assert _reasons(result.errors) == [
+        ('institution_id', '', 'empty value'),
+        ('mip_era', 'CMIP5', 'not an allowed value'),
+        ('version', 'latest', 'not a version (v<number>)')]
+    assert str(result.errors[0]) == "facet 2 (institution_id) '': empty value"
+
+
+def test_wrong_number_of_facets():
+    [result] = DRSValidator(_drs_config).validate_many(['CMIP6.CMIP.MOHC'])
+    assert [str(error) for error in result.errors] == ['has 3 facets (expected 10)']
+
+
+def test_dataset_drs_uses_the_validator():
+    drs = DatasetDRS(_drs_config)
+    assert drs.plausible_dataset_id(_good_id)
+    assert not drs.plausible_dataset_id(_good_id.replace('CMIP6.CMIP.', 'CMIP6.XMIP.'))
+    assert drs.dir_to_dataset_id('/data/' + _good_id.replace('.', '/')) == _good_id
+    assert _reasons(drs.get_dir_errors('CMIP6/CMIP/MOHC')) == [
+        (None, None, 'has 3 facets (expected 10)')]
@@ -0,0 +1,75 @@
+import os
+import argparse
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import config
+from ceda_mip_tools.pub_sys_intfc.dataset_drs import DatasetDRS
+from ceda_mip_tools.pub_sys_intfc.dataset_index import DatasetIDIndex, is_wildcard_spec
+from ceda_mip_tools.pub_sys_intfc.errors import InvalidDatasetIDError
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.mip_dataset_status import MIPStatusChecker
+
+
+_drs = DatasetDRS(config.projects['CMIP6']['drs'])
+_template = 'CMIP6.CMIP.{}.{}.historical.r1i1p1f1.Amon.{}.gn.v20200101'
+_ids = [_template.format(institution, source, variable)
+        for institution, source in (('MOHC', 'HadGEM3'), ('MOHC', 'UKESM1'), ('NCAR', 'CESM2'))
+        for variable in ('tas', 'pr')]
+
+
+@pytest.fixture
+def index():
+    index = DatasetIDIndex(_drs)
+    index.add_many(_ids)
+    # (ignored)
+    assert not index.add('CMIP6.CMIP.MOHC')
+    index.add(_ids[0])
+    return index
+
+
+def test_is_wildcard_spec():
+    assert is_wildcard_spec('CMIP6.*.MOHC')
+    assert is_wildcard_spec('CMIP6.CMIP.MOHC.UKESM1-0-L?')
+    assert is_wildcard_spec('CMIP6.[CD]MIP')
+    assert not is_wildcard_spec(_ids[0])
+
+
+def test_match(index):
+    assert len(index) == 6
+    assert index.match('*.*.*.*.*.*.*.*.*.*') == _ids
+    assert index.match('CMIP6.CMIP.MOHC.*.*.*.*.tas.*.*') == [_ids[0], _ids[2]]
+    assert index.match('*.*.*.*UK*.*.*.*.[pq]r.*.v2020*') == [_ids[3]]
+    assert index.match(_ids[4]) == [_ids[4]]
+    assert index.match('*.*.NOAA.*.*.*.*.*.*.*') == []
+
+
+def test_match_needs_all_facets(index):
+    with pytest.raises(ValueError):
+        index.match('CMIP6.*')
+
+
+def test_add_from_directory(tmp_path):
+    for dataset_id in _ids[:2]:
+        os.makedirs(os.path.join(str(tmp_path), *dataset_id.split('.')))
+    # (version directories are not descended into)
+    os.makedirs(os.path.join(str(tmp_path), *_ids[0].split('.'), 'v1', 'v2'))
+    index = DatasetIDIndex(_drs)
+    index.add_from_directory(str(tmp_path))
+    assert sorted(index.match('*.*.*.*.*.*.*.*.*.*')) == sorted(_ids[:2])
+
+
+def test_specs_and_wildcards_in_order(index):
+    checker = MIPStatusChecker()
+    checker._client = PublicationClient('CMIP6', requester='tester')
+    checker._index = index
+    args = argparse.Namespace(dataset_specs=[_ids[5], 'CMIP6.CMIP.MOHC.*.*.*.*.pr.*.*',
+                                             _ids[0]])
+    assert checker._get_dataset_ids(args) == [_ids[5], _ids[1], _ids[3], _ids[0]]
+
+    args.dataset_specs = ['CMIP6.CMIP.NOAA.*.*.*.*.*.*.*']
+    with pytest.raises(ValueError):
+        checker._get_dataset_ids(args)
+    args.dataset_specs = [_ids[0].replace('CMIP.', 'XMIP.')]
+    with pytest.raises(InvalidDatasetIDError):
+        checker._get_dataset_ids(args)
@@ -0,0 +1,116 @@
+import os
+import shutil
+
+import pytest
+
+from ceda_mip_tools.fs_utils.dir_fds import DirFDCache
+
+
+@pytest.fixture
+def cache():
+    with DirFDCache() as cache:
+        yield cache
+
+
+def _touch(path, content=''):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_stat_and_tests(tmp_path, cache):
+    _touch(str(tmp_path / 'f.nc'), 'data')
+    os.symlink('f.nc', str(tmp_path / 'link'))
+    assert cache.stat(str(tmp_path / 'f.nc')).st_size == 4
+    assert cache.isfile(str(tmp_path / 'f.nc'))
+    assert cache.isdir(str(tmp_path))
+    assert cache.islink(str(tmp_path / 'link'))
+    assert cache.readlink(str(tmp_path / 'link')) == 'f.nc'
+    assert cache.exists(str(tmp_path / 'link'))
+    assert not cache.exists(str(tmp_path / 'missing'))
+    assert not cache.isdir(str(tmp_path / 'f.nc' / 'below'))
+    # (as os.path.exists)
+    assert not cache.exists(str(tmp_path / 'bad\0name'))
+
+
+def test_makedirs_and_rename(tmp_path, cache):
+    deep = str(tmp_path / 'a' / 'b' / 'c')
+    cache.makedirs(deep)
+    assert os.path.isdir(deep)
+    with pytest.raises(FileExistsError):
+        cache.makedirs(deep)
+
+    _touch(os.path.join(deep, 'f.nc'))
+    assert cache.exists(os.path.join(deep, 'f.nc'))
+    # the descriptors for a/b and below are forgotten, so the old paths are not found
+    cache.rename(str(tmp_path / 'a' / 'b'), str(tmp_path / 'a' / 'x'))
+    assert not cache.exists(os.path.join(deep, 'f.nc'))
+    assert cache.exists(str(tmp_path / 'a' / 'x' / 'c' / 'f.nc'))
+
+
+def test_renaming_files_keeps_descriptors(tmp_path, cache, monkeypatch):
+    cache.makedirs(str(tmp_path / 'a' / 'b'))
+    _touch(str(tmp_path / 'a' / 'f.nc'))
+    assert cache.isdir(str(tmp_path / 'a' / 'b'))
+    forgotten = []
+    real_forget = cache._forget
+    monkeypatch.setattr(cache, '_forget', lambda path: forgotten.append(path) or real_forget(path))
+    open_fds = dict(cache._fds)
+
+    cache.rename(str(tmp_path / 'a' / 'f.nc'), str(tmp_path / 'a' / 'g.nc'))
+    cache.rename(str(tmp_path / 'a' / 'g.nc'), str(tmp_path / 'a' / 'b' / 'g.nc'), is_dir=False)
+    assert forgotten == []
+    assert all(cache._fds.get(path) == fd for path, fd in open_fds.items())
+    assert cache.isfile(str(tmp_path / 'a' / 'b' / 'g.nc'))
+
+    # (a directory, whether or not the caller says so)
+    cache.rename(str(tmp_path / 'a' / 'b'), str(tmp_path / 'a' / 'c'), is_dir=True)
+    cache.rename(str(tmp_path / 'a' / 'c'), str(tmp_path / 'a' / 'd'))
+    assert len(forgotten) == 4
+    assert str(tmp_path / 'a' / 'b') not in cache._fds
+    assert cache.isfile(str(tmp_path / 'a' / 'd' / 'g.nc'))
+
+
+def test_link_and_remove(tmp_path, cache):
+    _touch(str(tmp_path / 'f.nc'))
+    os.mkdir(str(tmp_path / 'd'))
+    cache.link(str(tmp_path / 'f.nc'), str(tmp_path / 'd' / 'f.nc'))
+    assert os.path.samefile(str(tmp_path / 'f.nc'), str(tmp_path / 'd' / 'f.nc'))
+    cache.remove(str(tmp_path / 'f.nc'))
+    assert not os.path.exists(str(tmp_path / 'f.nc'))
+
+
+def test_directory_removed_and_created_again(tmp_path, cache):
+    dir_path = str(tmp_path / 'landing' / 'sub')
+    os.makedirs(dir_path)
+    _touch(os.path.join(dir_path, 'old.nc'))
+    assert cache.exists(os.path.join(dir_path, 'old.nc'))
+
+    # by other means, while the descriptors are open
+    shutil.rmtree(str(tmp_path / 'landing'))
+    os.makedirs(dir_path)
+    _touch(os.path.join(dir_path, 'new.nc'))
+
+    assert cache.isfile(os.path.join(dir_path, 'new.nc'))
+    assert not cache.exists(os.path.join(dir_path, 'old.nc'))
+    cache.rename(os.path.join(dir_path, 'new.nc'), os.path.join(dir_path, 'moved.nc'))
+    assert os.path.exists(os.path.join(dir_path, 'moved.nc'))
+
+
+def test_open_limit(tmp_path):
+    with DirFDCache(max_open=3) as cache:
+        for i in range(10):
+            os.mkdir(str(tmp_path / str(i)))
+            _touch(str(tmp_path / str(i) / 'f.nc'))
+            assert cache.exists(str(tmp_path / str(i) / 'f.nc'))
+            assert len(cache._fds) <= 3
+        assert all(cache.exists(str(tmp_path / str(i) / 'f.nc')) for i in range(10))
+
+
+def test_disabled(tmp_path):
+    with DirFDCache() as cache:
+        cache.enabled = False
+        cache.makedirs(str(tmp_path / 'a' / 'b'))
+        _touch(str(tmp_path / 'a' / 'b' / 'f.nc'))
+        cache.rename(str(tmp_path / 'a' / 'b' / 'f.nc'), str(tmp_path / 'a' / 'g.nc'))
+        assert cache.isfile(str(tmp_path / 'a' / 'g.nc'))
+        assert not cache._fds
@@ -0,0 +1,71 @@
+import os
+import argparse
+
+import pytest
+
+from ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6 import RestructureForCMIP6
+from ceda_mip_tools.restructure_for_cmip6.target_index import TargetIndex
+from ceda_mip_tools.fs_utils.manifest import get_filesystem
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+def _get_dir_moves(input_paths, paths_to_dirs):
+    restructurer = RestructureForCMIP6()
+    restructurer._args = argparse.Namespace(paths=input_paths)
+    restructurer._fs = get_filesystem()
+    restructurer._target_index = TargetIndex(set(paths_to_dirs.values()))
+    return restructurer._get_dir_moves(paths_to_dirs)
+
+
+@pytest.fixture
+def landing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ('a_1.nc', 'a_2.nc'):
+        _touch(os.path.join('landing', 'sub', name))
+    return tmp_path
+
+
+def test_whole_directory(landing):
+    moves = {'landing/sub/a_1.nc': 'out/ds/v1', 'landing/sub/a_2.nc': 'out/ds/v1'}
+    assert _get_dir_moves(['landing'], moves) == {'out/ds/v1': 'landing/sub'}
+
+
+def test_not_an_input_path(landing):
+    moves = {'landing/sub/a_1.nc': 'out/ds/v1', 'landing/sub/a_2.nc': 'out/ds/v1'}
+    assert _get_dir_moves(['landing/sub'], moves) == {}
+    # (nor above one)
+    assert _get_dir_moves(['landing/sub/a_1.nc', 'landing/sub/a_2.nc'], moves) == {}
+
+
+def test_not_the_current_directory(landing, monkeypatch):
+    monkeypatch.chdir(os.path.join(str(landing), 'landing', 'sub'))
+    moves = {'a_1.nc': '../../out/ds/v1', 'a_2.nc': '../../out/ds/v1'}
+    assert _get_dir_moves(['.'], moves) == {}
+
+
+def test_other_files_in_directory(landing):
+    _touch('landing/sub/README')
+    moves = {'landing/sub/a_1.nc': 'out/ds/v1', 'landing/sub/a_2.nc': 'out/ds/v1'}
+    assert _get_dir_moves(['landing'], moves) == {}
+
+
+def test_files_going_to_different_datasets(landing):
+    moves = {'landing/sub/a_1.nc': 'out/ds/v1', 'landing/sub/a_2.nc': 'out/ds2/v1'}
+    assert _get_dir_moves(['landing'], moves) == {}
+
+
+def test_files_from_other_directories(landing):
+    _touch('landing/other/a_3.nc')
+    moves = {'landing/sub/a_1.nc': 'out/ds/v1', 'landing/sub/a_2.nc': 'out/ds/v1',
+             'landing/other/a_3.nc': 'out/ds/v1'}
+    assert _get_dir_moves(['landing'], moves) == {}
+
+
+def test_version_directory_exists(landing):
+    os.makedirs('out/ds/v1')
+    moves = {'landing/sub/a_1.nc': 'out/ds/v1', 'landing/sub/a_2.nc': 'out/ds/v1'}
+    assert _get_dir_moves(['landing'], moves) == {}
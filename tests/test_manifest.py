@@ -0,0 +1,78 @@
+import os
+import stat
+
+import pytest
+
+from ceda_mip_tools.fs_utils.manifest import ScanManifest, ManifestFilesystem, get_filesystem
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('data', 'sub'))
+    with open(os.path.join('data', 'sub', 'a.nc'), 'w') as f:
+        f.write('abc')
+    os.symlink('a.nc', os.path.join('data', 'sub', 'link.nc'))
+    os.symlink('missing.nc', os.path.join('data', 'dangling.nc'))
+    return tmp_path
+
+
+def _scan(path, tops, **kwargs):
+    manifest = ScanManifest(path, readonly=False)
+    count = manifest.scan(tops, **kwargs)
+    manifest.close()
+    return count
+
+
+def test_scan_and_read_back(tree):
+    assert _scan('scan.sqlite', ['data'], get_attributes=lambda path: {'tracking_id': 'x'}) == 5
+    manifest = ScanManifest('scan.sqlite')
+    path = os.path.join('data', 'sub', 'a.nc')
+    assert manifest.get_stat(path).st_size == 3
+    assert manifest.get_kind(os.path.join('data', 'sub', 'link.nc')) == ScanManifest.LINK
+    assert manifest.get_link_target(os.path.join('data', 'sub', 'link.nc')) == 'a.nc'
+    assert manifest.get_stat(os.path.join('data', 'dangling.nc')) == None
+    assert manifest.get_attributes(path) == {'tracking_id': 'x'}
+    assert manifest.listdir('data') == ['dangling.nc', 'sub']
+    walked = [(os.path.relpath(root), dirs, files) for root, dirs, files in manifest.walk('data')]
+    assert walked == [('data', ['sub'], ['dangling.nc']), (os.path.join('data', 'sub'), [], ['a.nc', 'link.nc'])]
+
+
+def test_answers_are_from_the_snapshot(tree):
+    _scan('scan.sqlite', ['data'])
+    path = os.path.join('data', 'sub', 'a.nc')
+    with open(path, 'a') as f:
+        f.write('more')
+    os.chmod(path, 0o600)
+    fs = get_filesystem('scan.sqlite')
+    assert isinstance(fs, ManifestFilesystem)
+    assert fs.stat(path).st_size == 3
+    assert stat.S_IMODE(fs.stat(path).st_mode) != 0o600
+
+    # rescanning (as mip-scan --append) brings it up to date
+    _scan('scan.sqlite', [os.path.join('data', 'sub')])
+    assert get_filesystem('scan.sqlite').stat(path).st_size == 7
+
+
+def test_falls_back_to_the_filesystem(tree):
+    _scan('scan.sqlite', [os.path.join('data', 'sub')])
+    os.mkdir('other')
+    open(os.path.join('other', 'b.nc'), 'w').close()
+    fs = get_filesystem('scan.sqlite')
+    assert fs.isfile(os.path.join('other', 'b.nc'))
+    assert fs.isdir('other')
+    assert fs.listdir('other') == ['b.nc']
+    assert [files for root, dirs, files in fs.walk('other')] == [['b.nc']]
+
+
+def test_path_needing_escapes(tree):
+    name = 'scan?#%41.sqlite'
+    _scan(name, ['data'])
+    assert ScanManifest(name).get_kind('data') == ScanManifest.DIR
+    # (and not some other file whose name is a prefix of it)
+    assert sorted(os.listdir('.')) == ['data', name]
+
+
+def test_readonly_manifest_must_exist(tree):
+    with pytest.raises(IOError):
+        ScanManifest('missing.sqlite')
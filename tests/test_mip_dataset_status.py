@@ -0,0 +1,205 @@
+import json
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import config, client
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+from ceda_mip_tools.pub_sys_intfc.mip_dataset_status import _ResultsWriter, _SummaryWriter
+from ceda_mip_tools.pub_sys_intfc.dataset_drs import DatasetDRS
+from ceda_mip_tools.pub_sys_intfc.errors import ServiceError
+
+
+_ids = ['CMIP6.CMIP.MOHC.X.historical.r{}i1p1f1.Amon.tas.gn.v20200101'.format(i)
+        for i in range(1, 6)]
+
+
+def _client(statuses, monkeypatch, page_size=2, jobs=1):
+    "a client whose queries are answered from a dictionary of {dataset_id: status}"
+    monkeypatch.setattr(config, 'max_query_datasets', page_size)
+    pub_client = PublicationClient('CMIP6', requester='tester', jobs=jobs)
+    pub_client.queries = []
+
+    def query(query_params):
+        dataset_ids = query_params['dataset_id'].split(',')
+        pub_client.queries.append(dataset_ids)
+        datasets = [{'dataset_id': dataset_id, 'status': statuses[dataset_id]}
+                    for dataset_id in dataset_ids if dataset_id in statuses]
+        return {'datasets': datasets, 'num_found': len(datasets)}
+    pub_client._query = query
+    return pub_client
+
+
+def test_status_pages(monkeypatch):
+    for jobs in (1, 3):
+        pub_client = _client({_ids[0]: 'completed', _ids[3]: 'failed'}, monkeypatch, jobs=jobs)
+        pages = list(pub_client.status_pages(_ids))
+        assert pages == [[(_ids[0], 'completed'), (_ids[1], 'UNKNOWN')],
+                         [(_ids[2], 'UNKNOWN'), (_ids[3], 'failed')],
+                         [(_ids[4], 'UNKNOWN')]]
+
+
+def _pages():
+    yield [(_ids[0], 'completed'), (_ids[1], 'failed')]
+    yield [(_ids[2], 'in_progress')]
+
+
+def test_json_written_a_page_at_a_time(tmp_path):
+    path = str(tmp_path / 'out.json')
+    _ResultsWriter(_pages()).write_json(path)
+    with open(path) as f:
+        assert json.load(f) == {
+            'datasets': [{'count': 1, 'dataset_id': _ids[0], 'status': 'completed'},
+                         {'count': 2, 'dataset_id': _ids[1], 'status': 'failed'},
+                         {'count': 3, 'dataset_id': _ids[2], 'status': 'in_progress'}],
+            'num_found': 3}
+
+
+def test_ndjson_and_csv(tmp_path):
+    path = str(tmp_path / 'out.ndjson')
+    _ResultsWriter(_pages()).write_ndjson(path)
+    with open(path) as f:
+        assert [json.loads(line)['count'] for line in f] == [1, 2, 3]
+    path = str(tmp_path / 'out.csv')
+    _ResultsWriter(_pages()).write_csv(path)
+    with open(path) as f:
+        assert f.read().splitlines()[1:] == ['1,{},completed'.format(_ids[0]),
+                                             '2,{},failed'.format(_ids[1]),
+                                             '3,{},in_progress'.format(_ids[2])]
+
+
+def test_fixed_width_streams():
+    lines = []
+
+    def pages():
+        yield [(_ids[0], 'completed')]
+        # (the first page is written before the second is asked for)
+        assert _ids[0] in lines[-1]
+        yield [(_ids[1], 'failed')]
+    _ResultsWriter(pages()).dump_fixed_width(80, writer=lines.append)
+    assert lines[-1] == '2 MIP datasets'
+
+
+def test_not_overwriting(tmp_path):
+    path = tmp_path / 'out.csv'
+    path.write_text('old')
+    with pytest.raises(Exception):
+        _ResultsWriter(_pages()).write_csv(str(path))
+    assert path.read_text() == 'old'
+
+
+def test_incomplete_output_is_removed(tmp_path):
+    def pages():
+        yield [(_ids[0], 'completed')]
+        raise ValueError("bad spec")
+    path = tmp_path / 'out.json'
+    with pytest.raises(ValueError):
+        _ResultsWriter(pages()).write_json(str(path))
+    assert not path.exists()
+
+
+def _watching(polls, monkeypatch):
+    """
+    a client whose successive polls give the statuses in polls (a list of
+    dictionaries, or exceptions to raise), and the list of sleeps it makes
+    """
+    pub_client = PublicationClient('CMIP6', requester='tester')
+    pub_client.polled = []
+    sleeps = []
+    monkeypatch.setattr(client.time, 'sleep', sleeps.append)
+
+    def query_pages(dataset_ids):
+        pub_client.polled.append(list(dataset_ids))
+        statuses = polls.pop(0)
+        if isinstance(statuses, Exception):
+            raise statuses
+        yield [(dataset_id, statuses.get(dataset_id, 'UNKNOWN')) for dataset_id in dataset_ids]
+    pub_client._query_status_pages = query_pages
+    return pub_client, sleeps
+
+
+def test_watch_until_completed(monkeypatch):
+    pub_client, sleeps = _watching([{_ids[0]: 'in_progress', _ids[1]: 'completed'},
+                                 {_ids[0]: 'in_progress'},
+                                 {_ids[0]: 'completed'}], monkeypatch)
+    lines = []
+    exit_status = pub_client.watch(_ids[:2], 10., 100., writer=lines.append)
+    assert exit_status == client.watch_exit_completed
+    # (finished datasets are not polled again)
+    assert pub_client.polled == [_ids[:2], _ids[:1], _ids[:1]]
+    # (backing off while nothing changes)
+    assert sleeps == [10., 15.]
+    assert lines[0] == 'Watching 2 MIP datasets (1 completed, 1 in_progress)'
+    assert lines[1].endswith('{}: in_progress -> completed'.format(_ids[0]))
+    assert lines[-1] == 'Finished: all 2 MIP datasets completed'
+
+
+def test_watch_unknown_and_failed(monkeypatch):
+    pub_client, sleeps = _watching([{_ids[0]: 'in_progress'},
+                                 {_ids[0]: 'failed'}], monkeypatch)
+    lines = []
+    exit_status = pub_client.watch(_ids[:2], 10., 100., writer=lines.append)
+    assert exit_status == client.watch_exit_failed
+    assert lines[0] == '{}: not known to the publication system'.format(_ids[1])
+    assert pub_client.polled == [_ids[:2], _ids[:1]]
+    assert lines[-1] == 'Finished: 1 of 2 MIP datasets failed, 1 unknown'
+
+
+def test_watch_retries_failed_polls(monkeypatch):
+    pub_client, sleeps = _watching([{_ids[0]: 'in_progress'},
+                                 ServiceError("unreachable"),
+                                 {_ids[0]: 'completed'}], monkeypatch)
+    lines = []
+    exit_status = pub_client.watch(_ids[:1], 10., 100., writer=lines.append)
+    assert exit_status == client.watch_exit_completed
+    assert 'WARNING: poll failed (unreachable); will retry in 10 seconds' in lines
+
+
+def test_watch_timeout(monkeypatch):
+    pub_client, sleeps = _watching([{_ids[0]: 'in_progress'}] * 10, monkeypatch)
+    clock = [0.]
+    monkeypatch.setattr(client.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(client.time, 'sleep', lambda secs: clock.__setitem__(0, clock[0] + secs))
+    lines = []
+    exit_status = pub_client.watch(_ids[:1], 10., 10., timeout=35., writer=lines.append)
+    assert exit_status == client.watch_exit_timeout
+    assert lines[-1] == 'Timed out with 1 MIP datasets unfinished'
+    assert clock[0] == 30.
+
+
+def _summary_pages():
+    yield [('CMIP6.CMIP.MOHC.X.historical.r1i1p1f1.Amon.tas.gn.v1', 'completed'),
+           ('CMIP6.CMIP.MOHC.Y.historical.r1i1p1f1.Amon.tas.gn.v1', 'failed')]
+    yield [('CMIP6.CMIP.NCAR.Z.piControl.r1i1p1f1.Amon.tas.gn.v1', 'completed'),
+           ('not.a.dataset.id', 'UNKNOWN')]
+
+
+def test_summary_json(tmp_path):
+    drs = DatasetDRS(config.projects['CMIP6']['drs'])
+    positions = [drs.get_facet_position(name) for name in ('institution', 'experiment_id')]
+    path = str(tmp_path / 'summary.json')
+    _SummaryWriter(_summary_pages(), drs, positions).write_json(path)
+    with open(path) as f:
+        assert json.load(f) == {
+            'summary_by': ['institution_id', 'experiment_id'],
+            'groups': [
+                {'institution_id': '?', 'experiment_id': '?', 'counts': {'UNKNOWN': 1}, 'total': 1},
+                {'institution_id': 'MOHC', 'experiment_id': 'historical',
+                 'counts': {'completed': 1, 'failed': 1}, 'total': 2},
+                {'institution_id': 'NCAR', 'experiment_id': 'piControl',
+                 'counts': {'completed': 1}, 'total': 1}],
+            'num_found': 4}
+
+
+def test_overall_summary_table():
+    drs = DatasetDRS(config.projects['CMIP6']['drs'])
+    lines = []
+    _SummaryWriter(_summary_pages(), drs, []).dump(writer=lines.append)
+    assert lines[0].split() == ['not_started', 'in_progress', 'completed', 'failed', 'UNKNOWN',
+                                'total']
+    assert lines[2].split() == ['0', '0', '2', '1', '1', '4']
+
+
+def test_unknown_summary_facet():
+    drs = DatasetDRS(config.projects['CMIP6']['drs'])
+    with pytest.raises(ValueError):
+        drs.get_facet_position('model')
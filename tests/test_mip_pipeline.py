@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from ceda_mip_tools.pipeline import mip_pipeline
+from ceda_mip_tools.pipeline.mip_pipeline import MIPPipeline
+from ceda_mip_tools.pub_sys_intfc.errors import SubmissionError
+
+
+class _FakeClient(object):
+    "answers status queries from a list of {dataset_id: status} for successive polls"
+
+    def __init__(self, polls=(), add_errors=None):
+        self._polls = list(polls)
+        self._add_errors = add_errors or {}
+        self.added = []
+
+    def add(self, path, replica=False, file_stats=None):
+        if path in self._add_errors:
+            raise self._add_errors[path]
+        self.added.append(path)
+        return path.replace('/', '.')
+
+    def status_many(self, dataset_ids):
+        statuses = self._polls.pop(0) if len(self._polls) > 1 else self._polls[0]
+        return [(dataset_id, statuses.get(dataset_id, 'UNKNOWN')) for dataset_id in dataset_ids]
+
+
+def _pipeline(client):
+    pipeline = MIPPipeline()
+    pipeline._client = client
+    return pipeline
+
+
+def _drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get())
+    return items
+
+
+def test_submission_errors(capsys):
+    pipeline = _pipeline(_FakeClient(add_errors={'a/2': SubmissionError("rejected")}))
+    for dataset_dir in ('a/1', 'a/2', 'a/3'):
+        pipeline._queue.put((dataset_dir, {}))
+    pipeline._queue.put(None)
+    pipeline._submit_worker(False, True)
+    assert pipeline._num_errors == 1
+    assert _drain(pipeline._track_queue) == ['a.1', 'a.3', None]
+    assert 'ERROR: adding directory a/2: rejected' in capsys.readouterr().out
+
+
+def test_unexpected_submission_error_still_ends_tracking():
+    pipeline = _pipeline(_FakeClient(add_errors={'a/2': RuntimeError("bug")}))
+    for dataset_dir in ('a/1', 'a/2', 'a/3'):
+        pipeline._queue.put((dataset_dir, {}))
+    with pytest.raises(RuntimeError):
+        pipeline._submit_worker(False, True)
+    assert pipeline._submit_failed
+    assert _drain(pipeline._track_queue) == ['a.1', None]
+
+
+def _track(pipeline, dataset_ids, **kwargs):
+    for dataset_id in dataset_ids:
+        pipeline._track_queue.put(dataset_id)
+    pipeline._track_queue.put(None)
+    pipeline._track_worker(0.001, 0.001, **kwargs)
+    return pipeline._track_status
+
+
+def test_tracking_waits_for_new_datasets_to_be_registered():
+    client = _FakeClient([{}, {'x': 'in_progress'}, {'x': 'completed', 'y': 'completed'}])
+    status = _track(_pipeline(client), ['x', 'y'], unknown_grace=60.)
+    assert status == mip_pipeline._track_exit_completed
+
+
+def test_tracking_unknown_after_grace_period(capsys):
+    client = _FakeClient([{'x': 'completed'}])
+    status = _track(_pipeline(client), ['x', 'y'], unknown_grace=0.)
+    assert status == mip_pipeline._track_exit_failed
+    assert 'Finished: 1 of 2 MIP datasets failed' in capsys.readouterr().out
+
+
+def test_tracking_timeout():
+    client = _FakeClient([{'x': 'in_progress'}])
+    status = _track(_pipeline(client), ['x'], timeout=0.01)
+    assert status == mip_pipeline._track_exit_timeout
+
+
+def test_tracking_can_be_stopped():
+    pipeline = _pipeline(_FakeClient([{'x': 'in_progress'}]))
+    pipeline._track_queue.put('x')
+    worker = threading.Thread(target=pipeline._track_worker, args=(0.01, 0.01))
+    worker.start()
+    pipeline._stop_tracking.set()
+    worker.join(5.)
+    assert not worker.is_alive()
+    assert pipeline._track_status == mip_pipeline._track_exit_failed
@@ -0,0 +1,93 @@
+import struct
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import netcdf_integrity
+
+
+_undefined = b'\xff' * 8
+
+
+def _superblock(version, eof, base=0, user_block=0):
+    "a minimal HDF5 superblock (with 8-byte offsets) as written by the given library version"
+    sig = netcdf_integrity._hdf5_signature
+    if version == 0:
+        # free-space, root group and shared header versions, reserved,
+        # sizes of offsets and lengths, reserved, B-tree Ks, flags
+        head = bytes([0, 0, 0, 0, 8, 8, 0]) + struct.pack('<HHI', 4, 16, 0)
+    elif version == 1:
+        head = bytes([0, 0, 0, 0, 8, 8, 0]) + struct.pack('<HHIHH', 4, 16, 0, 32, 0)
+    else:
+        head = bytes([8, 8, 0])
+    addresses = struct.pack('<Q', base) + _undefined + struct.pack('<Q', eof) + _undefined
+    return b'\0' * user_block + sig + bytes([version]) + head + addresses
+
+
+def _write(tmp_path, data, size):
+    path = tmp_path / 'test.nc'
+    path.write_bytes(data + b'\0' * (size - len(data)))
+    return str(path)
+
+
+@pytest.mark.parametrize('version', [0, 1, 2, 3])
+def test_hdf5_complete(tmp_path, version):
+    path = _write(tmp_path, _superblock(version, 4096), 4096)
+    assert netcdf_integrity.check_file(path) == None
+
+
+@pytest.mark.parametrize('version', [0, 1, 2, 3])
+def test_hdf5_truncated(tmp_path, version):
+    path = _write(tmp_path, _superblock(version, 4096), 4095)
+    problem = netcdf_integrity.check_file(path)
+    assert problem.startswith('truncated')
+    assert 'end of file at 4096 bytes' in problem
+
+
+@pytest.mark.parametrize('version', [0, 2])
+def test_hdf5_after_user_block(tmp_path, version):
+    # addresses are relative to the base address (the start of the superblock)
+    data = _superblock(version, 4096, base=512, user_block=512)
+    assert netcdf_integrity.check_file(_write(tmp_path, data, 4608)) == None
+    assert netcdf_integrity.check_file(_write(tmp_path, data, 4607)).startswith('truncated')
+
+
+def test_hdf5_ends_within_superblock(tmp_path):
+    data = _superblock(0, 4096)[:30]
+    path = _write(tmp_path, data, len(data))
+    assert 'within the HDF5 superblock' in netcdf_integrity.check_file(path)
+
+
+def _classic(numrecs, dims, variables):
+    "a classic format header: dims is [(name, length)], variables is [(name, dimids, nc_type, begin)]"
+    def name(s):
+        return struct.pack('>I', len(s)) + s.encode() + b'\0' * (-len(s) % 4)
+    data = b'CDF\x01' + struct.pack('>I', numrecs)
+    data += struct.pack('>II', 10, len(dims))
+    for dim_name, length in dims:
+        data += name(dim_name) + struct.pack('>I', length)
+    data += struct.pack('>II', 0, 0)
+    data += struct.pack('>II', 11, len(variables))
+    for var_name, dimids, nc_type, begin in variables:
+        data += name(var_name) + struct.pack('>I', len(dimids))
+        data += b''.join(struct.pack('>I', dimid) for dimid in dimids)
+        data += struct.pack('>II', 0, 0) + struct.pack('>III', nc_type, 0, begin)
+    return data
+
+
+def test_classic_fixed_size(tmp_path):
+    # float x(100) starting at byte 200: needs 600 bytes
+    header = _classic(0, [('x', 100)], [('v', [0], 5, 200)])
+    assert netcdf_integrity.check_file(_write(tmp_path, header, 600)) == None
+    assert netcdf_integrity.check_file(_write(tmp_path, header, 599)).startswith('truncated')
+
+
+def test_classic_records(tmp_path):
+    # 3 records of double t(time) starting at byte 200: needs 224 bytes
+    header = _classic(3, [('time', 0)], [('t', [0], 6, 200)])
+    assert netcdf_integrity.check_file(_write(tmp_path, header, 224)) == None
+    assert netcdf_integrity.check_file(_write(tmp_path, header, 223)).startswith('truncated')
+
+
+def test_not_netcdf(tmp_path):
+    path = _write(tmp_path, b'hello', 1000)
+    assert netcdf_integrity.check_file(path).startswith('not a netCDF file')
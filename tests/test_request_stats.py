@@ -0,0 +1,99 @@
+import json
+import datetime
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import util, config, request_stats
+from ceda_mip_tools.pub_sys_intfc.errors import ServiceError, ThrottledError
+
+
+_url = 'https://example.org/api/dataset/'
+
+
+def test_percentile():
+    vals = list(range(1, 101))
+    assert [request_stats._percentile(vals, pct) for pct in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert request_stats._percentile([3.], 99) == 3.
+    assert request_stats._percentile([], 50) == None
+
+
+def test_summary_and_trace(tmp_path):
+    trace_path = tmp_path / 'trace.ndjson'
+    stats = request_stats.RequestStats(trace_path=str(trace_path))
+    for i in range(1, 5):
+        stats.record(_url, 0., i / 10., wait=i / 20., status_code=200,
+                     bytes_sent=10, bytes_received=100)
+    stats.record(_url + '?x=1', 0., 1., error='timed out')
+    stats.record_retry(_url)
+    stats.close()
+    assert stats.get_summary() == [
+        '/api/dataset/: 5 requests, 1 retries, 1 errors, 40 bytes sent, 400 bytes received',
+        '  HTTP status: 200 x 4',
+        '  total seconds: p50 0.300, p95 1.000, p99 1.000, max 1.000',
+        '  wait  seconds: p50 0.100, p95 0.200, p99 0.200, max 0.200']
+    records = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert len(records) == 5
+    assert records[-1]['error'] == 'timed out' and records[-1]['status_code'] == None
+
+
+def test_no_requests():
+    assert request_stats.RequestStats().get_summary() == ['no requests made']
+
+
+class _Response(object):
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.elapsed = datetime.timedelta(seconds=0.25)
+        self.request = type('Request', (), {'body': 'a=1&b=2'})()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _Session(object):
+
+    def __init__(self, *responses):
+        self._responses = list(responses)
+
+    def post(self, url, data=None, timeout=None):
+        return self._responses.pop(0)
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = request_stats.RequestStats()
+    monkeypatch.setattr(util, '_request_stats', stats)
+    monkeypatch.setattr(util.time, 'sleep', lambda secs: None)
+    return stats
+
+
+def test_requests_are_recorded(stats):
+    session = _Session(_Response(200, b'{"datasets": [], "num_found": 0}'),
+                       _Response(200, b'not json'),
+                       _Response(500, b''))
+    post = lambda: util.do_post_expecting_json(_url, {}, compulsory_fields=('datasets',),
+                                               session=session)
+    assert post()['num_found'] == 0
+    for i in range(2):
+        with pytest.raises(ServiceError):
+            post()
+    endpoint = stats._endpoints['/api/dataset/']
+    assert endpoint.num_requests == 3
+    assert endpoint.num_errors == 1
+    assert endpoint.status_codes == {200: 2, 500: 1}
+    assert endpoint.bytes_sent == 21
+    assert endpoint.bytes_received == 40
+    assert endpoint.waits == [0.25] * 3
+
+
+def test_throttling_retries_are_counted(stats):
+    session = _Session(_Response(429, b'', headers={'Retry-After': '2'}),
+                       _Response(200, b'{"datasets": [], "num_found": 0}'))
+    post = lambda page: util.do_post_expecting_json(_url, page, session=session)
+    assert list(util.map_pages(post, [{}])) == [{'datasets': [], 'num_found': 0}]
+    endpoint = stats._endpoints['/api/dataset/']
+    assert (endpoint.num_requests, endpoint.num_retries) == (2, 1)
+    assert endpoint.status_codes == {429: 1, 200: 1}
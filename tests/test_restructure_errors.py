@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import argparse
+
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+from ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6 import (RestructureForCMIP6,
+                                                                        _quarantine_report_name)
+
+
+_good_name = 'tas_Amon_X_historical_r1i1p1f1_gn.nc'
+_dataset_dir = os.path.join('out', 'CMIP6', 'CMIP', 'MOHC', 'X', 'historical', 'r1i1p1f1',
+                            'Amon', 'tas', 'gn', 'v20200101')
+
+
+def _write_file(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.mip_era = 'CMIP6'
+        ds.activity_id = 'CMIP'
+        ds.institution_id = 'MOHC'
+    # (as if written long enough ago to have settled)
+    os.utime(path, (0, 0))
+    return path
+
+
+def _read_ndjson(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_errors_quarantined_and_listed(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    _write_file(os.path.join('landing', _good_name))
+    _write_file(os.path.join('landing', 'junk.nc'))
+    # (the same name as the error file, but not it)
+    os.makedirs(os.path.join('landing', 'sub'))
+    with open(os.path.join('landing', 'sub', 'errors.ndjson'), 'w') as f:
+        f.write('{}\n')
+    os.mkdir('out')
+    monkeypatch.setattr(sys, 'argv', ['restructure_for_cmip6', '-d', 'out', '-v', '20200101',
+                                      '--quarantine', os.path.join('landing', 'quarantine'),
+                                      '--error-file', os.path.join('landing', 'errors.ndjson'),
+                                      'landing'])
+
+    with pytest.raises(SystemExit) as exc_info:
+        RestructureForCMIP6().run()
+    assert exc_info.value.code == 1
+    assert '2 files could not be restructured' in capsys.readouterr().out
+    assert os.path.isfile(os.path.join(_dataset_dir, _good_name))
+
+    errors = _read_ndjson(os.path.join('landing', 'errors.ndjson'))
+    assert sorted(error['path'] for error in errors) == [os.path.join('landing', 'junk.nc'),
+                                                         os.path.join('landing', 'sub',
+                                                                      'errors.ndjson')]
+    assert all(error['reason'] and error['quarantined_as'] for error in errors)
+    assert sorted(os.listdir(os.path.join('landing', 'quarantine'))) == \
+        sorted(['errors.ndjson', 'junk.nc', _quarantine_report_name])
+    report = _read_ndjson(os.path.join('landing', 'quarantine', _quarantine_report_name))
+    assert sorted(entry['file'] for entry in report) == ['errors.ndjson', 'junk.nc']
+
+
+def test_errors_left_in_place(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    _write_file(os.path.join('landing', _good_name))
+    junk = _write_file(os.path.join('landing', 'junk.nc'))
+    os.mkdir('out')
+    monkeypatch.setattr(sys, 'argv', ['restructure_for_cmip6', '-d', 'out', '-v', '20200101',
+                                      '--keep-going', 'landing'])
+
+    with pytest.raises(SystemExit) as exc_info:
+        RestructureForCMIP6().run()
+    assert exc_info.value.code == 1
+    assert 'error: {}: '.format(junk) in capsys.readouterr().out
+    assert os.path.isfile(junk)
+    assert os.path.isfile(os.path.join(_dataset_dir, _good_name))
+
+
+@pytest.fixture
+def restructurer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('landing')
+    restructurer = RestructureForCMIP6()
+    restructurer._args = argparse.Namespace(
+        paths=['landing'], directory=os.path.join('landing', 'out'), version=20200101,
+        merge=True, manifest=None, link_unchanged=False, link_checksum=False, keep_going=True,
+        quarantine=os.path.join('landing', 'quarantine'), error_file=None, watch=True)
+    restructurer._allow_dir_moves = False
+    restructurer._open_error_file()
+    yield restructurer
+    restructurer._dir_fds.close()
+
+
+def test_watch_quarantines_failures(restructurer):
+    good = _write_file(os.path.join('landing', _good_name))
+    junk = _write_file(os.path.join('landing', 'junk.nc'))
+    written = set()
+    restructurer._restructure_batch([good, junk], None, written)
+    assert len(written) == 1
+    assert os.path.isfile(os.path.join('landing', 'quarantine', 'junk.nc'))
+
+    # the output and quarantine directories are not rescanned, but others
+    # with the same names are
+    other = _write_file(os.path.join('landing', 'sub', 'quarantine', 'junk.nc'))
+    assert list(restructurer._rescan_landing_area()) == [other]
+
+
+def test_watch_failures_not_retried_until_changed(restructurer):
+    restructurer._args.quarantine = None
+    junk = _write_file(os.path.join('landing', 'junk.nc'))
+    restructurer._restructure_batch([junk], None, set())
+    assert os.path.isfile(junk)
+    assert list(restructurer._rescan_landing_area()) == []
+
+    os.utime(junk, (1, 1))
+    assert list(restructurer._rescan_landing_area()) == [junk]
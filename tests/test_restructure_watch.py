@@ -0,0 +1,76 @@
+import os
+import argparse
+
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+from ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6 import RestructureForCMIP6
+
+
+def _write_file(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.mip_era = 'CMIP6'
+        ds.activity_id = 'CMIP'
+        ds.institution_id = 'MOHC'
+    # (as if written long enough ago to have settled)
+    os.utime(path, (0, 0))
+    return path
+
+
+def _file_name(source_id):
+    return 'tas_Amon_{}_historical_r1i1p1f1_gn.nc'.format(source_id)
+
+
+@pytest.fixture
+def restructurer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('landing')
+    os.mkdir('out')
+    restructurer = RestructureForCMIP6()
+    restructurer._args = argparse.Namespace(
+        paths=['landing'], directory='out', version=20200101, merge=True, manifest=None,
+        link_unchanged=False, link_checksum=False, keep_going=False, quarantine=None,
+        error_file=None, watch=True)
+    restructurer._allow_dir_moves = False
+    yield restructurer
+    restructurer._dir_fds.close()
+
+
+def test_batches_keep_the_input_paths(restructurer, tmp_path):
+    written = set()
+    path = _write_file(os.path.join('landing', 'sub', _file_name('X')))
+    restructurer._restructure_batch([path], None, written)
+    assert restructurer._args.paths == ['landing']
+    assert len(written) == 1
+
+    # a later file is still found by the rescan of the landing area
+    later = _write_file(os.path.join('landing', 'sub', _file_name('Y')))
+    assert list(restructurer._rescan_landing_area()) == [later]
+
+
+def test_batch_failing_part_way(restructurer, tmp_path):
+    paths = [_write_file(os.path.join('landing', _file_name(source_id)))
+             for source_id in ('X', 'Y')]
+    real_rename = restructurer._dir_fds.rename
+    calls = []
+
+    def rename(src, dst, **kwargs):
+        calls.append(src)
+        if len(calls) == 2:
+            raise OSError("simulated failure")
+        real_rename(src, dst, **kwargs)
+    restructurer._dir_fds.rename = rename
+
+    output_path = str(tmp_path / 'output.txt')
+    written = set()
+    with open(output_path, 'w') as output_fh:
+        restructurer._restructure_batch(paths, output_fh, written)
+    with open(output_path) as f:
+        listed = f.read().split()
+
+    # the file moved before the failure, and the one moved on its retry
+    assert len(listed) == 2
+    assert all(os.path.isdir(path) for path in listed)
+    assert not any(os.path.exists(path) for path in paths)
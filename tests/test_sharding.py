@@ -0,0 +1,55 @@
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import sharding
+
+
+_keys = ['CMIP6.CMIP.MOHC.X.historical.r{}i1p1f1.Amon.tas.gn.v20200101'.format(i)
+         for i in range(1000)]
+
+
+def test_parse_shard_spec():
+    assert sharding.parse_shard_spec('3/10') == (3, 10)
+    for spec in ('0/10', '11/10', '3', 'a/b', '1/2/3'):
+        with pytest.raises(ValueError):
+            sharding.parse_shard_spec(spec)
+
+
+def test_shards_partition_the_keys():
+    sharders = [sharding.Sharder(i, 7) for i in range(1, 8)]
+    selected = [list(sharder.select(_keys)) for sharder in sharders]
+    assert sorted(key for keys in selected for key in keys) == sorted(_keys)
+    # (roughly even)
+    assert all(100 < len(keys) < 190 for keys in selected)
+
+
+def test_shard_depends_only_on_key():
+    shards = [sharding.get_shard(key, 7) for key in _keys]
+    assert [sharding.get_shard(key, 7) for key in reversed(_keys)] == shards[::-1]
+    assert all(1 <= shard <= 7 for shard in shards)
+
+
+def test_select_with_key_function():
+    sharder = sharding.Sharder(2, 3)
+    items = [('/data/' + key, key) for key in _keys]
+    assert ([key for path, key in sharder.select(items, key=lambda item: item[1])]
+            == list(sharder.select(_keys)))
+
+
+def test_balanced_shards():
+    weights = dict((key, 1) for key in _keys[:30])
+    weights[_keys[30]] = 100
+    shards = sharding.get_balanced_shards(weights, 4)
+    loads = dict((shard, 0) for shard in range(1, 5))
+    for key, shard in shards.items():
+        loads[shard] += weights[key]
+    # the heavy item has a shard to itself, and the rest are spread evenly
+    assert sorted(loads.values()) == [10, 10, 10, 100]
+    # independent of the order of the input
+    assert sharding.get_balanced_shards(dict(reversed(list(weights.items()))), 4) == shards
+
+
+def test_balanced_sharder_falls_back_to_hash():
+    sharder = sharding.Sharder(1, 2)
+    sharder.balance({'a': 1})
+    assert sharder.get_shard('a') == sharding.get_balanced_shards({'a': 1}, 2)['a']
+    assert sharder.get_shard('b') == sharding.get_shard('b', 2)
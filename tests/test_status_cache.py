@@ -0,0 +1,71 @@
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import config
+from ceda_mip_tools.pub_sys_intfc.status_cache import StatusCache
+from ceda_mip_tools.pub_sys_intfc.client import PublicationClient
+
+
+def _cache(tmp_path, chain='CMIP6-fromdisk'):
+    return StatusCache(str(tmp_path / 'sub' / 'cache.sqlite'), 'esgf-prod', chain)
+
+
+def test_ids_to_query(tmp_path):
+    cache = _cache(tmp_path)
+    cache.update([('a', 'completed'), ('b', 'in_progress'), ('c', 'failed')], now=1000.)
+    cache.update([('d', 'completed')], now=1900.)
+    ids = ['e', 'd', 'c', 'b', 'a']
+    # (unknown, unfinished, and finished but checked longer ago than the ttl)
+    assert cache.get_ids_to_query(ids, ttl=500., now=2000.) == ['e', 'c', 'b', 'a']
+    assert cache.get_ids_to_query(ids, ttl=5000., now=2000.) == ['e', 'b']
+
+
+def test_transitions(tmp_path):
+    cache = _cache(tmp_path)
+    cache.update([('a', 'not_started'), ('b', 'in_progress')], now=1000.)
+    cache.update([('a', 'in_progress'), ('b', 'in_progress')], now=2000.)
+    cache.update([('a', 'completed'), ('b', 'failed')], now=3000.)
+    assert cache.get_many(['a', 'b', 'z']) == {'a': ('completed', 3000.),
+                                               'b': ('failed', 3000.)}
+    assert cache.get_transitions_since(1500.) == [('a', 'not_started', 'in_progress', 2000.),
+                                                  ('a', 'in_progress', 'completed', 3000.),
+                                                  ('b', 'in_progress', 'failed', 3000.)]
+    assert cache.get_transitions_since(2500.) == cache.get_transitions_since(1500.)[1:]
+
+
+def test_persists_per_chain(tmp_path):
+    cache = _cache(tmp_path)
+    cache.update([('a', 'completed')], now=1000.)
+    assert cache.record_run(now=1000.) == None
+    cache.close()
+    cache = _cache(tmp_path)
+    assert cache.record_run(now=2000.) == 1000.
+    assert list(cache.get_dataset_ids()) == ['a']
+    other = _cache(tmp_path, chain='PRIMAVERA-fromdisk')
+    assert list(other.get_dataset_ids()) == []
+    assert other.record_run(now=3000.) == None
+
+
+def test_refresh_only_queries_what_is_needed(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'max_query_datasets', 2)
+    pub_client = PublicationClient('CMIP6', requester='tester')
+    pub_client.cache = _cache(tmp_path)
+    pub_client.cache.update([('a', 'completed'), ('b', 'in_progress')])
+    queried = []
+
+    def query(query_params):
+        dataset_ids = query_params['dataset_id'].split(',')
+        queried.extend(dataset_ids)
+        datasets = [{'dataset_id': dataset_id, 'status': 'failed'} for dataset_id in dataset_ids]
+        return {'datasets': datasets, 'num_found': len(datasets)}
+    pub_client._query = query
+
+    pages = list(pub_client.status_pages(['a', 'b', 'c'], refresh=True, cache_ttl=3600.))
+    assert queried == ['b', 'c']
+    assert pages == [[('a', 'completed'), ('b', 'failed')], [('c', 'failed')]]
+    # (and the new statuses are cached)
+    assert pub_client.cache.get_many(['c'])['c'][0] == 'failed'
+
+
+def test_refresh_needs_cache():
+    with pytest.raises(ValueError):
+        PublicationClient('CMIP6', requester='tester').status_pages(['a'], refresh=True)
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from ceda_mip_tools.restructure_for_cmip6.target_index import TargetIndex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for version in ('v20200101', 'v20210101', 'files'):
+        os.makedirs(os.path.join('out', 'ds1', version))
+    for name in ('a.nc', 'b.nc'):
+        open(os.path.join('out', 'ds1', 'v20210101', name), 'w').close()
+    os.makedirs(os.path.join('out', 'ds2'))
+    # (a file where a version directory should be)
+    open(os.path.join('out', 'ds2', 'v20210101'), 'w').close()
+    version_dirs = [os.path.join('out', ds, 'v20210101') for ds in ('ds1', 'ds2', 'ds3')]
+    return TargetIndex(version_dirs + version_dirs[:1], jobs=2)
+
+
+def test_existing_version_dir(index):
+    version_dir = os.path.join('out', 'ds1', 'v20210101')
+    assert index.dataset_dir_exists(version_dir)
+    assert index.version_dir_exists(version_dir)
+    assert index.path_exists(version_dir)
+    assert index.get_files(version_dir) == {'a.nc', 'b.nc'}
+    assert index.get_other_versions(version_dir) == ['v20200101']
+
+
+def test_file_at_version_dir_path(index):
+    version_dir = os.path.join('out', 'ds2', 'v20210101')
+    assert index.dataset_dir_exists(version_dir)
+    assert not index.version_dir_exists(version_dir)
+    assert index.path_exists(version_dir)
+    assert index.get_files(version_dir) == set()
+    assert index.get_other_versions(version_dir) == []
+
+
+def test_missing_dataset_dir(index):
+    version_dir = os.path.join('out', 'ds3', 'v20210101')
+    assert not index.dataset_dir_exists(version_dir)
+    assert not index.version_dir_exists(version_dir)
+    assert not index.path_exists(version_dir)
+    assert index.get_files(version_dir) == set()
+    assert index.get_other_versions(version_dir) == []
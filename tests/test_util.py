@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+from ceda_mip_tools.pub_sys_intfc import util, config
+from ceda_mip_tools.pub_sys_intfc.errors import ThrottledError, ServiceError
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(util.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(config, 'throttle_initial_delay', 1.)
+    monkeypatch.setattr(config, 'throttle_max_retries', 3)
+    return sleeps
+
+
+def _throttled_then_ok(times, retry_after=None):
+    calls = []
+
+    def func(page):
+        calls.append(page)
+        if calls.count(page) <= times:
+            raise ThrottledError("slow down", retry_after=retry_after)
+        return page * 10
+    return func, calls
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_throttled_calls_are_retried(sleeps, jobs):
+    func, calls = _throttled_then_ok(2)
+    assert list(util.map_pages(func, [1, 2, 3], jobs=jobs)) == [10, 20, 30]
+    assert sorted(calls) == [1, 1, 1, 2, 2, 2, 3, 3, 3]
+    # (backing off exponentially)
+    assert sorted(sleeps) == [1., 1., 1., 2., 2., 2.]
+
+
+def test_retry_after_is_used(sleeps):
+    func, calls = _throttled_then_ok(1, retry_after=7.)
+    assert list(util.map_pages(func, [1])) == [10]
+    assert sleeps == [7.]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    func, calls = _throttled_then_ok(10)
+    with pytest.raises(ThrottledError):
+        list(util.map_pages(func, [1]))
+    assert len(calls) == config.throttle_max_retries + 1
+
+
+def test_other_errors_are_not_retried(sleeps):
+    limiter = util._AdaptiveLimiter(2)
+
+    def func(page):
+        raise ServiceError("down")
+    with pytest.raises(ServiceError):
+        util._call_with_limiter(func, 1, limiter)
+    assert not sleeps
+    assert limiter._active == 0
+
+
+def test_pages_from_generator_in_order():
+    pages = (page for page in range(50))
+    assert list(util.map_pages(lambda page: -page, pages, jobs=8)) == [-p for p in range(50)]
+
+
+def test_adaptive_limiter():
+    limiter = util._AdaptiveLimiter(8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter._limit == 2
+    # (grows back by one after as many successes as the limit)
+    for i in range(2):
+        limiter.acquire()
+        limiter.release()
+    assert limiter._limit == 3
+    for i in range(20):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter._limit == 1
+
+
+def _parser():
+    parser = util.ArgsFromCmdLineOrFileParser('things', 'things', allow_lazy=True)
+    parser.add_standard_arguments()
+    return parser
+
+
+def test_values_from_file(tmp_path):
+    path = tmp_path / 'things.txt'
+    path.write_text('  a \n\nb c\n')
+    assert _parser().parse_args(['-f', str(path)]).things == ['a', 'b c']
+    path.write_bytes(b' a \0\0b\nc\0d\xff')
+    # (used as given, and bytes not valid in the filesystem encoding kept as os.fsdecode does)
+    assert (_parser().parse_args(['-f', str(path), '--null']).things
+            == [' a ', 'b\nc', os.fsdecode(b'd\xff')])
+
+
+def test_null_separated_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(util._ValuesFromFile, '_block_size', 3)
+    values = ['first', 'x', '', 'a longer value', 'y']
+    path = tmp_path / 'things'
+    path.write_bytes(b'\0'.join(value.encode() for value in values))
+    assert list(util._ValuesFromFile(str(path), null_separated=True)) == \
+        [value for value in values if value]
+
+
+def test_lazy_values(tmp_path):
+    path = tmp_path / 'things.txt'
+    path.write_text('a\nb\n')
+    things = _parser().parse_args(['-f', str(path), '--lazy']).things
+    assert isinstance(things, util._ValuesFromFile)
+    assert list(things) == ['a', 'b']
+    # (only once)
+    assert list(things) == []
+
+
+@pytest.mark.parametrize('args', [['--null'], ['--lazy'], ['a', '-f', 'things.txt'],
+                                  ['-f', 'empty.txt'], ['-f', 'empty.txt', '--lazy'],
+                                  ['-f', 'missing.txt', '--lazy']])
+def test_bad_file_arguments(tmp_path, monkeypatch, args):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'things.txt').write_text('a\n')
+    (tmp_path / 'empty.txt').write_text('\n')
+    with pytest.raises(SystemExit):
+        _parser().parse_args(args)
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+from ceda_mip_tools.restructure_for_cmip6.restructure_for_cmip6 import Restructurer
+
+
+_name = 'tas_Amon_X_historical_r1i1p1f1_gn.nc'
+_dataset_dir = os.path.join('out', 'CMIP6', 'CMIP', 'MOHC', 'X', 'historical', 'r1i1p1f1',
+                            'Amon', 'tas', 'gn')
+
+
+def _write_file(path, tracking_id, value=1.):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.mip_era = 'CMIP6'
+        ds.activity_id = 'CMIP'
+        ds.institution_id = 'MOHC'
+        ds.tracking_id = tracking_id
+        ds.createDimension('t', 1)
+        ds.createVariable('tas', 'f4', ('t',))[:] = [value]
+
+
+@pytest.fixture
+def previous(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = os.path.join(_dataset_dir, 'v20200101', _name)
+    _write_file(path, 'hdl:21.14100/1')
+    return path
+
+
+def _restructure(checksum=False):
+    restructurer = Restructurer(directory='out', version=20210101,
+                                link_unchanged=True, link_checksum=checksum)
+    plan = restructurer.plan(['landing'])
+    restructurer.execute(plan)
+    return plan, os.path.join(_dataset_dir, 'v20210101', _name)
+
+
+def test_unchanged_file_is_linked(previous):
+    _write_file(os.path.join('landing', _name), 'hdl:21.14100/1')
+    plan, target = _restructure()
+    assert len(plan.links) == 1
+    assert os.path.samefile(previous, target)
+    assert not os.path.exists(os.path.join('landing', _name))
+
+
+def test_other_tracking_id_is_moved(previous):
+    _write_file(os.path.join('landing', _name), 'hdl:21.14100/2')
+    plan, target = _restructure()
+    assert not plan.links
+    assert not os.path.samefile(previous, target)
+
+
+def test_checksum_catches_changed_contents(previous):
+    # (same name, size and tracking_id, but different data)
+    _write_file(os.path.join('landing', _name), 'hdl:21.14100/1', value=2.)
+    plan, target = _restructure(checksum=True)
+    assert not plan.links
+    assert not os.path.samefile(previous, target)
+    with netCDF4.Dataset(target) as ds:
+        assert ds.variables['tas'][0] == 2.